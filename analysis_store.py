@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+analysis_store.py - persistent local store of tone and summary results
+
+One row per analyzed message (Message-ID, sender, subject, received date,
+urgency, label, score, emotions, summary and the models that produced them) in
+a SQLite database, with an FTS5 index over subject and summary kept in sync by
+triggers. Tone and summary results for the same message arrive separately and
+are merged into one row by an upsert that never overwrites a field with NULL.
+
+Writes are buffered and committed in batches through a single cached prepared
+statement (sqlite3 keeps it compiled), in WAL mode with synchronous=NORMAL, so
+the per-message cost is tens of microseconds rather than a commit per row.
+
+    python analysis_store.py query --urgency high --sender alice@example.com --since week
+    python analysis_store.py search "invoice overdue" --since 30d
+    python analysis_store.py stats
+
+Database path: --db, else WHISPRMAIL_STORE, else ~/.whisprmail/analysis.db.
+tone_analyzer.py and summarizer.py record their result with --store when their
+--json input carries a message_id; worker_server.py and backfill.py take --store too.
+"""
+
+import sys
+import os
+import re
+import json
+import time
+import atexit
+import sqlite3
+import argparse
+import threading
+import email.utils
+from datetime import datetime, timedelta, timezone
+
+DEFAULT_STORE_PATH = os.path.join(os.path.expanduser("~"), ".whisprmail", "analysis.db")
+DEFAULT_BATCH_SIZE = 256
+URGENCY_LEVELS = ("low", "medium", "high")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY,
+    message_id TEXT NOT NULL UNIQUE,
+    sender TEXT,
+    sender_address TEXT,
+    subject TEXT,
+    received_at TEXT,
+    urgency TEXT,
+    label TEXT,
+    score REAL,
+    emotions TEXT,
+    context_type TEXT,
+    reason TEXT,
+    summary TEXT,
+    tone_model TEXT,
+    summary_model TEXT,
+    analyzed_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS analyses_by_sender ON analyses(sender_address, received_at);
+CREATE INDEX IF NOT EXISTS analyses_by_urgency ON analyses(urgency, received_at);
+CREATE INDEX IF NOT EXISTS analyses_by_date ON analyses(received_at);
+"""
+
+# External-content FTS5 table: the text lives once, in analyses
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS analyses_fts USING fts5(
+    subject, summary, content='analyses', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS analyses_fts_insert AFTER INSERT ON analyses BEGIN
+    INSERT INTO analyses_fts(rowid, subject, summary) VALUES (new.id, new.subject, new.summary);
+END;
+CREATE TRIGGER IF NOT EXISTS analyses_fts_delete AFTER DELETE ON analyses BEGIN
+    INSERT INTO analyses_fts(analyses_fts, rowid, subject, summary) VALUES ('delete', old.id, old.subject, old.summary);
+END;
+CREATE TRIGGER IF NOT EXISTS analyses_fts_update AFTER UPDATE OF subject, summary ON analyses BEGIN
+    INSERT INTO analyses_fts(analyses_fts, rowid, subject, summary) VALUES ('delete', old.id, old.subject, old.summary);
+    INSERT INTO analyses_fts(rowid, subject, summary) VALUES (new.id, new.subject, new.summary);
+END;
+"""
+
+COLUMNS = ("message_id", "sender", "sender_address", "subject", "received_at", "urgency", "label", "score",
+           "emotions", "context_type", "reason", "summary", "tone_model", "summary_model", "analyzed_at")
+
+# A later partial result (summary only, tone only) fills in fields without blanking the others
+UPSERT_SQL = (
+    f"INSERT INTO analyses ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)}) "
+    "ON CONFLICT(message_id) DO UPDATE SET "
+    + ", ".join(f"{name} = COALESCE(excluded.{name}, {name})" for name in COLUMNS[1:])
+)
+
+_RELATIVE = re.compile(r"^(\d+)\s*([hdw])$")
+
+def store_path(path=None):
+    return path or os.environ.get("WHISPRMAIL_STORE", DEFAULT_STORE_PATH)
+
+def timestamp(value):
+    """ISO-8601 UTC to the second, so stored dates compare correctly as strings"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        value = datetime.fromtimestamp(value, timezone.utc)
+    elif isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            try:
+                value = email.utils.parsedate_to_datetime(value)
+            except (TypeError, ValueError, IndexError):
+                return None
+    if value.tzinfo is None:
+        value = value.astimezone()  # naive means local time
+    return value.astimezone(timezone.utc).isoformat(timespec="seconds")
+
+def parse_since(value, now=None):
+    """'today', 'week', 'month', '24h' / '7d' / '2w', or an ISO date, as a UTC timestamp"""
+    now = (now or datetime.now(timezone.utc)).astimezone()
+    value = value.strip().lower()
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if value == "today":
+        return timestamp(midnight)
+    if value == "week":
+        return timestamp(midnight - timedelta(days=midnight.weekday()))
+    if value == "month":
+        return timestamp(midnight.replace(day=1))
+    match = _RELATIVE.match(value)
+    if match:
+        amount, unit = int(match.group(1)), match.group(2)
+        return timestamp(now - {"h": timedelta(hours=amount), "d": timedelta(days=amount),
+                                "w": timedelta(weeks=amount)}[unit])
+    parsed = timestamp(value)
+    if parsed is None:
+        raise ValueError(f"Unrecognized date: {value!r}")
+    return parsed
+
+def record_once(path, message_id, sender=None, subject=None, received_at=None, tone=None, summary=None,
+                summary_model=None):
+    """Record one message's result and commit it, for the one-shot CLIs; False if the write failed"""
+    try:
+        with AnalysisStore(path or None) as store:
+            store.record(message_id, sender, subject, received_at, tone=tone, summary=summary,
+                         summary_model=summary_model)
+        return True
+    except (ValueError, sqlite3.Error, OSError) as e:
+        print(f"Could not record analysis: {e}", file=sys.stderr)
+        return False
+
+def _fts_query(text):
+    """User text as an FTS5 query: every word must appear, FTS syntax characters are literal"""
+    words = re.findall(r"\w+", text, re.UNICODE)
+    return " ".join(f'"{word}"' for word in words)
+
+class AnalysisStore:
+    """Buffered writer and query interface over one analysis database"""
+
+    def __init__(self, path=None, batch_size=DEFAULT_BATCH_SIZE):
+        self.path = store_path(path)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        # The periodic flusher commits from its own thread; _lock serializes every use
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA busy_timeout=5000")
+        self.connection.executescript(SCHEMA)
+        try:
+            self.connection.executescript(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError as e:
+            # SQLite built without FTS5: search falls back to LIKE scans
+            print(f"FTS5 unavailable ({e}), full-text search will scan", file=sys.stderr)
+            self.fts = False
+        self.batch_size = batch_size
+        self._pending = []
+        self._lock = threading.RLock()
+        self._flusher = None
+
+    def record(self, message_id, sender=None, subject=None, received_at=None, tone=None,
+               summary=None, summary_model=None):
+        """Queue one message's results; tone is a tone_analyzer result dict"""
+        if not message_id:
+            raise ValueError("message_id is required")
+        tone = tone or {}
+        emotions = tone.get("all_emotions_detected")
+        address = email.utils.parseaddr(sender)[1].lower() if sender else None
+        row = (
+            message_id, sender or None, address or None, subject or None, timestamp(received_at),
+            tone.get("urgency"), tone.get("label"), tone.get("score"),
+            json.dumps(emotions) if emotions else None, tone.get("context_type"), tone.get("reason"),
+            summary or None, tone.get("analysis_source"), summary_model if summary else None,
+            timestamp(datetime.now(timezone.utc))
+        )
+        with self._lock:
+            self._pending.append(row)
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        """Commit every queued row in one transaction; returns how many were written"""
+        with self._lock:
+            rows, self._pending = self._pending, []
+            if not rows:
+                return 0
+            with self.connection:
+                self.connection.executemany(UPSERT_SQL, rows)
+            return len(rows)
+
+    def flush_periodically(self, interval):
+        """Daemon thread that flushes every interval seconds, plus a flush at exit"""
+        if self._flusher:
+            return
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.flush()
+                except sqlite3.Error as e:
+                    print(f"Could not write analysis store: {e}", file=sys.stderr)
+        self._flusher = threading.Thread(target=loop, name="analysis-store-flush", daemon=True)
+        self._flusher.start()
+        atexit.register(self.flush)
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def query(self, urgency=None, sender=None, since=None, until=None, text=None, label=None, limit=50):
+        """Newest-first rows matching every given filter (limit=-1 for all)"""
+        self.flush()
+        clauses, params = [], []
+        if urgency:
+            clauses.append("a.urgency = ?")
+            params.append(urgency)
+        if label:
+            clauses.append("a.label = ?")
+            params.append(label.upper())
+        if sender:
+            if "@" in sender:
+                clauses.append("a.sender_address = ?")
+                params.append(sender.lower())
+            else:
+                clauses.append("a.sender LIKE ?")
+                params.append(f"%{sender}%")
+        if since:
+            clauses.append("COALESCE(a.received_at, a.analyzed_at) >= ?")
+            params.append(since)
+        if until:
+            clauses.append("COALESCE(a.received_at, a.analyzed_at) < ?")
+            params.append(until)
+
+        source = "analyses a"
+        if text:
+            if self.fts:
+                source = "analyses_fts JOIN analyses a ON a.id = analyses_fts.rowid"
+                clauses.append("analyses_fts MATCH ?")
+                params.append(_fts_query(text))
+            else:
+                for word in re.findall(r"\w+", text):
+                    clauses.append("(a.subject LIKE ? OR a.summary LIKE ?)")
+                    params.extend([f"%{word}%"] * 2)
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = (f"SELECT a.* FROM {source} {where} "
+               "ORDER BY COALESCE(a.received_at, a.analyzed_at) DESC LIMIT ?")
+        with self._lock:
+            cursor = self.connection.execute(sql, params + [limit])
+            names = [d[0] for d in cursor.description]
+            rows = [dict(zip(names, row)) for row in cursor]
+        for row in rows:
+            del row["id"]
+            if row["emotions"]:
+                row["emotions"] = json.loads(row["emotions"])
+        return rows
+
+    def get(self, message_ids):
+        """{message_id: row} for the given ids that are stored"""
+        self.flush()
+        rows = {}
+        message_ids = list(message_ids)
+        with self._lock:
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(message_ids), 500):
+                chunk = message_ids[start:start + 500]
+                cursor = self.connection.execute(
+                    f"SELECT * FROM analyses WHERE message_id IN ({', '.join('?' for _ in chunk)})", chunk)
+                names = [d[0] for d in cursor.description]
+                for values in cursor:
+                    row = dict(zip(names, values))
+                    del row["id"]
+                    if row["emotions"]:
+                        row["emotions"] = json.loads(row["emotions"])
+                    rows[row["message_id"]] = row
+        return rows
+
+    def stats(self):
+        """Row count, urgency breakdown and date range"""
+        self.flush()
+        with self._lock:
+            total, first, last = self.connection.execute(
+                "SELECT COUNT(*), MIN(received_at), MAX(received_at) FROM analyses").fetchone()
+            by_urgency = dict(self.connection.execute(
+                "SELECT COALESCE(urgency, 'unanalyzed'), COUNT(*) FROM analyses GROUP BY 1"))
+            summarized = self.connection.execute(
+                "SELECT COUNT(*) FROM analyses WHERE summary IS NOT NULL").fetchone()[0]
+        return {"messages": total, "summarized": summarized, "by_urgency": by_urgency,
+                "oldest": first, "newest": last, "fts": self.fts, "path": self.path}
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the WhisprMail analysis store")
+    parser.add_argument("--db", default=None, help=f"database path (default: WHISPRMAIL_STORE or {DEFAULT_STORE_PATH})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    for name in ("query", "search"):
+        command = commands.add_parser(name, help="filter stored analyses" if name == "query"
+                                      else "full-text search over subjects and summaries")
+        if name == "search":
+            command.add_argument("text", help="words that must all appear in the subject or summary")
+        command.add_argument("--urgency", choices=URGENCY_LEVELS)
+        command.add_argument("--label", help="tone label, e.g. NEGATIVE")
+        command.add_argument("--sender", help="exact address, or part of the sender name")
+        command.add_argument("--since", help="'today', 'week', 'month', 24h, 7d, 2w or an ISO date")
+        command.add_argument("--until", help="same forms as --since")
+        command.add_argument("--limit", type=int, default=50)
+    commands.add_parser("stats", help="row counts and date range")
+    args = parser.parse_args()
+
+    try:
+        with AnalysisStore(args.db) as store:
+            if args.command == "stats":
+                result = {"success": True, **store.stats()}
+            else:
+                rows = store.query(
+                    urgency=args.urgency, label=args.label, sender=args.sender,
+                    since=parse_since(args.since) if args.since else None,
+                    until=parse_since(args.until) if args.until else None,
+                    text=getattr(args, "text", None), limit=args.limit)
+                result = {"success": True, "count": len(rows), "results": rows}
+    except (ValueError, sqlite3.Error) as e:
+        result = {"success": False, "error": str(e)}
+    print(json.dumps(result, ensure_ascii=False))
+    if not result["success"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
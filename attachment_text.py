@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+attachment_text.py - extract text from email attachments for tone and summary
+
+Each attachment is extracted in its own short-lived child process that gets the
+file's bytes on stdin and prints JSON, so a malformed or hostile PDF or Office
+file can only take down its child. On POSIX the child runs under resource
+limits (address space, CPU seconds, no file writes), and every child is killed
+after a per-file timeout.
+
+On Windows, the platform the packaged app ships its Python for, there are no
+rlimits. The child gets no memory, CPU or file-write limit, only the timeout, and
+that timeout is halved there (5 s unless set). The size, page and member-byte
+caps below still bound what a single file can make the parser do. Children run in parallel, files over the size limit
+or of unsupported types are skipped, and extraction is streamed: PDFs stop
+after a page limit, Office XML is parsed incrementally, and every extractor
+stops once the text budget (html_text.DEFAULT_MAX_CHARS) is filled.
+
+Supported: PDF, DOCX, PPTX, XLSX (shared strings), HTML and plain text types.
+PDF needs the optional pypdf package. Without it, PDFs get an "unavailable" report
+without starting a child, and the output lists pdf under "unavailable" so the app
+can tell the user once and stop downloading them.
+
+    python attachment_text.py report.pdf minutes.docx
+    echo '[{"filename": "a.pdf", "mime_type": "application/pdf", "data": "<base64>"}]' | \\
+        python attachment_text.py --json
+
+Limits: WHISPRMAIL_ATTACHMENT_TIMEOUT (seconds per file, default 10; 5 on Windows),
+WHISPRMAIL_ATTACHMENT_MAX_MB (default 10), WHISPRMAIL_ATTACHMENT_MAX_PAGES
+(default 20), WHISPRMAIL_ATTACHMENT_MEMORY_MB (default 512).
+"""
+
+import sys
+import os
+import io
+import re
+import json
+import time
+import base64
+import zipfile
+import argparse
+import subprocess
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+
+import html_text
+
+# Without rlimits (Windows) the timeout is the only bound on a hostile file, so it is tighter
+TIMEOUT_SECONDS = float(os.environ.get("WHISPRMAIL_ATTACHMENT_TIMEOUT", "10" if os.name == "posix" else "5"))
+MAX_FILE_BYTES = int(float(os.environ.get("WHISPRMAIL_ATTACHMENT_MAX_MB", "10")) * 1024 * 1024)
+MAX_PAGES = int(os.environ.get("WHISPRMAIL_ATTACHMENT_MAX_PAGES", "20"))
+MEMORY_LIMIT_BYTES = int(os.environ.get("WHISPRMAIL_ATTACHMENT_MEMORY_MB", "512")) * 1024 * 1024
+MAX_ATTACHMENTS = 5
+MAX_PARALLEL = 4
+# Office members together expanding past this are treated as zip bombs
+MAX_UNCOMPRESSED_BYTES = 100 * 1024 * 1024
+
+OOXML = "application/vnd.openxmlformats-officedocument"
+KINDS_BY_MIME_TYPE = {
+    "application/pdf": "pdf",
+    f"{OOXML}.wordprocessingml.document": "docx",
+    f"{OOXML}.presentationml.presentation": "pptx",
+    f"{OOXML}.spreadsheetml.sheet": "xlsx",
+    "text/html": "html",
+    "text/plain": "text",
+    "text/csv": "text",
+    "text/markdown": "text",
+    "text/calendar": "text",
+    "application/json": "text",
+}
+KINDS_BY_EXTENSION = {
+    ".pdf": "pdf", ".docx": "docx", ".pptx": "pptx", ".xlsx": "xlsx", ".html": "html", ".htm": "html",
+    ".txt": "text", ".csv": "text", ".md": "text", ".log": "text", ".ics": "text", ".json": "text",
+}
+
+def kind_for(filename, mime_type=None):
+    """Extractor name for an attachment, or None when its type is not supported"""
+    kind = KINDS_BY_MIME_TYPE.get((mime_type or "").split(";")[0].strip().lower())
+    if kind is None:
+        kind = KINDS_BY_EXTENSION.get(os.path.splitext(filename or "")[1].lower())
+    return kind
+
+class TextBudget:
+    """Collects whitespace-collapsed text until max_chars are gathered"""
+
+    def __init__(self, max_chars):
+        self.max_chars = max_chars
+        self.parts = []
+        self.length = 0
+
+    @property
+    def full(self):
+        return self.length >= self.max_chars
+
+    def add(self, text):
+        text = " ".join((text or "").split())
+        if text and not self.full:
+            self.parts.append(text)
+            self.length += len(text) + 1
+
+    def text(self):
+        return " ".join(self.parts)[:self.max_chars]
+
+# --- Extractors, run inside the sandboxed child ---
+
+def extract_pdf(data, budget):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise RuntimeError("PDF extraction needs pypdf (pip install pypdf)")
+    reader = PdfReader(io.BytesIO(data))
+    pages = 0
+    for page in reader.pages[:MAX_PAGES]:
+        budget.add(page.extract_text() or "")
+        pages += 1
+        if budget.full:
+            break
+    return {"pages": pages, "total_pages": len(reader.pages)}
+
+def _office_members(archive, kind):
+    names = archive.namelist()
+    if kind == "docx":
+        return [name for name in ("word/document.xml",) if name in names]
+    if kind == "pptx":
+        slides = [name for name in names if re.fullmatch(r"ppt/slides/slide\d+\.xml", name)]
+        return sorted(slides, key=lambda name: int(re.search(r"\d+", name).group()))
+    return [name for name in ("xl/sharedStrings.xml",) if name in names]
+
+class CappedReader:
+    """File-like view of a zip member that fails once the archive's running total passes the cap
+
+    The sizes in the zip directory are written by whoever built the file, so
+    the decompressed bytes themselves are counted.
+    """
+
+    def __init__(self, stream, counter):
+        self.stream = stream
+        self.counter = counter
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.counter[0] += len(data)
+        if self.counter[0] > MAX_UNCOMPRESSED_BYTES:
+            raise RuntimeError(f"archive expands past {MAX_UNCOMPRESSED_BYTES // (1024 * 1024)} MB")
+        return data
+
+def extract_office(data, budget, kind):
+    """Text runs (<w:t>, <a:t>, <t>) of an Office Open XML file, parsed incrementally"""
+    members = 0
+    # Decompressed bytes read so far, across every member
+    expanded = [0]
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        for name in _office_members(archive, kind):
+            run = []
+            with archive.open(name) as stream:
+                for _, element in ElementTree.iterparse(CappedReader(stream, expanded)):
+                    tag = element.tag.rsplit("}", 1)[-1]
+                    if tag == "t":
+                        run.append(element.text or "")
+                    elif tag in ("p", "si", "br", "tab"):
+                        # Paragraph or cell boundary
+                        run.append(" ")
+                        if tag in ("p", "si"):
+                            budget.add("".join(run))
+                            run = []
+                            if budget.full:
+                                break
+                    element.clear()
+            budget.add("".join(run))
+            members += 1
+            if budget.full:
+                break
+    return {"parts": members}
+
+def _decode(data):
+    if data.startswith((b"\xff\xfe", b"\xfe\xff")):
+        return data.decode("utf-16", errors="replace")
+    return data.decode("utf-8-sig", errors="replace")
+
+def extract(kind, data, max_chars):
+    """Extract one attachment's text in the current process"""
+    budget = TextBudget(max_chars)
+    if kind == "pdf":
+        details = extract_pdf(data, budget)
+    elif kind in ("docx", "pptx", "xlsx"):
+        details = extract_office(data, budget, kind)
+    elif kind == "html":
+        # Markup is mostly not text, so allow more input than characters wanted
+        budget.add(html_text.html_to_text(_decode(data[:max_chars * 64]), max_chars))
+        details = {}
+    elif kind == "text":
+        budget.add(_decode(data[:max_chars * 4]))
+        details = {}
+    else:
+        raise RuntimeError(f"Unsupported attachment type: {kind}")
+    text = budget.text()
+    return {"success": True, "text": text, "chars": len(text), "truncated": budget.full, **details}
+
+def limit_resources():
+    """Cap the child's memory and CPU time and forbid file writes (POSIX only)"""
+    if os.name != "posix":
+        return
+    import resource
+    resource.setrlimit(resource.RLIMIT_AS, (MEMORY_LIMIT_BYTES, MEMORY_LIMIT_BYTES))
+    cpu_seconds = int(TIMEOUT_SECONDS) + 1
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (0, 0))
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+
+def run_child(kind):
+    """--extract-one: read the file on stdin, print its text as JSON"""
+    # Limits go on before any untrusted byte is parsed (preexec_fn is unsafe with the parent's threads)
+    limit_resources()
+    data = sys.stdin.buffer.read(MAX_FILE_BYTES + 1)
+    try:
+        result = extract(kind, data, int(os.environ.get("WHISPRMAIL_ATTACHMENT_MAX_CHARS",
+                                                        html_text.DEFAULT_MAX_CHARS)))
+    except MemoryError:
+        result = {"success": False, "error": "Memory limit exceeded"}
+    except Exception as e:
+        result = {"success": False, "error": f"{type(e).__name__}: {e}"}
+    print(json.dumps(result))
+
+# --- Parent: one sandboxed child per attachment ---
+
+def extract_sandboxed(kind, data, max_chars, timeout=None):
+    """Extract one attachment in a resource-limited child process"""
+    timeout = TIMEOUT_SECONDS if timeout is None else timeout
+    env = {**os.environ, "WHISPRMAIL_ATTACHMENT_MAX_CHARS": str(max_chars)}
+    try:
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--extract-one", kind],
+            input=data, capture_output=True, timeout=timeout, env=env)
+    except subprocess.TimeoutExpired:
+        return {"success": False, "error": f"Timed out after {timeout:g}s"}
+    try:
+        return json.loads(completed.stdout)
+    except ValueError:
+        # Killed by a limit before it could answer
+        return {"success": False, "error": f"Extractor exited with code {completed.returncode}"}
+
+def unavailable_kinds():
+    """{kind: reason} for supported types whose optional extractor is not installed"""
+    import importlib.util
+    if importlib.util.find_spec("pypdf") is None:
+        return {"pdf": "PDF extraction unavailable: install pypdf (pip install pypdf)"}
+    return {}
+
+def extract_attachments(attachments, max_chars=None, timeout=None):
+    """Extract [{"filename", "mime_type", "data": bytes}] in parallel children.
+
+    Returns (combined text within max_chars, per-attachment reports in input order).
+    """
+    max_chars = html_text.DEFAULT_MAX_CHARS if max_chars is None else max_chars
+    reports = []
+    jobs = []
+    unavailable = unavailable_kinds()
+    for attachment in attachments:
+        filename = attachment.get("filename") or "attachment"
+        kind = kind_for(filename, attachment.get("mime_type"))
+        report = {"filename": filename, "kind": kind}
+        reports.append(report)
+        if kind is None:
+            report.update(success=False, error="Unsupported type")
+        elif kind in unavailable:
+            report.update(success=False, error=unavailable[kind])
+        elif len(attachment["data"]) > MAX_FILE_BYTES:
+            report.update(success=False, error=f"Larger than {MAX_FILE_BYTES // (1024 * 1024)} MB")
+        elif len(jobs) >= MAX_ATTACHMENTS:
+            report.update(success=False, error=f"Only the first {MAX_ATTACHMENTS} attachments are read")
+        else:
+            jobs.append((report, kind, attachment["data"]))
+
+    texts = {}
+    if jobs:
+        with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL, len(jobs))) as pool:
+            futures = [(report, pool.submit(extract_sandboxed, kind, data, max_chars, timeout))
+                       for report, kind, data in jobs]
+            for report, future in futures:
+                result = future.result()
+                text = result.pop("text", "")
+                report.update(result)
+                if text:
+                    texts[id(report)] = f"[Attachment {report['filename']}] {text}"
+
+    # Earlier attachments get the budget first
+    combined = "\n\n".join(texts[id(report)] for report in reports if id(report) in texts)
+    return combined[:max_chars], reports
+
+def combined_text(text, html=None, attachments=None):
+    """Analysis input: plain text, then the HTML body's visible text, then attachment text"""
+    parts = [text or ""]
+    if html:
+        parts.append(html_text.html_to_text(html))
+    if attachments:
+        parts.append(attachments)
+    return "\n\n".join(part.strip() for part in parts if part and part.strip())
+
+def read_inputs(args):
+    """[{"filename", "mime_type", "data": bytes}] from --json stdin or file paths"""
+    if args.json:
+        inputs = []
+        for item in json.loads(sys.stdin.read() or "[]"):
+            # Gmail returns attachment data as URL-safe base64, often unpadded
+            data = item.get("data") or ""
+            data = base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+            inputs.append({"filename": item.get("filename"), "mime_type": item.get("mime_type"), "data": data})
+        return inputs
+    inputs = []
+    for path in args.files:
+        with open(path, "rb") as f:
+            inputs.append({"filename": os.path.basename(path), "mime_type": None,
+                           "data": f.read(MAX_FILE_BYTES + 1)})
+    return inputs
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract text from email attachments for tone and summary")
+    parser.add_argument("files", nargs="*", help="attachment files to read")
+    parser.add_argument("--json", action="store_true",
+                        help='stdin is [{"filename": ..., "mime_type": ..., "data": <base64>}, ...]')
+    parser.add_argument("--max-chars", type=int, default=None,
+                        help=f"text budget across all attachments (default {html_text.DEFAULT_MAX_CHARS})")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help=f"seconds allowed per attachment (default {TIMEOUT_SECONDS:g})")
+    parser.add_argument("--extract-one", metavar="KIND", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.extract_one:
+        run_child(args.extract_one)
+        return
+    start = time.perf_counter()
+    try:
+        inputs = read_inputs(args)
+    except (OSError, ValueError) as e:
+        print(json.dumps({"success": False, "error": f"Could not read attachments: {e}"}))
+        return
+    text, reports = extract_attachments(inputs, args.max_chars, args.timeout)
+    print(json.dumps({"success": True, "text": text, "attachments": reports, "unavailable": unavailable_kinds(),
+                      "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)}))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,521 @@
+#!/usr/bin/env python3
+"""
+backfill.py - offline triage of a local mbox or Maildir archive
+
+Streams messages from mbox files or Maildir directories (no Gmail access),
+extracts the body the way main.js's processEmailContent does (first text/plain
+part, otherwise the first text/html part reduced to text by html_text), runs
+tone analysis in large chunks across worker processes (tone_pool), optionally
+summarizes, and
+writes one row per message to a SQLite database (and, with --store, to the
+searchable analysis store, and with --embed, to the embedding index).
+
+Progress is durable: each chunk's rows and its completion records are committed
+together (SQLite in WAL mode), keyed by Message-ID and a hash of the analysis
+configuration. Re-running the same command after a crash skips everything that
+was already analyzed under that configuration without fully parsing it, so a
+restart costs a pass over the headers rather than the whole job; changing the
+model or lexicon changes the hash and re-analyzes.
+
+    python backfill.py ~/Mail/archive.mbox --output triage.db
+    python backfill.py ~/Maildir --summarize --workers 4
+    python backfill.py archive.mbox --rules-only --limit 10000
+    python backfill.py ~/Maildir --store --embed    # searchable store + "more like this"
+"""
+
+import sys
+import os
+import re
+import json
+import time
+import hashlib
+import email
+import email.policy
+import email.utils
+import mailbox
+import sqlite3
+import argparse
+from datetime import datetime, timezone
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import tone_analyzer
+import tone_pool
+import runtime_config
+import analysis_store
+import near_duplicates
+import sender_priors
+import html_text
+import language_id
+
+DEFAULT_OUTPUT = "backfill.db"
+DEFAULT_CHUNK_SIZE = 1024
+# main.js returns text shorter than this unsummarized
+MIN_SUMMARY_CHARS = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    mailbox TEXT NOT NULL,
+    message_key TEXT NOT NULL,
+    message_id TEXT,
+    sender TEXT,
+    subject TEXT,
+    date TEXT,
+    urgency TEXT,
+    label TEXT,
+    score REAL,
+    reason TEXT,
+    analysis_source TEXT,
+    context_type TEXT,
+    summary TEXT,
+    text_length INTEGER,
+    attachments TEXT,
+    analyzed_at TEXT,
+    config_hash TEXT,
+    language TEXT,
+    PRIMARY KEY (mailbox, message_key)
+);
+CREATE TABLE IF NOT EXISTS progress (
+    message_ref TEXT NOT NULL,
+    config_hash TEXT NOT NULL,
+    completed_at TEXT,
+    PRIMARY KEY (message_ref, config_hash)
+);
+"""
+
+_MESSAGE_ID = re.compile(rb"^message-id:[ \t]*(.*?)[ \t]*\r?$", re.IGNORECASE | re.MULTILINE)
+
+def open_mailbox(path):
+    """A Maildir for a directory with cur/new subdirectories, otherwise an mbox file"""
+    if os.path.isdir(path):
+        if not os.path.isdir(os.path.join(path, "cur")) and not os.path.isdir(os.path.join(path, "new")):
+            raise ValueError(f"{path} is a directory but not a Maildir (no cur/ or new/)")
+        return mailbox.Maildir(path, factory=None, create=False)
+    if not os.path.isfile(path):
+        raise ValueError(f"{path} does not exist")
+    return mailbox.mbox(path, create=False)
+
+def iter_raw_messages(box, path):
+    """Yield (key, raw bytes) one at a time so an archive never has to fit in memory"""
+    for key in box.iterkeys():
+        try:
+            yield str(key), box.get_bytes(key)
+        except (OSError, KeyError) as e:
+            print(f"Skipping message {key} in {path}: {e}", file=sys.stderr)
+
+def message_ref(path, key, raw):
+    """Stable identity for resume: the Message-ID header, else mailbox path and key"""
+    headers = raw.split(b"\n\n", 1)[0].split(b"\r\n\r\n", 1)[0]
+    match = _MESSAGE_ID.search(headers)
+    if match and match.group(1):
+        return match.group(1).decode("utf-8", errors="replace")
+    return f"{os.path.abspath(path)}#{key}"
+
+def config_hash(tone_source, summary_model=None):
+    """Short hash of everything that changes the stored results"""
+    config = {
+        "tone": tone_source,
+        # The rules tier's output depends on its lexicon
+        "lexicon": tone_analyzer.LEXICON if tone_source == "simple_rules" else None,
+        # With the model, bulk mail is labelled by its headers instead
+        "header_rules": tone_analyzer.HEADER_RULES_VERSION if tone_source != "simple_rules" else None,
+        # HTML-only bodies are analyzed as html_text extracts them
+        "html_text": html_text.EXTRACTOR_VERSION,
+        # Which languages reach which model
+        "language_id": language_id.LANGUAGE_ID_VERSION,
+        "tone_routes": language_id.routes_for("tone"),
+        "summary_routes": language_id.routes_for("summarize") if summary_model else None,
+        "summary": summary_model
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+def _part_text(part):
+    try:
+        return part.get_content()
+    except (LookupError, ValueError, AssertionError):
+        # Unknown charset or broken transfer encoding: decode what we can
+        payload = part.get_payload(decode=True) or b""
+        return payload.decode("utf-8", errors="replace")
+
+def extract_content(message):
+    """(text_content, html_content, attachments) with processEmailContent's preferences"""
+    text_content = ""
+    html_content = ""
+    attachments = []
+    for part in message.walk():
+        if part.is_multipart():
+            continue
+        content_type = part.get_content_type()
+        filename = part.get_filename()
+        if part.get_content_disposition() == "attachment" or (filename and content_type not in ("text/plain", "text/html")):
+            payload = part.get_payload(decode=True) or b""
+            attachments.append({"filename": filename, "mimeType": content_type, "size": len(payload)})
+        elif content_type == "text/plain" and not text_content:
+            # Only the first of several text/plain parts, as in main.js
+            text_content = _part_text(part)
+        elif content_type == "text/html" and not html_content:
+            html_content = _part_text(part)
+
+    if html_content and not text_content:
+        text_content = html_text.html_to_text(html_content)
+    text_content = re.sub(r"\[image:.*?\]", "", text_content, flags=re.IGNORECASE)
+    text_content = re.sub(r"\s+", " ", text_content).strip()
+    return text_content, html_content, attachments
+
+def parse_message(key, raw):
+    """The fields backfill stores plus the text main.js would send for analysis"""
+    message = email.message_from_bytes(raw, policy=email.policy.default)
+    subject = str(message.get("Subject", "") or "") or "No Subject"
+    from_header = str(message.get("From", "") or "")
+    sender = email.utils.parseaddr(from_header)[1].lower() or from_header
+    date = None
+    try:
+        parsed = email.utils.parsedate_to_datetime(str(message.get("Date", "")))
+        date = parsed.astimezone(timezone.utc).isoformat() if parsed.tzinfo else parsed.isoformat()
+    except (TypeError, ValueError, IndexError):
+        pass
+    text_content, _, attachments = extract_content(message)
+    return {
+        "message_key": key,
+        "message_id": str(message.get("Message-ID", "") or "").strip() or None,
+        "sender": sender,
+        "subject": subject,
+        "date": date,
+        "body": text_content,
+        # Same string main.js passes to tone_analyzer.py
+        "content": f"{subject}\n\n{text_content}".strip(),
+        "attachments": attachments,
+        # Only the headers tone_analyzer.header_precheck looks at
+        "headers": {name: str(message[name]) for name in tone_analyzer.BULK_HEADERS if message[name] is not None}
+    }
+
+# --- Summarization pool (one pipeline per worker process, loaded once) ---
+
+_summarizer = None
+
+def _init_summarizer(config, core_slices, counter):
+    """Worker initializer: take the next free core slice, then load the summarization pipeline"""
+    global _summarizer
+    import summarizer
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    cores = core_slices[index % len(core_slices)]
+    runtime_config.apply_thread_settings(config, cores=cores, threads=len(cores))
+    _summarizer = summarizer.load_summarizer_pipeline()
+
+def _summarize_chunk(texts):
+    import summarizer
+    return [summarizer.summarize_text_bart(text, _summarizer) for text in texts]
+
+def start_summary_pool(num_workers):
+    import multiprocessing
+    config = runtime_config.load_runtime_config("summarize")
+    cores = config["cpu_affinity"] or runtime_config.available_cores()
+    ctx = multiprocessing.get_context("spawn")
+    counter = ctx.Value("i", 0)
+    return ProcessPoolExecutor(max_workers=num_workers, mp_context=ctx, initializer=_init_summarizer,
+                               initargs=(config, runtime_config.split_cores(num_workers, cores), counter))
+
+def summarize_all(pool, texts, num_workers):
+    """Summaries (or None for short texts) in input order, split across the pool"""
+    summaries = [None] * len(texts)
+    todo = [i for i, text in enumerate(texts) if len(text) >= MIN_SUMMARY_CHARS]
+    if not todo:
+        return summaries
+    step = max(1, -(-len(todo) // (num_workers * 4)))
+    chunks = [todo[start:start + step] for start in range(0, len(todo), step)]
+    for chunk, results in zip(chunks, pool.map(_summarize_chunk, [[texts[i] for i in chunk] for chunk in chunks])):
+        for index, result in zip(chunk, results):
+            summaries[index] = result.get("summary_text") if result.get("success") else None
+    return summaries
+
+def summarize_with_reuse(reuse, pool, texts, refs, num_workers):
+    """summarize_all, but near duplicates of stored or same-chunk messages are summarized once"""
+    import summarizer
+
+    def summarize(batch):
+        return [{"success": summary is not None, "summary_text": summary}
+                for summary in summarize_all(pool, batch, num_workers)]
+
+    summaries = [None] * len(texts)
+    todo = [i for i, text in enumerate(texts) if len(text) >= MIN_SUMMARY_CHARS]
+    results = near_duplicates.analyze_with_reuse(reuse, "summarize", summarizer.SUMMARY_MODEL_NAME,
+                                                 [texts[i] for i in todo], [refs[i] for i in todo], summarize)
+    for i, result in zip(todo, results):
+        summaries[i] = result.get("summary_text") if result.get("success") else None
+    return summaries
+
+# --- Output ---
+
+def open_output(path):
+    connection = sqlite3.connect(path)
+    # WAL keeps a crash from corrupting committed chunks and lets readers query mid-run
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(messages)")]
+    if columns and "config_hash" not in columns:
+        connection.execute("ALTER TABLE messages ADD COLUMN config_hash TEXT")
+    if columns and "language" not in columns:
+        connection.execute("ALTER TABLE messages ADD COLUMN language TEXT")
+    connection.executescript(SCHEMA)
+    connection.commit()
+    return connection
+
+def completed_refs(connection, current_hash):
+    return {row[0] for row in connection.execute(
+        "SELECT message_ref FROM progress WHERE config_hash = ?", (current_hash,))}
+
+def write_rows(connection, mailbox_path, messages, tones, summaries, current_hash):
+    """Store a chunk's results and mark its messages complete in one transaction"""
+    analyzed_at = datetime.now(timezone.utc).isoformat()
+    rows = [(
+        mailbox_path, message["message_key"], message["message_id"], message["sender"], message["subject"],
+        message["date"], tone.get("urgency"), tone.get("label"), tone.get("score"), tone.get("reason"),
+        tone.get("analysis_source"), tone.get("context_type"), summary, len(message["body"]),
+        json.dumps(message["attachments"]), analyzed_at, current_hash, tone.get("language")
+    ) for message, tone, summary in zip(messages, tones, summaries)]
+    with connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        connection.executemany(
+            "INSERT OR REPLACE INTO progress VALUES (?, ?, ?)",
+            [(message["ref"], current_hash, analyzed_at) for message in messages])
+
+class Progress:
+    """Throughput and ETA for the messages this run actually analyzes"""
+
+    def __init__(self, total):
+        self.total = total
+        self.analyzed = 0
+        self.skipped = 0
+        self.model_skipped = Counter()
+        self.started = time.perf_counter()
+
+    def count_shortcuts(self, tones):
+        """Tally tone results that did not need a model pass"""
+        for tone in tones:
+            if "reused_from" in tone:
+                self.model_skipped["near-duplicate reuse"] += 1
+            elif tone.get("analysis_source") in ("sender_prior", "header_rules"):
+                self.model_skipped[tone["analysis_source"].replace("_", " ")] += 1
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        rate = self.analyzed / elapsed if elapsed else 0.0
+        remaining = max(0, self.total - self.analyzed - self.skipped)
+        eta = f"{remaining / rate / 60:.1f} min" if rate else "unknown"
+        done = self.analyzed + self.skipped
+        shortcuts = "".join(f", {count} by {name}" for name, count in sorted(self.model_skipped.items()))
+        print(f"{done}/{self.total} messages ({self.skipped} already done{shortcuts}), "
+              f"{rate:.1f} msg/s, ETA {eta}", file=sys.stderr)
+
+def iter_chunks(boxes, chunk_size, done, progress, limit=None):
+    """(mailbox_path, [parsed messages]) chunks of not-yet-analyzed messages, up to limit in total"""
+    seen = 0
+    for path, box in boxes:
+        chunk = []
+        for key, raw in iter_raw_messages(box, path):
+            if limit is not None and seen >= limit:
+                break
+            seen += 1
+            ref = message_ref(path, key, raw)
+            if ref in done:
+                progress.skipped += 1
+                continue
+            try:
+                message = parse_message(key, raw)
+            except Exception as e:
+                print(f"Skipping unparsable message {key} in {path}: {e}", file=sys.stderr)
+                progress.skipped += 1
+                continue
+            message["ref"] = ref
+            # Duplicate Message-IDs (the same mail in two folders) are analyzed once
+            done.add(ref)
+            chunk.append(message)
+            if len(chunk) >= chunk_size:
+                yield path, chunk
+                chunk = []
+        if chunk:
+            yield path, chunk
+        if limit is not None and seen >= limit:
+            return
+
+def run_backfill(args):
+    boxes = [(path, open_mailbox(path)) for path in args.paths]
+    total = sum(len(box) for _, box in boxes)
+    if args.limit is not None:
+        total = min(total, args.limit)
+
+    classifier = None
+    if not args.rules_only:
+        classifier = tone_analyzer.load_ai_classifier()
+        if classifier is None:
+            print("AI unavailable, using fallback analysis", file=sys.stderr)
+    summary_model = None
+    if args.summarize:
+        import summarizer
+        summary_model = summarizer.SUMMARY_MODEL_NAME
+    current_hash = config_hash(tone_analyzer.TONE_MODEL_NAME if classifier is not None else "simple_rules",
+                               summary_model)
+
+    connection = open_output(args.output)
+    done = completed_refs(connection, current_hash)
+    if done:
+        print(f"Resuming: {len(done)} messages already analyzed with config {current_hash}", file=sys.stderr)
+
+    store = analysis_store.AnalysisStore(args.store or None) if args.store is not None else None
+    reuse = near_duplicates.open_index(args.reuse or None) if args.reuse is not None else None
+    priors = None
+    if args.priors is not None and classifier is not None:
+        priors = sender_priors.SenderPriors.load(path=args.priors or None)
+    encoder = index = None
+    if args.embed is not None:
+        import embedding_index
+        encoder = embedding_index.Encoder(classifier=classifier)
+        index = embedding_index.open_index(args.embed or None, encoder)
+    summary_workers = args.workers or len(runtime_config.available_cores())
+    pool = start_summary_pool(summary_workers) if args.summarize else None
+    progress = Progress(total)
+
+    def analyze_tones(batch, batch_refs):
+        if reuse:
+            return near_duplicates.analyze_with_reuse(reuse, "tone", tone_analyzer.TONE_MODEL_NAME,
+                                                      batch, batch_refs, run_model)
+        return run_model(batch)
+
+    def run_model(batch):
+        return tone_pool.analyze_batch_parallel(batch, args.workers, args.batch_size, classifier)
+
+    routed_classifiers = {}
+
+    def routed_tones(model, texts):
+        """Tone from a model routed for a language other than English (language_id.py)"""
+        if model not in routed_classifiers:
+            routed_classifiers[model] = tone_analyzer.load_ai_classifier(model_name=model)
+        if routed_classifiers[model] is None:
+            return tone_analyzer.fallback_analysis_batch(texts)
+        results = tone_analyzer.analyze_batch_with_ai(
+            texts, routed_classifiers[model], args.batch_size or runtime_config.load_runtime_config("tone")["batch_size"])
+        for result in results:
+            if result.get("success"):
+                result["analysis_source"] = model
+        return results
+
+    def model_tones(model, messages):
+        texts = [message["content"] for message in messages]
+        if model == language_id.RULES:
+            progress.model_skipped["language routing"] += len(messages)
+            return tone_analyzer.fallback_analysis_batch(texts)
+        if model != tone_analyzer.TONE_MODEL_NAME:
+            return routed_tones(model, texts)
+        refs = [message["ref"] for message in messages]
+        if priors is not None:
+            # Identical texts may share a ref; it only names the source of a reused result
+            ref_by_text = dict(zip(texts, refs))
+            return sender_priors.analyze_with_priors(
+                priors, [message["sender"] for message in messages], [message["subject"] for message in messages],
+                texts, lambda batch: analyze_tones(batch, [ref_by_text[text] for text in batch]))
+        return analyze_tones(texts, refs)
+
+    def tone_results(messages):
+        languages = [language_id.detect(message["content"]) for message in messages]
+        if classifier is None:
+            tones = tone_analyzer.fallback_analysis_batch([message["content"] for message in messages])
+        else:
+            # Bulk mail recognized by its headers never reaches the priors or the model
+            tones = [tone_analyzer.header_precheck(message["content"], message["headers"]) for message in messages]
+            by_model = {}
+            for i, tone in enumerate(tones):
+                if tone is None:
+                    model = language_id.route("tone", languages[i], tone_analyzer.TONE_MODEL_NAME)
+                    by_model.setdefault(model, []).append(i)
+            for model, todo in by_model.items():
+                for i, tone in zip(todo, model_tones(model, [messages[i] for i in todo])):
+                    tones[i] = tone
+        for tone, language in zip(tones, languages):
+            tone["language"] = language
+        return tones
+
+    try:
+        for path, messages in iter_chunks(boxes, args.chunk_size, done, progress, args.limit):
+            texts = [message["content"] for message in messages]
+            refs = [message["ref"] for message in messages]
+            tones = tone_results(messages)
+            if priors is not None:
+                priors.save()
+            summaries = [None] * len(messages)
+            if pool:
+                # Only languages routed to the default summary model are summarized here
+                bodies = [message["body"] if language_id.route("summarize", tone["language"], summary_model)
+                          == summary_model else "" for message, tone in zip(messages, tones)]
+                if reuse:
+                    summaries = summarize_with_reuse(reuse, pool, bodies, refs, summary_workers)
+                else:
+                    summaries = summarize_all(pool, bodies, summary_workers)
+            write_rows(connection, os.path.abspath(path), messages, tones, summaries, current_hash)
+            if store:
+                for message, tone, summary in zip(messages, tones, summaries):
+                    store.record(message["ref"], message["sender"], message["subject"], message["date"],
+                                 tone, summary, summary_model)
+                store.flush()
+            if index is not None:
+                # Same input as embedding_index.py build, so every vector in the index is comparable
+                embedding_index.embed_and_add(
+                    index, encoder, [message["ref"] for message in messages],
+                    [embedding_index.embedding_text(message["subject"], summary)
+                     for message, summary in zip(messages, summaries)])
+
+            progress.analyzed += len(messages)
+            progress.count_shortcuts(tones)
+            progress.report()
+    finally:
+        if pool:
+            pool.shutdown()
+        connection.close()
+        if store:
+            store.close()
+        if reuse:
+            reuse.close()
+        for _, box in boxes:
+            box.close()
+    return {"success": True, "processed": progress.analyzed, "skipped": progress.skipped,
+            "model_skipped": dict(progress.model_skipped),
+            "config_hash": current_hash, "output": args.output,
+            "elapsed_s": round(time.perf_counter() - progress.started, 1)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze a local mbox or Maildir archive into SQLite")
+    parser.add_argument("paths", nargs="+", help="mbox files and/or Maildir directories")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help=f"SQLite database (default: {DEFAULT_OUTPUT})")
+    parser.add_argument("--summarize", action="store_true", help="also summarize each message body")
+    parser.add_argument("--rules-only", action="store_true", help="skip the model and use the keyword rules")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes (default: one per available core)")
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help="texts per forward pass (default: runtime config batch_size)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="messages read, analyzed and committed per step; a crash loses at most one")
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many messages")
+    parser.add_argument("--store", nargs="?", const="", default=None,
+                        help="also record results in the analysis store (default path: WHISPRMAIL_STORE "
+                             "or ~/.whisprmail/analysis.db)")
+    parser.add_argument("--reuse", nargs="?", const="", default=None,
+                        help="analyze near-duplicate messages once and reuse the result (default path: "
+                             "WHISPRMAIL_REUSE_DB or ~/.whisprmail/near_duplicates.db)")
+    parser.add_argument("--priors", nargs="?", const="", default=None,
+                        help="answer from consistent per-sender history instead of the model (default path: "
+                             "WHISPRMAIL_PRIORS_PATH or ~/.whisprmail/sender_priors.npz)")
+    parser.add_argument("--embed", nargs="?", const="", default=None,
+                        help="also add each message to the embedding index (default directory: "
+                             "WHISPRMAIL_EMBEDDINGS or ~/.whisprmail/embeddings)")
+    args = parser.parse_args()
+
+    try:
+        print(json.dumps(run_backfill(args)))
+    except ValueError as e:
+        print(json.dumps({"success": False, "error": str(e)}))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+mail_corpus.py - deterministic synthetic mail shaped like a real inbox
+
+Generates urgent requests, routine work mail, quoted reply threads, thank-you
+notes, automated notifications and HTML newsletters with a long-tailed body
+length distribution. The same seed always yields the same corpus, so replay
+runs on different machines are comparable.
+
+    python benchmarks/mail_corpus.py --count 1000 --seed 7 > corpus.jsonl
+
+Each line: {"id", "category", "sender", "subject", "text", "html", "headers"}
+where "text" is what main.js would send (subject + plain text body) and "html"
+is the raw HTML body for mail that has one.
+"""
+
+import sys
+import json
+import random
+import argparse
+
+# Share of each category in a typical notification-heavy inbox
+CATEGORY_WEIGHTS = {
+    "urgent": 0.08,
+    "routine": 0.22,
+    "reply_thread": 0.15,
+    "thanks": 0.07,
+    "notification": 0.23,
+    "newsletter": 0.25
+}
+
+FIRST_NAMES = ["Alex", "Sam", "Priya", "Jordan", "Mei", "Carlos", "Fatima", "Liam", "Noor", "Elena"]
+COMPANIES = ["acme", "globex", "initech", "umbrella", "hooli", "stark", "wayne", "tyrell"]
+PROJECTS = ["billing migration", "Q3 roadmap", "mobile release", "data warehouse", "security audit"]
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
+
+URGENT_SENTENCES = [
+    "The production server is down and customers cannot log in.",
+    "We need your approval immediately or the shipment will be cancelled.",
+    "This is critical: the payment run failed and payroll is due today.",
+    "Please call me ASAP, the client is threatening to cancel the contract.",
+    "Emergency maintenance is required before 5pm, can you help?",
+    "The deadline was moved to tomorrow morning, we need the figures tonight."
+]
+ROUTINE_SENTENCES = [
+    "Attached are the notes from today's meeting.",
+    "Let me know if you have any questions about the {project}.",
+    "I have updated the document with the latest numbers.",
+    "Can we find a time next week to go over the {project}?",
+    "The team agreed to revisit this at the next sync.",
+    "Here is the status update for the {project}: things are on track.",
+    "I reviewed the proposal and left a few comments inline.",
+    "Please find the revised schedule below."
+]
+THANKS_SENTENCES = [
+    "Thanks so much for your help on the {project}, it made a real difference.",
+    "Great work everyone, the launch went smoothly.",
+    "I really appreciate you staying late to get this done.",
+    "Excellent presentation today, the client loved it."
+]
+ANGRY_SENTENCES = [
+    "I am really frustrated that this is still not fixed.",
+    "This is the third time the invoice has been wrong.",
+    "Honestly this is unacceptable and I expect a response today."
+]
+NOTIFICATION_TEMPLATES = [
+    ("Build #{n} failed on main", "ci@{company}.com",
+     "Build #{n} for {company}/app failed on branch main. Job: test-unit. Duration: {m}m {s}s. "
+     "View logs at https://ci.{company}.com/builds/{n}"),
+    ("Your order #{n} has shipped", "shipping@{company}.com",
+     "Good news! Your order #{n} has shipped and will arrive on {day}. "
+     "Track your package at https://track.{company}.com/{n}"),
+    ("New sign-in to your account", "security@{company}.com",
+     "We noticed a new sign-in to your account from a new device on {day}. "
+     "If this was you, you can ignore this message."),
+    ("Invoice {n} is available", "billing@{company}.com",
+     "Your invoice {n} for ${m}.{s} is now available. Payment is due within 30 days.")
+]
+NEWSLETTER_ITEMS = [
+    "Save up to {m}% on all items this weekend only",
+    "Free shipping on orders over ${m}",
+    "New arrivals: the {day} collection is here",
+    "Members get early access to our biggest sale of the year",
+    "Five tips to get more out of your subscription",
+    "Customer favourites, back in stock"
+]
+
+def _long_tail_sentences(rng, median):
+    """Sentence count from a log-normal so a few messages are very long"""
+    return max(1, min(400, int(rng.lognormvariate(0, 0.9) * median)))
+
+def _fill(rng, template):
+    return template.format(project=rng.choice(PROJECTS), day=rng.choice(DAYS),
+                           company=rng.choice(COMPANIES), n=rng.randint(1000, 99999),
+                           m=rng.randint(5, 70), s=rng.randint(10, 59))
+
+def _person(rng):
+    name = rng.choice(FIRST_NAMES)
+    return name, f"{name.lower()}@{rng.choice(COMPANIES)}.com"
+
+def _paragraph(rng, pool, count):
+    return " ".join(_fill(rng, rng.choice(pool)) for _ in range(count))
+
+def make_urgent(rng):
+    name, sender = _person(rng)
+    body = _paragraph(rng, URGENT_SENTENCES, rng.randint(1, 3))
+    if rng.random() < 0.4:
+        body += " " + _paragraph(rng, ANGRY_SENTENCES, 1)
+    body += " " + _paragraph(rng, ROUTINE_SENTENCES, _long_tail_sentences(rng, 2))
+    subject = rng.choice(["URGENT: ", "Action required: ", "Re: ", ""]) + rng.choice(
+        ["server outage", "payment failed", "need approval", "client escalation"])
+    return sender, subject, f"Hi,\n\n{body}\n\n{name}", None, {}
+
+def make_routine(rng):
+    name, sender = _person(rng)
+    body = _paragraph(rng, ROUTINE_SENTENCES, _long_tail_sentences(rng, 5))
+    subject = _fill(rng, rng.choice(["Notes from {day}", "{project} update", "Quick question"]))
+    return sender, subject, f"Hi team,\n\n{body}\n\nBest,\n{name}", None, {}
+
+def make_reply_thread(rng):
+    name, sender = _person(rng)
+    reply = _paragraph(rng, ROUTINE_SENTENCES + ANGRY_SENTENCES, rng.randint(1, 3))
+    quoted = []
+    for depth in range(1, rng.randint(2, 5)):
+        other, other_email = _person(rng)
+        quoted.append(f"On {rng.choice(DAYS)}, {other} <{other_email}> wrote:")
+        for sentence in _paragraph(rng, ROUTINE_SENTENCES, _long_tail_sentences(rng, 3)).split(". "):
+            quoted.append(">" * depth + " " + sentence)
+    subject = "Re: " * rng.randint(1, 3) + _fill(rng, "{project}")
+    return sender, subject, f"{reply}\n\n{name}\n\n" + "\n".join(quoted), None, {}
+
+def make_thanks(rng):
+    name, sender = _person(rng)
+    body = _paragraph(rng, THANKS_SENTENCES, rng.randint(1, 3))
+    return sender, "Thank you!", f"Hi,\n\n{body}\n\nCheers,\n{name}", None, {}
+
+def make_notification(rng):
+    template = rng.choice(NOTIFICATION_TEMPLATES)
+    company = rng.choice(COMPANIES)
+    values = dict(company=company, n=rng.randint(1000, 99999), m=rng.randint(1, 59),
+                  s=rng.randint(10, 59), day=rng.choice(DAYS))
+    subject, sender, body = (part.format(**values) for part in template)
+    headers = {"Auto-Submitted": "auto-generated", "X-Mailer": f"{company}-notifier 2.1"}
+    return sender, subject, body, None, headers
+
+def make_newsletter(rng):
+    company = rng.choice(COMPANIES)
+    items = [_fill(rng, rng.choice(NEWSLETTER_ITEMS)) for _ in range(_long_tail_sentences(rng, 6))]
+    rows = "".join(
+        f'<tr><td class="item"><a href="https://{company}.com/p/{rng.randint(1, 9999)}?utm_source=email">'
+        f"<strong>{item}</strong></a><p>Shop now &amp; save&nbsp;today.</p></td></tr>" for item in items)
+    html = (
+        f"<html><head><style>.item{{padding:8px;font-family:Arial}} td{{color:#333}}</style></head>"
+        f'<body><div style="display:none">{items[0]}</div><table>{rows}</table>'
+        f'<p><a href="https://{company}.com/unsubscribe">Unsubscribe</a> | View in browser</p>'
+        f"<script>track('{rng.randint(1, 10 ** 9)}')</script></body></html>")
+    # What processEmailContent() would leave behind for a mail with no text/plain part
+    text = " ".join(items) + " Shop now &amp; save&nbsp;today. Unsubscribe | View in browser"
+    headers = {"List-Unsubscribe": f"<https://{company}.com/unsubscribe>", "Precedence": "bulk"}
+    return f"news@{company}.com", _fill(rng, rng.choice(NEWSLETTER_ITEMS)), text, html, headers
+
+GENERATORS = {
+    "urgent": make_urgent,
+    "routine": make_routine,
+    "reply_thread": make_reply_thread,
+    "thanks": make_thanks,
+    "notification": make_notification,
+    "newsletter": make_newsletter
+}
+
+def generate_corpus(count, seed=0):
+    """Yield count deterministic synthetic messages"""
+    rng = random.Random(seed)
+    categories = list(CATEGORY_WEIGHTS)
+    weights = [CATEGORY_WEIGHTS[c] for c in categories]
+    for index in range(count):
+        category = rng.choices(categories, weights)[0]
+        sender, subject, body, html, headers = GENERATORS[category](rng)
+        yield {
+            "id": f"synthetic-{seed}-{index:07d}",
+            "category": category,
+            "sender": sender,
+            "subject": subject,
+            # Same shape main.js sends to tone_analyzer.py
+            "text": f"{subject}\n\n{body}".strip(),
+            "html": html,
+            "headers": dict(headers, From=sender, Subject=subject)
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic mail corpus")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON-lines file (default: stdout)")
+    args = parser.parse_args()
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        for message in generate_corpus(args.count, args.seed):
+            out.write(json.dumps(message) + "\n")
+    finally:
+        if args.output:
+            out.close()
+
+if __name__ == "__main__":
+    main()
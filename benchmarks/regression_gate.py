@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+regression_gate.py - fail the build when the ML workers get slower or fatter
+
+Runs the benchmark suite (or reads an existing report), compares every
+benchmark's latency, throughput and peak RSS against the committed
+baseline.json, prints a diff table and exits non-zero on any regression.
+
+    python benchmarks/regression_gate.py
+    python benchmarks/regression_gate.py --report latest_report.json --tolerance p50_ms=0.4
+    python benchmarks/regression_gate.py --update-baseline
+
+Tolerances are relative (0.25 = 25% worse than baseline is still OK). A change
+also has to exceed a small absolute slack, so microsecond-level noise on the
+rules path cannot fail the gate. Tolerances stored in the baseline file under
+"tolerances" override the defaults; --tolerance overrides both.
+
+The baseline is rarely recorded on the machine that runs the gate, so each
+result is first rescaled by the reference workload measured in the same run
+(see run_benchmarks.case_reference): latencies by the reference latency ratio,
+peak RSS by the difference in the reference's RSS. Only the ratios within a
+run are compared, and a faster or slower CPU, more cores or another torch build
+cancel out. --absolute compares the raw numbers, for a baseline recorded on
+the same machine.
+"""
+
+import sys
+import os
+import json
+import argparse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+if BENCH_DIR not in sys.path:
+    sys.path.insert(0, BENCH_DIR)
+
+import run_benchmarks
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+# metric -> True when a bigger number is worse
+GATED_METRICS = {
+    "p50_ms": True,
+    "p95_ms": True,
+    "throughput_per_s": False,
+    "peak_rss_mb": True
+}
+
+DEFAULT_TOLERANCES = {
+    "p50_ms": 0.25,
+    "p95_ms": 0.50,
+    "throughput_per_s": 0.20,
+    "peak_rss_mb": 0.15
+}
+
+ABSOLUTE_SLACK = {
+    "p50_ms": 0.05,
+    "p95_ms": 0.10,
+    "throughput_per_s": 0.0,
+    "peak_rss_mb": 5.0
+}
+
+# Benchmark name prefix -> (reference for latency and throughput, reference for peak RSS)
+REFERENCES = {
+    "fallback_analysis": ("reference[python]", "reference[python]"),
+    "cold_start": ("reference[import]", "reference[import]"),
+    "": ("reference[torch]", "reference[import]")
+}
+TIME_METRICS = ("p50_ms", "p95_ms")
+
+def references_for(name):
+    return next(refs for prefix, refs in REFERENCES.items() if name.startswith(prefix))
+
+def rescale(baseline_results, current_results):
+    """current_results expressed on the baseline machine, using the reference workloads of both runs"""
+    missing = sorted({ref for refs in REFERENCES.values() for ref in refs}
+                     - (set(baseline_results) & set(current_results)))
+    if missing:
+        raise ValueError(f"reference benchmark(s) {', '.join(missing)} missing; "
+                         "re-record the baseline with --update-baseline or compare with --absolute")
+    rescaled = {}
+    for name, stats in current_results.items():
+        if name.startswith("reference["):
+            continue
+        time_ref, rss_ref = references_for(name)
+        speed = baseline_results[time_ref]["p50_ms"] / current_results[time_ref]["p50_ms"]
+        stats = dict(stats)
+        for metric in TIME_METRICS:
+            if stats.get(metric) is not None:
+                stats[metric] = stats[metric] * speed
+        if stats.get("throughput_per_s") is not None:
+            stats["throughput_per_s"] = stats["throughput_per_s"] / speed
+        if stats.get("peak_rss_mb") is not None:
+            stats["peak_rss_mb"] += baseline_results[rss_ref]["peak_rss_mb"] - current_results[rss_ref]["peak_rss_mb"]
+        rescaled[name] = stats
+    return rescaled
+
+def compare(baseline_results, current_results, tolerances):
+    """One row per benchmark metric: values, relative change, allowed change and status"""
+    rows = []
+    for name in sorted(set(baseline_results) | set(current_results)):
+        base = baseline_results.get(name)
+        current = current_results.get(name)
+        if base is None:
+            rows.append({"benchmark": name, "metric": "-", "status": "new"})
+            continue
+        if current is None:
+            rows.append({"benchmark": name, "metric": "-", "status": "missing"})
+            continue
+        for metric, higher_is_worse in GATED_METRICS.items():
+            if base.get(metric) is None or current.get(metric) is None:
+                continue
+            old, new = float(base[metric]), float(current[metric])
+            change = (new - old) / old if old else 0.0
+            worse_by = change if higher_is_worse else -change
+            regressed = (worse_by > tolerances[metric]
+                         and abs(new - old) > ABSOLUTE_SLACK[metric])
+            rows.append({
+                "benchmark": name, "metric": metric, "baseline": old, "current": new,
+                "change": change, "tolerance": tolerances[metric],
+                "status": "REGRESSED" if regressed else ("improved" if worse_by < 0 else "ok")
+            })
+    return rows
+
+def format_table(rows):
+    headers = ["benchmark", "metric", "baseline", "current", "change", "limit", "status"]
+    lines = []
+    for row in rows:
+        if "baseline" not in row:
+            lines.append([row["benchmark"], row["metric"], "", "", "", "", row["status"]])
+            continue
+        lines.append([row["benchmark"], row["metric"], f"{row['baseline']:.3f}", f"{row['current']:.3f}",
+                      f"{row['change']:+.1%}", f"{row['tolerance']:.0%}", row["status"]])
+    widths = [max(len(str(cell)) for cell in column) for column in zip(headers, *lines)]
+    render = lambda cells: "  ".join(str(cell).ljust(width) for cell, width in zip(cells, widths))
+    return "\n".join([render(headers), render(["-" * w for w in widths])] + [render(l) for l in lines])
+
+def parse_tolerance(value):
+    metric, _, amount = value.partition("=")
+    if metric not in GATED_METRICS or not amount:
+        raise argparse.ArgumentTypeError(f"expected METRIC=FRACTION with METRIC in {', '.join(GATED_METRICS)}")
+    return metric, float(amount)
+
+def main():
+    parser = run_benchmarks.build_parser()
+    parser.description = "Compare benchmark results against the committed baseline"
+    parser.set_defaults(output=run_benchmarks.DEFAULT_OUTPUT)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--report", help="compare this existing report instead of running the suite")
+    parser.add_argument("--tolerance", type=parse_tolerance, action="append", default=[],
+                        help="override one tolerance, e.g. p50_ms=0.4 (repeatable)")
+    parser.add_argument("--absolute", action="store_true",
+                        help="compare raw numbers instead of rescaling by the reference workloads")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="write the current results as the new baseline and exit")
+    args = parser.parse_args()
+
+    if args.report:
+        with open(args.report, encoding="utf-8") as f:
+            report = json.load(f)
+    else:
+        report = run_benchmarks.run_suite(args)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    if args.update_baseline:
+        # Keep hand-tuned tolerances across baseline refreshes
+        if baseline and "tolerances" in baseline:
+            report["tolerances"] = baseline["tolerances"]
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if baseline is None:
+        print(f"No baseline at {args.baseline}; run with --update-baseline to create one", file=sys.stderr)
+        return 2
+
+    tolerances = dict(DEFAULT_TOLERANCES)
+    tolerances.update(baseline.get("tolerances", {}))
+    tolerances.update(dict(args.tolerance))
+
+    # Latency ratios only carry over between runs with the same thread configuration
+    baseline_threads = baseline.get("environment", {}).get("runtime_config", {})
+    current_threads = report.get("environment", {}).get("runtime_config", {})
+    for key in ("intra_op_threads", "inter_op_threads", "workers"):
+        if baseline_threads.get(key) != current_threads.get(key):
+            print(f"Warning: baseline {key}={baseline_threads.get(key)} but this run has "
+                  f"{current_threads.get(key)}; re-record the baseline if the thread defaults changed",
+                  file=sys.stderr)
+
+    baseline_results, current_results = baseline["results"], report["results"]
+    if not args.absolute:
+        try:
+            current_results = rescale(baseline_results, current_results)
+        except ValueError as e:
+            print(str(e), file=sys.stderr)
+            return 2
+        baseline_results = {name: stats for name, stats in baseline_results.items()
+                            if not name.startswith("reference[")}
+        print("Current results rescaled to the baseline machine by the reference workloads "
+              f"(baseline: {baseline.get('environment', {}).get('cpu_count')} CPUs, "
+              f"torch {baseline.get('environment', {}).get('torch')})")
+    rows = compare(baseline_results, current_results, tolerances)
+    print(format_table(rows))
+    failures = [row for row in rows if row["status"] in ("REGRESSED", "missing")]
+    if failures:
+        print(f"\n{len(failures)} performance regression(s) against {args.baseline}", file=sys.stderr)
+        return 1
+    print("\nNo performance regressions.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+replay.py - drive the ML workers with synthetic mail at a fixed arrival rate
+
+Replays a corpus (mail_corpus.py) against either the spawn-per-email CLI path
+main.js uses today or a running worker_server.py, with Poisson arrivals at a
+configurable rate. Latency is measured from arrival to response, so it includes
+time spent queued behind earlier mail; queue depth is the number of messages in
+the system when each new one arrives.
+
+    python benchmarks/replay.py --mode cli --task tone --rate 0.5 --count 50 --tiny-models
+    python benchmarks/replay.py --mode server --start-server --workers 4 --rate 20 --count 2000
+    python benchmarks/replay.py --mode server --port 8765 --rate 0      # closed loop, max throughput
+"""
+
+import sys
+import os
+import json
+import time
+import random
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+import mail_corpus
+import tiny_models
+from run_benchmarks import percentile
+
+SCRIPTS = {"tone": "tone_analyzer.py", "summarize": "summarizer.py"}
+
+def call_cli(task, message, env):
+    """One fresh script process per email, exactly like executePythonScript() in main.js"""
+    completed = subprocess.run([sys.executable, os.path.join(REPO_ROOT, SCRIPTS[task])],
+                               input=message["text"], capture_output=True, text=True, env=env)
+    return json.loads(completed.stdout)
+
+def call_server(task, message, host, port):
+    import worker_server
+    return worker_server.request_worker({"id": message["id"], "task": task, "text": message["text"]},
+                                        host, port)
+
+def start_server(args, env):
+    """Launch worker_server.py and wait until it answers a ping"""
+    import worker_server
+    command = [sys.executable, os.path.join(REPO_ROOT, "worker_server.py"),
+               "--host", args.host, "--port", str(args.port), "--workers", str(args.workers)]
+    process = subprocess.Popen(command, env=env, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + args.server_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("worker_server.py exited during startup")
+        try:
+            worker_server.request_worker({"task": "ping"}, args.host, args.port, timeout=2.0)
+            return process
+        except OSError:
+            time.sleep(0.5)
+    process.kill()
+    raise RuntimeError("worker_server.py did not become ready in time")
+
+def replay(messages, call, rate, concurrency, seed=0):
+    """Submit messages with Poisson arrivals (rate <= 0: all at once) and time each one"""
+    rng = random.Random(seed)
+    lock = threading.Lock()
+    in_system = 0
+    records = []
+
+    def handle(message, arrived):
+        nonlocal in_system
+        started = time.perf_counter()
+        try:
+            result = call(message)
+            ok = bool(result.get("success"))
+        except Exception as e:
+            print(f"Request {message['id']} failed: {e}", file=sys.stderr)
+            ok = False
+        finished = time.perf_counter()
+        with lock:
+            in_system -= 1
+            records.append({"arrived": arrived, "started": started, "finished": finished, "ok": ok})
+
+    depths = []
+    begin = time.perf_counter()
+    next_arrival = begin
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for message in messages:
+            if rate > 0:
+                next_arrival += rng.expovariate(rate)
+                delay = next_arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            arrived = time.perf_counter()
+            with lock:
+                in_system += 1
+                depths.append(in_system)
+            pool.submit(handle, message, arrived)
+    wall = time.perf_counter() - begin
+    return records, depths, wall
+
+def build_report(records, depths, wall, args):
+    latencies = [r["finished"] - r["arrived"] for r in records]
+    service = [r["finished"] - r["started"] for r in records]
+
+    def ms(values, pct):
+        return round(percentile(values, pct) * 1000, 1) if values else None
+
+    return {
+        "mode": args.mode,
+        "task": args.task,
+        "arrival_rate_per_s": args.rate,
+        "concurrency": args.concurrency,
+        "messages": len(records),
+        "errors": sum(1 for r in records if not r["ok"]),
+        "wall_s": round(wall, 2),
+        "throughput_per_s": round(len(records) / wall, 2) if wall else None,
+        "latency_ms": {"p50": ms(latencies, 50), "p95": ms(latencies, 95), "p99": ms(latencies, 99),
+                       "max": ms(latencies, 100)},
+        "service_ms": {"p50": ms(service, 50), "p95": ms(service, 95), "p99": ms(service, 99)},
+        "queue_depth": {"mean": round(sum(depths) / len(depths), 2) if depths else 0,
+                        "p95": percentile(depths, 95), "max": max(depths, default=0)}
+    }
+
+def load_messages(args):
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()][:args.count]
+    return list(mail_corpus.generate_corpus(args.count, args.seed))
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay synthetic mail against the ML workers")
+    parser.add_argument("--mode", choices=["cli", "server"], default="cli")
+    parser.add_argument("--task", choices=list(SCRIPTS), default="tone")
+    parser.add_argument("--rate", type=float, default=1.0,
+                        help="mean arrivals per second (Poisson); 0 submits everything at once")
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight at most")
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus", help="JSON-lines corpus file (default: generate one)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--start-server", action="store_true",
+                        help="launch worker_server.py for the run (server mode)")
+    parser.add_argument("--workers", type=int, default=2, help="workers for --start-server")
+    parser.add_argument("--server-timeout", type=float, default=300.0)
+    parser.add_argument("--tiny-models", action="store_true",
+                        help="use the offline stand-in models from tiny_models.py")
+    parser.add_argument("--output", help="also write the report to this file")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if args.tiny_models:
+        env = tiny_models.tiny_model_env(tiny_models.build_tiny_models())
+
+    server = None
+    if args.mode == "server":
+        if args.start_server:
+            server = start_server(args, env)
+        call = lambda message: call_server(args.task, message, args.host, args.port)
+    else:
+        call = lambda message: call_cli(args.task, message, env)
+
+    try:
+        records, depths, wall = replay(load_messages(args), call, args.rate, args.concurrency, args.seed)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    report = build_report(records, depths, wall, args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
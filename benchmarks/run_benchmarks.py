@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+run_benchmarks.py - latency, throughput, memory and cold-start benchmarks
+
+Runs fully offline on a CPU-only machine against tiny randomly initialised BART
+stand-ins (see tiny_models.py). Each case runs in its own subprocess so its peak
+RSS is not polluted by the others, and the combined results are written as a
+JSON report. The reference case measures fixed workloads (a pure-Python loop,
+importing torch and transformers, a float32 matmul) that regression_gate.py
+scales every other result by, so reports from different machines compare:
+
+    python benchmarks/run_benchmarks.py --output bench_report.json
+    python benchmarks/run_benchmarks.py --cases fallback_analysis,analyze_with_ai
+    python benchmarks/run_benchmarks.py --real-models   # use the configured checkpoints
+"""
+
+import sys
+import os
+import json
+import time
+import platform
+import argparse
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+import tiny_models
+
+DEFAULT_OUTPUT = os.path.join(BENCH_DIR, "latest_report.json")
+DEFAULT_BATCH_SIZES = [1, 4, 8, 16]
+CASES = ["reference", "fallback_analysis", "fallback_analysis_batch", "analyze_with_ai", "analyze_batch_with_ai",
+         "summarize_text_bart", "cold_start"]
+
+def peak_rss_mb(maxrss=None):
+    """Peak resident set size in MB (ru_maxrss is KB on Linux, bytes on macOS)"""
+    import resource
+    if maxrss is None:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(maxrss / divisor, 1)
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+def summarize_latencies(seconds, items_per_call=1):
+    """p50/p95/mean in ms plus items-per-second throughput"""
+    total = sum(seconds)
+    return {
+        "p50_ms": round(percentile(seconds, 50) * 1000, 3),
+        "p95_ms": round(percentile(seconds, 95) * 1000, 3),
+        "mean_ms": round(total / len(seconds) * 1000, 3),
+        "throughput_per_s": round(items_per_call * len(seconds) / total, 2) if total else None,
+        "calls": len(seconds)
+    }
+
+def time_calls(func, inputs, iterations):
+    latencies = []
+    for i in range(iterations):
+        item = inputs[i % len(inputs)]
+        start = time.perf_counter()
+        func(item)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def bench_texts():
+    import runtime_config
+    return runtime_config.SAMPLE_TEXTS
+
+# --- Cases (each runs inside its own subprocess) ---
+
+def python_workload(_):
+    """Fixed interpreter-bound work: string building, sorting and dict counting"""
+    words = sorted(f"word{i * 7919 % 5000}" for i in range(5000))
+    counts = {}
+    for word in words:
+        counts[word] = counts.get(word, 0) + 1
+    return len(counts)
+
+def case_reference(args):
+    results = {"reference[python]": summarize_latencies(time_calls(python_workload, [None], args.iterations * 5))}
+    results["reference[python]"]["peak_rss_mb"] = peak_rss_mb()
+    # Fresh interpreters, so the import is as cold as the scripts' own
+    runs = []
+    for _ in range(args.cold_runs):
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, "-c", "import torch, transformers.pipelines"],
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        _, status, rusage = os.wait4(process.pid, 0)
+        if os.waitstatus_to_exitcode(status) != 0:
+            raise RuntimeError("importing torch and transformers failed")
+        runs.append((time.perf_counter() - start, peak_rss_mb(rusage.ru_maxrss)))
+    results["reference[import]"] = summarize_latencies([elapsed for elapsed, _ in runs])
+    results["reference[import]"]["peak_rss_mb"] = max(rss for _, rss in runs)
+    import torch
+    import runtime_config
+    runtime_config.apply_thread_settings()
+    generator = torch.Generator().manual_seed(0)
+    matrix = torch.rand(512, 512, generator=generator)
+    run = lambda _: torch.mm(matrix, matrix)
+    time_calls(run, [None], 5)
+    results["reference[torch]"] = summarize_latencies(time_calls(run, [None], args.iterations * 5))
+    return results
+
+def case_fallback_analysis(args):
+    import tone_analyzer
+    texts = bench_texts()
+    time_calls(tone_analyzer.fallback_analysis, texts, 50)  # warm-up
+    return {"fallback_analysis": summarize_latencies(
+        time_calls(tone_analyzer.fallback_analysis, texts, args.iterations * 100))}
+
+# Lexicons whose terms nest or share prefixes, where overlapping matches would score differently
+CONSISTENCY_LEXICONS = [
+    {"urgent": {"help": 1, "help me": 1, "asap": 1}, "negative": {"not": 1, "not good": 1},
+     "positive": {"good": 1, "thank": 1, "thank you": 1}},
+    {"urgent": {"!!": 1, "!!!": 2, "urgent": 1}, "negative": {"fail": 1, "failed": 1}, "positive": {}},
+]
+CONSISTENCY_TEXTS = ["please help me now", "Help! help me asap", "thank you, not good!!!", "It failed!! fail",
+                     "helpful but not goodness", "", "thank\nyou"]
+
+def check_batch_matches_single(tone_analyzer):
+    """Fail the case when fallback_analysis_batch and fallback_analysis disagree on any text"""
+    lexicon = tone_analyzer.LEXICON
+    try:
+        for candidate in [lexicon] + CONSISTENCY_LEXICONS:
+            tone_analyzer.use_lexicon(candidate)
+            texts = CONSISTENCY_TEXTS + bench_texts()
+            single = [tone_analyzer.fallback_analysis(text) for text in texts]
+            if tone_analyzer.fallback_analysis_batch(texts) != single:
+                raise RuntimeError(f"fallback_analysis_batch disagrees with fallback_analysis for {candidate}")
+    finally:
+        tone_analyzer.use_lexicon(lexicon)
+
+def case_fallback_analysis_batch(args):
+    import tone_analyzer
+    check_batch_matches_single(tone_analyzer)
+    texts = bench_texts() * 1000
+    run = lambda _: tone_analyzer.fallback_analysis_batch(texts)
+    time_calls(run, [None], 1)
+    return {"fallback_analysis_batch": summarize_latencies(
+        time_calls(run, [None], max(3, args.iterations)), items_per_call=len(texts))}
+
+def case_analyze_with_ai(args):
+    import tone_analyzer
+    start = time.perf_counter()
+    classifier = tone_analyzer.load_ai_classifier()
+    load_ms = (time.perf_counter() - start) * 1000
+    texts = bench_texts()
+    time_calls(lambda text: tone_analyzer.analyze_with_ai(text, classifier), texts, 2)
+    stats = summarize_latencies(time_calls(
+        lambda text: tone_analyzer.analyze_with_ai(text, classifier), texts, args.iterations))
+    stats["load_ms"] = round(load_ms, 1)
+    return {"analyze_with_ai": stats}
+
+def case_analyze_batch_with_ai(args):
+    import tone_analyzer
+    classifier = tone_analyzer.load_ai_classifier()
+    texts = bench_texts()
+    results = {}
+    for batch_size in args.batch_sizes:
+        batch = (texts * (batch_size // len(texts) + 1))[:batch_size]
+        run = lambda _: tone_analyzer.analyze_batch_with_ai(batch, classifier, batch_size)
+        time_calls(run, [None], 1)
+        results[f"analyze_batch_with_ai[batch={batch_size}]"] = summarize_latencies(
+            time_calls(run, [None], max(2, args.iterations // 2)), items_per_call=batch_size)
+    return results
+
+def case_summarize_text_bart(args):
+    import summarizer
+    start = time.perf_counter()
+    pipeline = summarizer.load_summarizer_pipeline()
+    load_ms = (time.perf_counter() - start) * 1000
+    texts = bench_texts()
+    time_calls(lambda text: summarizer.summarize_text_bart(text, pipeline), texts, 1)
+    stats = summarize_latencies(time_calls(
+        lambda text: summarizer.summarize_text_bart(text, pipeline), texts, args.iterations))
+    stats["load_ms"] = round(load_ms, 1)
+    return {"summarize_text_bart": stats}
+
+def run_cold(script, text, env):
+    """Wall time and peak RSS of one fresh script process"""
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, script)], env=env,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    process.stdin.write(text.encode("utf-8"))
+    process.stdin.close()
+    output = process.stdout.read()
+    process.stdout.close()
+    _, status, rusage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0 or not json.loads(output).get("success"):
+        raise RuntimeError(f"{script} failed during cold start: {output[:200]!r}")
+    return elapsed, peak_rss_mb(rusage.ru_maxrss)
+
+def case_cold_start(args):
+    env = dict(os.environ)
+    text = bench_texts()[3]
+    results = {}
+    for script in ["tone_analyzer.py", "summarizer.py"]:
+        runs = [run_cold(script, text, env) for _ in range(args.cold_runs)]
+        stats = summarize_latencies([elapsed for elapsed, _ in runs])
+        stats["peak_rss_mb"] = max(rss for _, rss in runs)
+        results[f"cold_start[{script[:-3]}]"] = stats
+    return results
+
+CASE_FUNCTIONS = {
+    "reference": case_reference,
+    "fallback_analysis": case_fallback_analysis,
+    "fallback_analysis_batch": case_fallback_analysis_batch,
+    "analyze_with_ai": case_analyze_with_ai,
+    "analyze_batch_with_ai": case_analyze_batch_with_ai,
+    "summarize_text_bart": case_summarize_text_bart,
+    "cold_start": case_cold_start
+}
+
+def run_case_inline(args):
+    """Child-process entry: run one case and print its results as JSON"""
+    results = CASE_FUNCTIONS[args.case](args)
+    # Cold start and the reference case report their own RSS; everything else reports this process
+    for stats in results.values():
+        stats.setdefault("peak_rss_mb", peak_rss_mb())
+    print(json.dumps(results))
+
+def run_case_subprocess(case, args, env):
+    command = [sys.executable, os.path.abspath(__file__), "--case", case,
+               "--iterations", str(args.iterations), "--cold-runs", str(args.cold_runs),
+               "--batch-sizes", ",".join(str(b) for b in args.batch_sizes)]
+    completed = subprocess.run(command, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Benchmark case {case} failed:\n{completed.stderr[-2000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def environment_info():
+    info = {"python": platform.python_version(), "platform": platform.platform(),
+            "machine": platform.machine(), "cpu_count": os.cpu_count()}
+    for module in ["torch", "transformers"]:
+        try:
+            info[module] = __import__(module).__version__
+        except ImportError:
+            info[module] = None
+    import runtime_config
+    info["runtime_config"] = runtime_config.load_runtime_config()
+    return info
+
+def run_suite(args):
+    """Run every selected case in a fresh process and return the combined report"""
+    if args.real_models:
+        env = dict(os.environ)
+        models = {"tone": os.environ.get("WHISPRMAIL_TONE_MODEL", "facebook/bart-large-mnli"),
+                  "summarize": os.environ.get("WHISPRMAIL_SUMMARY_MODEL", "facebook/bart-large-cnn")}
+    else:
+        models = tiny_models.build_tiny_models(args.model_dir)
+        env = tiny_models.tiny_model_env(models)
+
+    results = {}
+    for case in args.cases:
+        print(f"Running {case}...", file=sys.stderr)
+        results.update(run_case_subprocess(case, args, env))
+
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "models": models if args.real_models else {"tiny": True, **tiny_models.TINY_CONFIG},
+        "environment": environment_info(),
+        "results": results
+    }
+
+def _int_list(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the WhisprMail ML workers offline")
+    parser.add_argument("--cases", type=lambda v: [c for c in v.split(",") if c], default=CASES,
+                        help="comma-separated subset of: " + ", ".join(CASES))
+    parser.add_argument("--iterations", type=int, default=20, help="timed calls per case")
+    parser.add_argument("--batch-sizes", type=_int_list, default=DEFAULT_BATCH_SIZES)
+    parser.add_argument("--cold-runs", type=int, default=3, help="fresh processes per cold-start script")
+    parser.add_argument("--model-dir", default=None, help="where to build the tiny stand-in models")
+    parser.add_argument("--real-models", action="store_true",
+                        help="benchmark the configured checkpoints instead of tiny stand-ins")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--case", choices=CASES, help=argparse.SUPPRESS)
+    return parser
+
+def main():
+    args = build_parser().parse_args()
+    if args.case:
+        run_case_inline(args)
+        return
+
+    unknown = [case for case in args.cases if case not in CASE_FUNCTIONS]
+    if unknown:
+        sys.exit(f"Unknown benchmark case(s): {', '.join(unknown)}")
+
+    report = run_suite(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report["results"], indent=2))
+    print(f"Report written to {args.output}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+tiny_models.py - randomly initialised stand-ins for the two BART checkpoints
+
+Builds a byte-level BPE tokenizer trained on a few sample emails plus tiny
+BartForConditionalGeneration (summarizer) and BartForSequenceClassification
+(MNLI-style zero-shot) models, entirely offline. The architectures, label maps
+and generation settings mirror facebook/bart-large-cnn and
+facebook/bart-large-mnli so the production code paths run unchanged; only the
+sizes (and therefore the outputs) differ.
+"""
+
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+import runtime_config
+
+DEFAULT_MODEL_DIR = os.path.join(REPO_ROOT, "benchmarks", ".tiny_models")
+
+# Small enough to load in milliseconds, big enough that batch size and thread count still matter
+TINY_CONFIG = {
+    "d_model": 64,
+    "encoder_layers": 2,
+    "decoder_layers": 2,
+    "encoder_attention_heads": 4,
+    "decoder_attention_heads": 4,
+    "encoder_ffn_dim": 256,
+    "decoder_ffn_dim": 256,
+    "max_position_embeddings": 1024
+}
+
+TOKENIZER_CORPUS = runtime_config.SAMPLE_TEXTS + [
+    "Please review the attached contract and reply before the deadline tomorrow.",
+    "Your order has shipped and will arrive on Monday. Track your package online.",
+    "Can we move our call to Thursday afternoon? Something urgent came up.",
+    "Congratulations on the promotion, well deserved! Let's celebrate soon."
+]
+
+def model_paths(model_dir=None):
+    model_dir = model_dir or DEFAULT_MODEL_DIR
+    return {
+        "tone": os.path.join(model_dir, "tiny-bart-mnli"),
+        "summarize": os.path.join(model_dir, "tiny-bart-cnn")
+    }
+
+def build_tokenizer(workdir):
+    from tokenizers import ByteLevelBPETokenizer
+    from transformers import BartTokenizerFast
+
+    bpe = ByteLevelBPETokenizer()
+    bpe.train_from_iterator(TOKENIZER_CORPUS * 20, vocab_size=1000, min_frequency=1,
+                            special_tokens=["<s>", "<pad>", "</s>", "<unk>", "<mask>"])
+    os.makedirs(workdir, exist_ok=True)
+    bpe.save_model(workdir)
+    return BartTokenizerFast(vocab_file=os.path.join(workdir, "vocab.json"),
+                             merges_file=os.path.join(workdir, "merges.txt"),
+                             model_max_length=TINY_CONFIG["max_position_embeddings"])
+
+def build_tiny_models(model_dir=None, seed=0):
+    """Create both stand-in checkpoints under model_dir (once) and return their paths"""
+    paths = model_paths(model_dir)
+    if all(os.path.exists(os.path.join(path, "config.json")) for path in paths.values()):
+        return paths
+
+    import torch
+    from transformers import (BartConfig, BartForConditionalGeneration,
+                              BartForSequenceClassification, GenerationConfig)
+
+    torch.manual_seed(seed)
+    tokenizer = build_tokenizer(os.path.join(model_dir or DEFAULT_MODEL_DIR, "bpe"))
+    common = dict(TINY_CONFIG, vocab_size=len(tokenizer), pad_token_id=tokenizer.pad_token_id,
+                  bos_token_id=tokenizer.bos_token_id, eos_token_id=tokenizer.eos_token_id,
+                  decoder_start_token_id=tokenizer.eos_token_id)
+
+    summarizer_model = BartForConditionalGeneration(BartConfig(**common))
+    # Same defaults bart-large-cnn ships with
+    summarizer_model.generation_config = GenerationConfig(
+        max_length=142, min_length=56, num_beams=4, no_repeat_ngram_size=3, length_penalty=2.0,
+        early_stopping=True, forced_bos_token_id=tokenizer.bos_token_id,
+        forced_eos_token_id=tokenizer.eos_token_id, decoder_start_token_id=tokenizer.eos_token_id,
+        bos_token_id=tokenizer.bos_token_id, eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id)
+    summarizer_model.save_pretrained(paths["summarize"])
+    tokenizer.save_pretrained(paths["summarize"])
+
+    # Same label map bart-large-mnli uses, which the zero-shot pipeline looks up by name
+    labels = {0: "contradiction", 1: "neutral", 2: "entailment"}
+    classifier_model = BartForSequenceClassification(BartConfig(
+        **common, num_labels=3, id2label=labels, label2id={v: k for k, v in labels.items()}))
+    classifier_model.save_pretrained(paths["tone"])
+    tokenizer.save_pretrained(paths["tone"])
+    return paths
+
+def tiny_model_env(paths, base_env=None):
+    """Environment that points tone_analyzer.py / summarizer.py at the stand-ins, offline"""
+    env = dict(os.environ if base_env is None else base_env)
+    env.update({
+        "WHISPRMAIL_TONE_MODEL": paths["tone"],
+        "WHISPRMAIL_SUMMARY_MODEL": paths["summarize"],
+        "HF_HUB_OFFLINE": "1",
+        "TRANSFORMERS_OFFLINE": "1"
+    })
+    return env
+
+if __name__ == "__main__":
+    for task, path in build_tiny_models(sys.argv[1] if len(sys.argv) > 1 else None).items():
+        print(f"{task}: {path}")
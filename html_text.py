@@ -0,0 +1,136 @@
+"""
+html_text.py - reduce an HTML email body to the plain text the models read
+
+Marketing mail is mostly markup: inline CSS, tracking scripts, hidden preheader
+padding (runs of &zwnj;&nbsp;) and layout tables. The body is fed to an
+incremental html.parser.HTMLParser in chunks, so its cost is linear in the
+input and parsing stops as soon as the text budget is filled. Style, script,
+head and other non-content elements are dropped along with anything hidden by
+the hidden attribute, aria-hidden or an inline display:none / visibility:hidden
+/ mso-hide:all style; entities are decoded, invisible spacer characters removed
+and whitespace collapsed to single spaces.
+
+The budget (WHISPRMAIL_HTML_MAX_CHARS, default 6000 characters) sits just past
+the 1024 tokens BART reads, so text the models would truncate anyway is never
+tokenized. Used by backfill.py, and by tone_analyzer.py, summarizer.py and
+worker_server.py when they are given raw HTML.
+"""
+
+import os
+import re
+from html.parser import HTMLParser
+
+# Bumped whenever the extracted text changes, so backfill re-analyzes HTML-only mail
+EXTRACTOR_VERSION = 1
+DEFAULT_MAX_CHARS = int(os.environ.get("WHISPRMAIL_HTML_MAX_CHARS", "6000"))
+CHUNK_CHARS = 64 * 1024
+
+# Elements whose content is never text a reader sees
+SKIP_TAGS = frozenset({"style", "script", "head", "title", "noscript", "template", "svg", "math",
+                       "object", "iframe", "select", "button"})
+# Elements that end a run of text, so neighbouring words are not glued together
+BLOCK_TAGS = frozenset({"address", "article", "aside", "blockquote", "br", "dd", "div", "dl", "dt",
+                        "figcaption", "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6", "header",
+                        "hr", "li", "main", "nav", "ol", "p", "pre", "section", "table", "tbody", "td",
+                        "tfoot", "th", "thead", "tr", "ul"})
+VOID_TAGS = frozenset({"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta",
+                       "param", "source", "track", "wbr"})
+
+_HIDDEN_STYLE = re.compile(r"display\s*:\s*none|visibility\s*:\s*hidden|mso-hide\s*:\s*all", re.IGNORECASE)
+# Zero-width and soft-hyphen characters used to pad preheaders
+_INVISIBLE = re.compile("[\u00ad\u034f\u180e\u200b-\u200f\u2060-\u2064\ufeff]")
+
+def is_hidden(attrs):
+    """Whether a start tag's attributes hide the element"""
+    for name, value in attrs:
+        if name == "hidden":
+            return True
+        if name == "aria-hidden" and (value or "").strip().lower() == "true":
+            return True
+        if name == "style" and value and _HIDDEN_STYLE.search(value):
+            return True
+    return False
+
+class TextExtractor(HTMLParser):
+    """Incremental HTML-to-text parser that stops collecting once max_chars are gathered"""
+
+    def __init__(self, max_chars=None):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = DEFAULT_MAX_CHARS if max_chars is None else max_chars
+        self.parts = []
+        self.length = 0
+        self.full = False
+        self._pending_space = False
+        # (tag, depth) of the hidden or non-content element being skipped
+        self._skip_tag = None
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if self._skip_tag is not None:
+            if tag == self._skip_tag:
+                self._skip_depth += 1
+            elif tag == "body" and self._skip_tag == "head":
+                # A missing </head> must not swallow the whole body
+                self._skip_tag = None
+            return
+        if tag in BLOCK_TAGS:
+            self._pending_space = True
+        if tag not in VOID_TAGS and (tag in SKIP_TAGS or is_hidden(attrs)):
+            self._skip_tag, self._skip_depth = tag, 1
+
+    def handle_startendtag(self, tag, attrs):
+        if self._skip_tag is None and tag in BLOCK_TAGS:
+            self._pending_space = True
+
+    def handle_endtag(self, tag):
+        if self._skip_tag is not None:
+            if tag == self._skip_tag:
+                self._skip_depth -= 1
+                if self._skip_depth == 0:
+                    self._skip_tag = None
+            return
+        if tag in BLOCK_TAGS:
+            self._pending_space = True
+
+    def handle_data(self, data):
+        if self._skip_tag is not None or self.full:
+            return
+        data = _INVISIBLE.sub("", data)
+        if not data:
+            return
+        if data[0].isspace():
+            self._pending_space = True
+        words = data.split()
+        if not words:
+            return
+        text = " ".join(words)
+        if self._pending_space and self.parts:
+            text = " " + text
+        self._pending_space = data[-1].isspace()
+        self.parts.append(text)
+        self.length += len(text)
+        if self.length >= self.max_chars:
+            self.full = True
+
+    def text(self):
+        text = "".join(self.parts)
+        if len(text) > self.max_chars:
+            text = text[:self.max_chars]
+            # Cut at a word boundary unless that would drop most of the last stretch
+            boundary = text.rfind(" ")
+            if boundary > self.max_chars * 0.9:
+                text = text[:boundary]
+        return text.strip()
+
+def html_to_text(html, max_chars=None):
+    """Visible text of an HTML document, at most max_chars long"""
+    if not html:
+        return ""
+    extractor = TextExtractor(max_chars)
+    for start in range(0, len(html), CHUNK_CHARS):
+        extractor.feed(html[start:start + CHUNK_CHARS])
+        if extractor.full:
+            break
+    else:
+        extractor.close()
+    return extractor.text()
@@ -0,0 +1,207 @@
+"""
+language_id.py - fast language identification and per-language model routing
+
+bart-large-mnli and bart-large-cnn only understand English; on other languages
+they spend seconds producing noise. detect() runs before any model and costs
+well under a millisecond: letters in a non-Latin script decide the language
+directly (Cyrillic, Greek, Arabic, Hebrew, Devanagari, Thai, Hangul, kana, Han),
+and Latin-script text is scored by a naive Bayes model over character trigrams
+of its words, trained at import on the short seed texts below. Text that is too
+short or too close between two languages is "und" (undetermined) and keeps the
+default model, so misdetection never costs English mail its model.
+
+Routing maps a language to a model name or to "rules" per task:
+
+    WHISPRMAIL_TONE_ROUTES="de=svalabs/gbert-large-zeroshot-nli,*=rules"
+    WHISPRMAIL_SUMMARY_ROUTES="*=rules"
+
+English and undetermined text always go to the task's default model unless
+routed explicitly; "*" covers every other language and defaults to "rules" (the
+keyword tier for tone; no summary, so the caller shows the original text).
+Routing "*" to the default model restores the old send-everything behaviour.
+"""
+
+import os
+import re
+import math
+from collections import Counter
+
+# Bumped whenever detection or the seed texts change, so backfill re-analyzes
+LANGUAGE_ID_VERSION = 1
+RULES = "rules"
+UNDETERMINED = "und"
+DEFAULT_LANGUAGES = ("en", UNDETERMINED)
+ROUTE_ENV = {"tone": "WHISPRMAIL_TONE_ROUTES", "summarize": "WHISPRMAIL_SUMMARY_ROUTES"}
+
+SAMPLE_CHARS = 2000
+MIN_LETTERS = 20
+# Mean log-likelihood gap per trigram between the best and second language
+MIN_MARGIN = 0.1
+# Share of letters a non-Latin script needs before it decides the language
+MIN_SCRIPT_SHARE = 0.3
+
+SCRIPTS = (
+    ("ko", re.compile("[\uac00-\ud7af\u1100-\u11ff]")),
+    ("ja", re.compile("[\u3040-\u30ff]")),
+    ("zh", re.compile("[\u4e00-\u9fff]")),
+    ("ru", re.compile("[\u0400-\u04ff]")),
+    ("el", re.compile("[\u0370-\u03ff]")),
+    ("ar", re.compile("[\u0600-\u06ff]")),
+    ("he", re.compile("[\u0590-\u05ff]")),
+    ("hi", re.compile("[\u0900-\u097f]")),
+    ("th", re.compile("[\u0e00-\u0e7f]")),
+)
+# Letters only Ukrainian uses among the Cyrillic languages
+_UKRAINIAN = re.compile("[\u0456\u0457\u0454\u0491\u0406\u0407\u0404\u0490]")
+_NOISE = re.compile(r"(?:https?://|www\.)\S+|[\w.+-]+@[\w-]+(?:\.[\w-]+)+|[\d_]+")
+_WORD = re.compile(r"[^\W\d_]+")
+
+SEED_TEXTS = {
+    "en": """Hi team, thank you for your message. I will send the report by the end of the day and
+        let you know if there are any problems with the invoice. Please check the attached document
+        and confirm that the meeting is still scheduled for tomorrow morning. We need to update the
+        account before the deadline, otherwise the order will be cancelled. Could you call me when you
+        have a moment? Best regards and have a great weekend. Your package has been shipped and should
+        arrive within three business days. This is a reminder that your payment is due this week.
+        The build failed on the main branch; view the logs and fix the test job. Customer favourites are
+        back in stock, with five tips to get more out of your subscription and our newsletter.""",
+    "de": """Hallo zusammen, vielen Dank für Ihre Nachricht. Ich schicke den Bericht bis heute Abend
+        und melde mich, falls es Probleme mit der Rechnung gibt. Bitte prüfen Sie das angehängte
+        Dokument und bestätigen Sie, dass die Besprechung morgen früh noch stattfindet. Wir müssen das
+        Konto vor der Frist aktualisieren, sonst wird die Bestellung storniert. Könnten Sie mich
+        anrufen, wenn Sie einen Moment Zeit haben? Mit freundlichen Grüßen und ein schönes Wochenende.
+        Ihr Paket wurde versendet und sollte innerhalb von drei Werktagen ankommen. Dies ist eine
+        Erinnerung, dass Ihre Zahlung diese Woche fällig ist.""",
+    "fr": """Bonjour à tous, merci pour votre message. J'enverrai le rapport avant la fin de la journée
+        et je vous préviendrai s'il y a des problèmes avec la facture. Veuillez vérifier le document
+        joint et confirmer que la réunion est toujours prévue pour demain matin. Nous devons mettre à
+        jour le compte avant la date limite, sinon la commande sera annulée. Pourriez-vous m'appeler
+        quand vous aurez un moment ? Cordialement et bon week-end. Votre colis a été expédié et devrait
+        arriver dans les trois jours ouvrables. Ceci est un rappel que votre paiement est dû cette
+        semaine.""",
+    "es": """Hola equipo, gracias por su mensaje. Enviaré el informe antes del final del día y les
+        avisaré si hay algún problema con la factura. Por favor revise el documento adjunto y confirme
+        que la reunión sigue programada para mañana por la mañana. Tenemos que actualizar la cuenta
+        antes de la fecha límite, de lo contrario el pedido será cancelado. ¿Podría llamarme cuando
+        tenga un momento? Saludos cordiales y que tenga un buen fin de semana. Su paquete ha sido
+        enviado y debería llegar en tres días hábiles. Este es un recordatorio de que su pago vence
+        esta semana.""",
+    "it": """Ciao a tutti, grazie per il vostro messaggio. Invierò il rapporto entro la fine della
+        giornata e vi farò sapere se ci sono problemi con la fattura. Per favore controllate il
+        documento allegato e confermate che la riunione è ancora prevista per domani mattina. Dobbiamo
+        aggiornare il conto prima della scadenza, altrimenti l'ordine sarà annullato. Potrebbe
+        chiamarmi quando ha un momento? Cordiali saluti e buon fine settimana. Il suo pacco è stato
+        spedito e dovrebbe arrivare entro tre giorni lavorativi. Questo è un promemoria che il suo
+        pagamento scade questa settimana.""",
+    "pt": """Olá equipe, obrigado pela sua mensagem. Vou enviar o relatório até o final do dia e aviso
+        se houver algum problema com a fatura. Por favor verifique o documento anexo e confirme que a
+        reunião ainda está marcada para amanhã de manhã. Precisamos atualizar a conta antes do prazo,
+        caso contrário o pedido será cancelado. Você poderia me ligar quando tiver um momento?
+        Atenciosamente e um ótimo fim de semana. A sua encomenda foi enviada e deve chegar em três dias
+        úteis. Este é um lembrete de que o seu pagamento vence esta semana.""",
+    "nl": """Hallo allemaal, bedankt voor je bericht. Ik stuur het rapport voor het einde van de dag en
+        laat het weten als er problemen zijn met de factuur. Controleer alstublieft het bijgevoegde
+        document en bevestig dat de vergadering morgenochtend nog steeds gepland staat. We moeten het
+        account voor de deadline bijwerken, anders wordt de bestelling geannuleerd. Kunt u mij bellen
+        als u even tijd heeft? Met vriendelijke groet en een fijn weekend. Uw pakket is verzonden en
+        zou binnen drie werkdagen moeten aankomen. Dit is een herinnering dat uw betaling deze week
+        verschuldigd is.""",
+    "sv": """Hej alla, tack för ditt meddelande. Jag skickar rapporten innan dagens slut och hör av mig
+        om det finns några problem med fakturan. Kontrollera det bifogade dokumentet och bekräfta att
+        mötet fortfarande är planerat till i morgon bitti. Vi måste uppdatera kontot före tidsfristen,
+        annars kommer beställningen att avbrytas. Kan du ringa mig när du har en stund? Med vänliga
+        hälsningar och trevlig helg. Ditt paket har skickats och bör komma fram inom tre arbetsdagar.
+        Detta är en påminnelse om att din betalning förfaller denna vecka.""",
+    "pl": """Cześć wszystkim, dziękuję za wiadomość. Wyślę raport do końca dnia i dam znać, jeśli będą
+        jakieś problemy z fakturą. Proszę sprawdzić załączony dokument i potwierdzić, że spotkanie
+        nadal jest zaplanowane na jutro rano. Musimy zaktualizować konto przed terminem, w przeciwnym
+        razie zamówienie zostanie anulowane. Czy mógłby Pan do mnie zadzwonić, kiedy będzie miał Pan
+        chwilę? Pozdrawiam serdecznie i życzę miłego weekendu. Twoja paczka została wysłana i powinna
+        dotrzeć w ciągu trzech dni roboczych. To jest przypomnienie, że płatność jest należna w tym
+        tygodniu.""",
+    "tr": """Merhaba ekip, mesajınız için teşekkür ederim. Raporu gün sonuna kadar göndereceğim ve
+        faturayla ilgili bir sorun olursa size haber vereceğim. Lütfen ekteki belgeyi kontrol edin ve
+        toplantının hâlâ yarın sabah için planlandığını onaylayın. Hesabı son tarihten önce
+        güncellememiz gerekiyor, aksi takdirde sipariş iptal edilecek. Müsait olduğunuzda beni
+        arayabilir misiniz? Saygılarımla, iyi hafta sonları. Paketiniz kargoya verildi ve üç iş günü
+        içinde ulaşması bekleniyor. Bu, ödemenizin bu hafta vadesinin dolduğuna dair bir
+        hatırlatmadır.""",
+}
+
+def _trigrams(words):
+    for word in words:
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            yield padded[i:i + 3]
+
+def _train(seeds):
+    """Per-language trigram log-probabilities with add-one smoothing, plus the unseen-trigram value"""
+    counts = {language: Counter(_trigrams(_WORD.findall(text.lower()))) for language, text in seeds.items()}
+    vocabulary = set().union(*counts.values())
+    models = {}
+    for language, counter in counts.items():
+        total = sum(counter.values()) + len(vocabulary) + 1
+        models[language] = ({gram: math.log((count + 1) / total) for gram, count in counter.items()},
+                            math.log(1 / total))
+    return models
+
+MODELS = _train(SEED_TEXTS)
+
+def _script_language(text, letters):
+    for language, pattern in SCRIPTS:
+        if len(pattern.findall(text)) >= letters * MIN_SCRIPT_SHARE:
+            if language == "ru" and _UKRAINIAN.search(text):
+                return "uk"
+            # Japanese mixes kana with Han, so kana is checked before Han
+            return language
+    return None
+
+def scores(text):
+    """Mean log-likelihood per trigram for each Latin-script language, best first"""
+    grams = list(_trigrams(_WORD.findall(text.lower())))
+    if not grams:
+        return []
+    results = []
+    for language, (logprobs, unseen) in MODELS.items():
+        total = sum(logprobs.get(gram, unseen) for gram in grams)
+        results.append((total / len(grams), language))
+    return sorted(results, reverse=True)
+
+def detect(text):
+    """ISO 639-1 code of text's language, or "und" when it is too short or ambiguous"""
+    text = _NOISE.sub(" ", (text or "")[:SAMPLE_CHARS])
+    letters = sum(len(word) for word in _WORD.findall(text))
+    if letters < MIN_LETTERS:
+        return UNDETERMINED
+    language = _script_language(text, letters)
+    if language is not None:
+        return language
+    ranked = scores(text)
+    if len(ranked) < 2 or ranked[0][0] - ranked[1][0] < MIN_MARGIN:
+        return UNDETERMINED
+    return ranked[0][1]
+
+def parse_routes(spec):
+    """{"de": "model", "*": "rules"} from "de=model,*=rules" """
+    routes = {}
+    for entry in (spec or "").split(","):
+        language, _, target = entry.partition("=")
+        if language.strip() and target.strip():
+            routes[language.strip().lower()] = target.strip()
+    return routes
+
+def routes_for(task):
+    return parse_routes(os.environ.get(ROUTE_ENV[task], ""))
+
+def route(task, language, default_model):
+    """Model name (or RULES) that should handle text of language for task"""
+    routes = routes_for(task)
+    if language in routes:
+        return routes[language]
+    if language in DEFAULT_LANGUAGES:
+        return default_model
+    return routes.get("*", RULES)
+
+def routed_models(task, default_model):
+    """Every model other than the default that routes_for(task) can pick"""
+    return sorted({target for target in routes_for(task).values() if target not in (RULES, default_model)})
@@ -1,4 +1,4 @@
-const { app, BrowserWindow, ipcMain, Notification, shell, screen, globalShortcut } = require('electron');
+const { app, BrowserWindow, ipcMain, Notification, shell, screen, globalShortcut, dialog } = require('electron');
 const path = require('path');
 const fs = require('fs');
 const crypto = require('crypto'); // Added for PKCE
@@ -870,7 +870,9 @@ function processEmailContent(payload) {
   }
 
   // If HTML content is present but no plain text, try to create a basic plain text version from HTML.
-  if (htmlContent && !textContent) {
+  // This version is only for display; the Python scripts extract their own from the raw HTML.
+  const textFromHtml = Boolean(htmlContent && !textContent);
+  if (textFromHtml) {
     let rawBody = htmlContent;
     rawBody = rawBody.replace(/<style([\s\S]*?)<\/style>/gi, '')
                      .replace(/<script([\s\S]*?)<\/script>/gi, '')
@@ -891,7 +893,7 @@ function processEmailContent(payload) {
   textContent = textContent.replace(/\[image:.*?\]/gi, '').replace(/\s+/g, ' ').trim();
   // htmlContent is kept raw as it will be rendered in an iframe.
 
-  return { textContent, htmlContent, attachments };
+  return { textContent, htmlContent, attachments, textFromHtml };
 }
 
 async function getEmailDetails(messageId) {
@@ -913,15 +915,22 @@ async function getEmailDetails(messageId) {
         if (foundEmail) fromEmail = foundEmail.toLowerCase();
     }
     const subject = headers.find(h => h.name.toLowerCase() === 'subject')?.value || 'No Subject';
+    const storeRecord = analysisStoreRecord(messageId, headers, fromHeader, subject);
 
-    const { textContent, htmlContent, attachments } = processEmailContent(payload); // New line
+    const { textContent, htmlContent, attachments, textFromHtml } = processEmailContent(payload); // New line
     const contentForAnalysis = `${subject}\n\n${textContent}`.trim();
 
     console.log(`Processing email: "${subject}" from ${fromHeader}`);
 
+    // Attachment download and extraction run alongside the body's tone analysis; only the summary waits for them
+    if (settings.enableSummary) {
+      pendingAttachmentText.set(messageId, extractAttachmentText(messageId, attachments));
+    }
+
     let tone;
     if (settings.showUrgency) {
-      tone = await detectEmotionalTone(contentForAnalysis);
+      tone = await detectEmotionalTone(textFromHtml ? subject : contentForAnalysis, fromEmail, headers,
+                                       textFromHtml ? htmlContent : null, storeRecord);
     } else {
       tone = { label: 'NEUTRAL', score: 0.0, urgency: 'low', analysis_source: 'disabled_setting' };
     }
@@ -933,7 +942,9 @@ async function getEmailDetails(messageId) {
       subject,
       body: textContent, // This is the plain text body
       bodyHtml: htmlContent, // This is the HTML body
+      textFromHtml, // body was flattened from bodyHtml, so the scripts are given the HTML instead
       attachments,
+      storeRecord, // identifies the message in the analysis store, for the summary
       id: messageId,
       tone,
       readTime,
@@ -945,22 +956,46 @@ async function getEmailDetails(messageId) {
   }
 }
 
-async function summarizeText(text) {
+// Message fields tone_analyzer.py and summarizer.py record their results under with --store
+function analysisStoreRecord(messageId, headers, fromHeader, subject) {
+  const header = name => headers.find(h => h.name.toLowerCase() === name)?.value;
+  return {
+    message_id: header('message-id') || messageId,
+    sender: fromHeader,
+    subject,
+    date: header('date') || null
+  };
+}
+
+async function summarizeText(text, html = null, attachmentText = '', storeRecord = null) {
   console.log("Summarizing text via Python script...");
-  if (!text || text.trim().length < 100) { // Keep basic check for very short text
+  if (!text || `${text} ${attachmentText}`.trim().length < 100) { // Keep basic check for very short text
     console.log("Text too short or empty for summarization, returning original.");
     return text;
   }
 
   console.log("Input text to summarizer.py:", text); // Added log
-  return executePythonScript('summarizer.py', [], text)
+  // An HTML-only body is passed raw so summarizer.py can extract clean, budgeted text from it;
+  // attachment text is summarized after the body; with a store record the summary is kept in the analysis store
+  const useJson = Boolean(html || attachmentText || storeRecord);
+  const input = useJson
+    ? JSON.stringify({ text: html ? '' : text, html, attachments: attachmentText, ...storeRecord })
+    : text;
+  const summaryArgs = useJson ? ['--reuse', '--json'] : ['--reuse'];
+  if (storeRecord) summaryArgs.push('--store');
+  return executePythonScript('summarizer.py', summaryArgs, input)
     .then(result => {
+      if (result?.skipped) {
+        // No summarization model is routed for this language; the original text reads better than noise
+        console.log(`Summary skipped for language '${result.language}', returning original.`);
+        return text;
+      }
       if (result && result.success && result.summary_text) {
         console.log("Summarization successful via Python script.");
         console.log("Summary text from summarizer.py:", result.summary_text);
 
         const summary = result.summary_text;
-        const originalLength = text.length;
+        const originalLength = text.length + attachmentText.length;
         const summaryLength = summary.length;
 
         // Condition for not effective summary:
@@ -989,10 +1024,26 @@ async function summarizeText(text) {
     });
 }
 
-async function detectEmotionalTone(text) {
+// Headers that let tone_analyzer.py label bulk mail without running the model
+const BULK_MAIL_HEADERS = ['list-unsubscribe', 'list-id', 'precedence', 'auto-submitted', 'x-mailer'];
+
+async function detectEmotionalTone(text, fromEmail = null, headers = null, html = null, storeRecord = null) {
   console.log("Analyzing email tone via Python script for:", text.substring(0, 100) + "...");
   // Python script now handles empty/short text appropriately
-  return executePythonScript('tone_analyzer.py', [], text)
+  // With the sender known, a consistent sender history can answer without the model
+  const toneArgs = fromEmail && fromEmail !== 'unknown@example.com'
+    ? ['--json', '--reuse', '--priors', '--sender', fromEmail]
+    : ['--json', '--reuse'];
+  const bulkHeaders = (headers || []).filter(h => BULK_MAIL_HEADERS.includes(h.name.toLowerCase()));
+  const payload = { text, headers: bulkHeaders };
+  if (html) payload.html = html;
+  // The result is recorded in the analysis store under the message's id
+  if (storeRecord) {
+    Object.assign(payload, storeRecord);
+    toneArgs.push('--store');
+  }
+  const input = JSON.stringify(payload);
+  return executePythonScript('tone_analyzer.py', toneArgs, input)
     .then(result => {
       if (result && result.success && result.label && result.urgency) {
         console.log("Tone analysis successful via Python script:", result);
@@ -1021,6 +1072,66 @@ async function detectEmotionalTone(text) {
     });
 }
 
+// Attachments attachment_text.py can read; anything else is never downloaded
+const ATTACHMENT_TEXT_TYPES = /\.(pdf|docx|pptx|xlsx|html?|txt|csv|md|log|ics|json)$/i;
+// Kinds attachment_text.py reported it cannot read (e.g. pdf without pypdf); never downloaded again this session
+const unavailableAttachmentKinds = new Set();
+const ATTACHMENT_KIND_EXTENSIONS = { pdf: /\.pdf$/i };
+const ATTACHMENT_TEXT_MAX_BYTES = 10 * 1024 * 1024;
+const ATTACHMENT_TEXT_MAX_FILES = 5;
+// Longest the summary waits for attachment text before going ahead with the body alone
+const ATTACHMENT_TEXT_SUMMARY_WAIT_MS = 5000;
+// messageId -> promise of its attachment text, started by getEmailDetails and taken by the summary
+const pendingAttachmentText = new Map();
+
+function takeAttachmentText(messageId) {
+  const promise = pendingAttachmentText.get(messageId) || Promise.resolve('');
+  pendingAttachmentText.delete(messageId);
+  return promise;
+}
+
+function resolveWithin(promise, ms, fallback) {
+  let timer;
+  const timeout = new Promise(resolve => { timer = setTimeout(() => resolve(fallback), ms); });
+  return Promise.race([promise, timeout]).finally(() => clearTimeout(timer));
+}
+
+async function extractAttachmentText(messageId, attachments) {
+  const isUnavailable = filename => [...unavailableAttachmentKinds]
+    .some(kind => ATTACHMENT_KIND_EXTENSIONS[kind]?.test(filename));
+  const readable = (attachments || [])
+    .filter(a => ATTACHMENT_TEXT_TYPES.test(a.filename || '') && (a.size || 0) <= ATTACHMENT_TEXT_MAX_BYTES)
+    .filter(a => !isUnavailable(a.filename || ''))
+    .slice(0, ATTACHMENT_TEXT_MAX_FILES);
+  if (readable.length === 0) return '';
+  try {
+    const files = await Promise.all(readable.map(async a => {
+      const res = await gmail.users.messages.attachments.get({ userId: 'me', messageId, id: a.attachmentId });
+      return { filename: a.filename, mime_type: a.mimeType, data: res.data.data };
+    }));
+    // Each file is extracted in its own sandboxed, time-limited child process
+    const result = await executePythonScript('attachment_text.py', ['--json'], JSON.stringify(files), 30000);
+    for (const [kind, reason] of Object.entries(result?.unavailable || {})) {
+      if (unavailableAttachmentKinds.has(kind)) continue;
+      unavailableAttachmentKinds.add(kind);
+      // Said once per session, so the user knows why those attachments are not summarized
+      console.warn(`${reason}. ${kind.toUpperCase()} attachments will not be included in summaries.`);
+      if (mainWindow && !mainWindow.isDestroyed()) {
+        dialog.showMessageBox(mainWindow, {
+          type: 'info',
+          title: 'Attachment text unavailable',
+          message: `${reason}.`,
+          detail: `${kind.toUpperCase()} attachments will not be included in summaries until it is installed.`
+        }).catch(() => {});
+      }
+    }
+    return result?.success ? (result.text || '') : '';
+  } catch (error) {
+    console.error(`Attachment text extraction failed for ${messageId}:`, error);
+    return '';
+  }
+}
+
 async function processEmailWithOCR(messageId) {
   try {
     // Directly get email details without any OCR fallback.
@@ -2382,6 +2493,8 @@ async function checkForNewEmails() {
 
       for (const emailId of unseenEmailIds) {
         const emailDetails = await processEmailWithOCR(emailId);
+        // Taken whether or not this email is summarized, so no extraction is left behind in the map
+        const attachmentTextPromise = takeAttachmentText(emailId);
         if (emailDetails) {
           // Check if the sender is in the notifiableAuthors list
           if (notifiableAuthors.length === 0 || (emailDetails.fromEmail && notifiableAuthors.includes(emailDetails.fromEmail.toLowerCase()))) {
@@ -2389,7 +2502,10 @@ async function checkForNewEmails() {
             let displayText = emailDetails.body;
             let isSummary = false;
             if (settings.enableSummary && emailDetails.body) {
-              displayText = await summarizeText(emailDetails.body);
+              const attachmentText = await resolveWithin(attachmentTextPromise, ATTACHMENT_TEXT_SUMMARY_WAIT_MS, '');
+              displayText = await summarizeText(emailDetails.body,
+                                                emailDetails.textFromHtml ? emailDetails.bodyHtml : null,
+                                                attachmentText, emailDetails.storeRecord);
               isSummary = displayText !== emailDetails.body;
             }
             const notificationData = { ...emailDetails, body: displayText, isSummary };
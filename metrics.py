@@ -0,0 +1,273 @@
+"""
+metrics.py - in-process metrics registry with Prometheus text exposition
+
+Counters, gauges and histograms with labels, kept in plain dicts behind one
+lock. A registry can be snapshotted to JSON so forked workers can hand their
+numbers to the parent, which merges every snapshot (adding a "worker" label)
+into a single exposition served over localhost HTTP or written to a file for a
+node-exporter textfile collector.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, help_text, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        if not self.labelnames and self.kind != "histogram":
+            # Unlabelled series are exported as 0 from the start rather than appearing later
+            self.values[()] = 0
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self):
+        return {"type": self.kind, "help": self.help, "labelnames": list(self.labelnames),
+                "samples": [[list(key), value] for key, value in self.values.items()]}
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        """Mirror a monotonic count that is kept elsewhere (e.g. by the model manager)"""
+        key = self._key(labels)
+        with self.registry.lock:
+            self.values[key] = value
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def snapshot(self):
+        snap = super().snapshot()
+        snap["buckets"] = list(self.buckets)
+        return snap
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.metrics = {}
+        self.collectors = []
+
+    def _add(self, metric):
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(Counter(self, name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._add(Gauge(self, name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(self, name, help_text, labelnames, buckets))
+
+    def add_collector(self, collect):
+        """Register a callable run before every snapshot to refresh gauges"""
+        self.collectors.append(collect)
+
+    def snapshot(self):
+        for collect in self.collectors:
+            try:
+                collect()
+            except Exception as e:
+                print(f"Metrics collector failed: {e}", file=sys.stderr)
+        with self.lock:
+            return json.loads(json.dumps({name: m.snapshot() for name, m in self.metrics.items()}))
+
+REGISTRY = Registry()
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render(snapshots):
+    """Prometheus text format for a list of (extra_labels, snapshot) pairs, merged per family"""
+    families = {}
+    for extra, snapshot in snapshots:
+        for name, family in snapshot.items():
+            entry = families.setdefault(name, {"family": family, "series": []})
+            entry["series"].append((extra, family))
+
+    lines = []
+    for name in sorted(families):
+        family = families[name]["family"]
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        for extra, series in families[name]["series"]:
+            names = series["labelnames"]
+            for values, value in series["samples"]:
+                if series["type"] != "histogram":
+                    lines.append(f"{name}{_labels(names, values, extra)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(series["buckets"], value["counts"]):
+                    cumulative += count
+                    le = dict(extra or {}, le=_number(bound))
+                    lines.append(f"{name}_bucket{_labels(names, values, le)} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(names, values, dict(extra or {}, le='+Inf'))} {value['count']}")
+                lines.append(f"{name}_sum{_labels(names, values, extra)} {_number(value['sum'])}")
+                lines.append(f"{name}_count{_labels(names, values, extra)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+def process_rss_bytes():
+    """Current resident set size of this process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        try:
+            import resource
+        except ImportError:
+            return 0
+        # Peak rather than current, but the best portable approximation
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+def listen_queue_depth(port):
+    """Connections waiting in a local listening socket's accept queue (Linux only)"""
+    for path in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(path) as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    local, state, queues = fields[1], fields[3], fields[4]
+                    # 0A is LISTEN; for listening sockets rx_queue is the accept backlog
+                    if state == "0A" and int(local.rsplit(":", 1)[1], 16) == port:
+                        return int(queues.split(":")[1], 16)
+        except (OSError, ValueError, IndexError, StopIteration):
+            continue
+    return None
+
+def write_atomic(path, content):
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+def write_snapshot_periodically(registry, path, interval):
+    """Daemon thread that keeps path updated with registry's JSON snapshot"""
+    def loop():
+        while True:
+            try:
+                write_atomic(path, json.dumps(registry.snapshot()))
+            except OSError as e:
+                print(f"Could not write metrics snapshot: {e}", file=sys.stderr)
+            time.sleep(interval)
+    thread = threading.Thread(target=loop, name="metrics-snapshot", daemon=True)
+    thread.start()
+    return thread
+
+def read_snapshots(directory):
+    """(labels, snapshot) for every worker snapshot file in directory"""
+    snapshots = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, filename), encoding="utf-8") as f:
+                snapshots.append(({"worker": filename[:-5]}, json.load(f)))
+        except (OSError, ValueError):
+            continue  # Mid-rewrite or removed; it will be picked up next scrape
+    return snapshots
+
+def serve_http(render_text, host, port):
+    """Serve render_text() at /metrics from a daemon thread"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = render_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+def write_file_periodically(render_text, path, interval):
+    """Daemon thread that rewrites path with render_text() every interval seconds"""
+    def loop():
+        while True:
+            try:
+                write_atomic(path, render_text())
+            except OSError as e:
+                print(f"Could not write metrics file: {e}", file=sys.stderr)
+            time.sleep(interval)
+    thread = threading.Thread(target=loop, name="metrics-file", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,141 @@
+"""
+model_manager.py - on-demand model residency for the long-lived worker
+
+bart-large-cnn and bart-large-mnli together keep ~3 GB resident. The manager
+loads a model the first time it is asked for, remembers its size, and evicts the
+least-recently-used model when a memory budget would be exceeded or when a model
+has sat idle past a timeout. Both checkpoints ship as safetensors, which
+transformers memory-maps on load, so a reload after eviction is served from the
+page cache rather than re-parsed from disk.
+"""
+
+import sys
+import gc
+import time
+import threading
+from collections import OrderedDict
+
+def model_size_bytes(model):
+    """Bytes held by a pipeline's (or bare module's) parameters and buffers"""
+    module = getattr(model, "model", model)
+    try:
+        tensors = list(module.parameters()) + list(module.buffers())
+    except AttributeError:
+        return 0
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+class ModelManager:
+    """LRU cache of loaded models bounded by a memory budget and an idle timeout.
+
+    get() mirrors dict.get so callers that used a plain {task: model} dict keep
+    working: it returns the model, or None when it cannot be loaded.
+    """
+
+    def __init__(self, loaders, memory_budget_mb=None, idle_timeout=None):
+        self.loaders = dict(loaders)
+        self.memory_budget = memory_budget_mb * 1024 * 1024 if memory_budget_mb else None
+        self.idle_timeout = idle_timeout
+        self._resident = OrderedDict()  # name -> model, least recently used first
+        self._last_used = {}
+        self._sizes = {}                # remembered across evictions to plan ahead
+        self.hit_counts = {name: 0 for name in self.loaders}
+        self.load_counts = {name: 0 for name in self.loaders}
+        self.evict_counts = {name: 0 for name in self.loaders}
+        self.load_seconds = {name: 0.0 for name in self.loaders}
+        self._lock = threading.RLock()
+        self._reaper = None
+
+    def get(self, name, default=None):
+        if name not in self.loaders:
+            return default
+        with self._lock:
+            if name in self._resident:
+                self._resident.move_to_end(name)
+                self._last_used[name] = time.monotonic()
+                self.hit_counts[name] += 1
+                return self._resident[name]
+
+            # Make room up front when the size is known from an earlier load
+            self._enforce_budget(incoming=self._sizes.get(name, 0))
+            start = time.monotonic()
+            model = self.loaders[name]()
+            if model is None:
+                return default
+            self.load_seconds[name] += time.monotonic() - start
+            self.load_counts[name] += 1
+            self._sizes[name] = model_size_bytes(model)
+            self._resident[name] = model
+            self._last_used[name] = time.monotonic()
+            self._enforce_budget(keep=name)
+            return model
+
+    def evict(self, name, reason="manual"):
+        with self._lock:
+            if self._resident.pop(name, None) is None:
+                return False
+            self._last_used.pop(name, None)
+            self.evict_counts[name] += 1
+        # Drop the last reference before collecting so the weights are actually freed
+        gc.collect()
+        print(f"Evicted model '{name}' ({reason})", file=sys.stderr)
+        return True
+
+    def resident_bytes(self):
+        with self._lock:
+            return sum(self._sizes.get(name, 0) for name in self._resident)
+
+    def _enforce_budget(self, incoming=0, keep=None):
+        if not self.memory_budget:
+            return
+        while self._resident and self.resident_bytes() + incoming > self.memory_budget:
+            victim = next((name for name in self._resident if name != keep), None)
+            if victim is None:
+                # A single model larger than the budget stays loaded; evicting it would thrash
+                break
+            self.evict(victim, reason="memory budget")
+
+    def evict_idle(self):
+        """Evict every model unused for longer than idle_timeout; returns the evicted names"""
+        if not self.idle_timeout:
+            return []
+        now = time.monotonic()
+        with self._lock:
+            idle = [name for name in self._resident
+                    if now - self._last_used.get(name, now) > self.idle_timeout]
+        return [name for name in idle if self.evict(name, reason="idle timeout")]
+
+    def start_idle_reaper(self, interval=None):
+        """Check for idle models in a daemon thread"""
+        if not self.idle_timeout or self._reaper:
+            return
+        interval = interval or max(1.0, self.idle_timeout / 4)
+
+        def reap():
+            while True:
+                time.sleep(interval)
+                self.evict_idle()
+
+        self._reaper = threading.Thread(target=reap, name="model-idle-reaper", daemon=True)
+        self._reaper.start()
+
+    def stats(self):
+        """Current residency plus cumulative hit/load/evict counts"""
+        now = time.monotonic()
+        with self._lock:
+            resident = {
+                name: {
+                    "size_mb": round(self._sizes.get(name, 0) / (1024 * 1024), 1),
+                    "idle_s": round(now - self._last_used.get(name, now), 1)
+                }
+                for name in self._resident
+            }
+            return {
+                "resident": resident,
+                "resident_mb": round(self.resident_bytes() / (1024 * 1024), 1),
+                "memory_budget_mb": round(self.memory_budget / (1024 * 1024), 1) if self.memory_budget else None,
+                "idle_timeout_s": self.idle_timeout,
+                "hits": dict(self.hit_counts),
+                "loads": dict(self.load_counts),
+                "evictions": dict(self.evict_counts),
+                "load_seconds": {name: round(s, 2) for name, s in self.load_seconds.items()}
+            }
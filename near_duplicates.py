@@ -0,0 +1,268 @@
+"""
+near_duplicates.py - reuse tone and summary results across near-identical mail
+
+Newsletters and automated notifications differ only in names, dates, links and
+tracking codes, so an exact-hash cache never hits. Each text is reduced to
+normalized word 3-shingles (URLs, addresses and long ID-like tokens replaced by
+placeholders; for tone, numbers too) and a 64-value MinHash signature. Stored
+signatures are bucketed by LSH banding (16 bands of 4 values), so a lookup reads
+a handful of candidates instead of scanning, and a candidate is only reused when
+its estimated Jaccard similarity clears the task's threshold.
+
+Entries live in SQLite (WAL) and are namespaced by task and model, so results
+from a different checkpoint are never reused; only successful results produced
+by that model are stored. A reused result carries
+"reused_from": {"ref": <message id or content hash>, "similarity": 0.93}.
+
+Enable with --reuse on tone_analyzer.py / summarizer.py / worker_server.py /
+backfill.py (the two scripts also honor WHISPRMAIL_REUSE=1); WHISPRMAIL_REUSE_DB
+overrides the path (default ~/.whisprmail/near_duplicates.db).
+"""
+
+import sys
+import os
+import re
+import json
+import time
+import zlib
+import hashlib
+import sqlite3
+import threading
+
+import numpy as np
+
+DEFAULT_REUSE_PATH = os.path.join(os.path.expanduser("~"), ".whisprmail", "near_duplicates.db")
+NUM_PERM = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_PERM // BANDS
+SHINGLE_WORDS = 3
+# Summaries repeat names and dates from the text, so they need a closer match than a tone label
+DEFAULT_THRESHOLDS = {"tone": 0.8, "summarize": 0.9}
+MAX_ENTRIES = 50_000
+MAX_CANDIDATES = 64
+# Shingles hashed per block, so the shingles x NUM_PERM product stays ~2 MB however long the text
+SIGNATURE_BLOCK = 4096
+# Keys that describe one run or one input rather than the result, dropped before storing
+VOLATILE_KEYS = ("timings", "memory", "event", "id", "reused_from", "load_ms", "time_to_first_token_ms",
+                 "total_ms", "text_length")
+
+# Universal hashing a*x + b mod p over 32-bit shingle hashes; a fixed seed keeps
+# stored signatures comparable across runs
+_PRIME = 4294967291  # largest prime below 2**32
+_rng = np.random.default_rng(0x5EED)
+_A = _rng.integers(1, _PRIME, NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, _PRIME, NUM_PERM, dtype=np.uint64)
+
+_URL = re.compile(r"(?:https?://|www\.)\S+")
+_ADDRESS = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+_ID_TOKEN = re.compile(r"\b(?=[a-z_]*\d)\w{12,}\b")  # tracking codes, hashes, order IDs
+_NUMBER = re.compile(r"\d+")
+_WORD = re.compile(r"\w+")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    namespace TEXT NOT NULL,
+    ref TEXT NOT NULL,
+    signature BLOB NOT NULL,
+    result TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS buckets (
+    namespace TEXT NOT NULL,
+    key INTEGER NOT NULL,
+    entry_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS buckets_by_key ON buckets(namespace, key);
+CREATE INDEX IF NOT EXISTS buckets_by_entry ON buckets(entry_id);
+CREATE INDEX IF NOT EXISTS entries_by_namespace ON entries(namespace, id);
+"""
+
+def reuse_path(path=None):
+    return path or os.environ.get("WHISPRMAIL_REUSE_DB", DEFAULT_REUSE_PATH)
+
+def normalized_words(text, keep_numbers=False):
+    text = _URL.sub(" url ", text.lower())
+    text = _ADDRESS.sub(" address ", text)
+    text = _ID_TOKEN.sub(" code ", text)
+    if not keep_numbers:
+        text = _NUMBER.sub("0", text)
+    return _WORD.findall(text)
+
+def signature(text, task="tone"):
+    """MinHash signature (NUM_PERM uint32 values) of text's shingles, or None for empty text"""
+    words = normalized_words(text or "", keep_numbers=task == "summarize")
+    if not words:
+        return None
+    if len(words) < SHINGLE_WORDS:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    minimum = np.full(NUM_PERM, _PRIME, dtype=np.uint64)
+    for start in range(0, len(hashes), SIGNATURE_BLOCK):
+        # (2**32)**2 + 2**32 still fits in uint64, so the products cannot overflow
+        block = (np.multiply.outer(hashes[start:start + SIGNATURE_BLOCK], _A) + _B) % _PRIME
+        np.minimum(minimum, block.min(axis=0), out=minimum)
+    return minimum.astype(np.uint32)
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of the two signatures' shingle sets"""
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+def band_keys(sig):
+    """One signed 64-bit bucket key per LSH band"""
+    keys = []
+    for band in range(BANDS):
+        chunk = sig[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].tobytes()
+        digest = hashlib.blake2b(bytes([band]) + chunk, digest_size=8).digest()
+        keys.append(int.from_bytes(digest, "big", signed=True))
+    return keys
+
+def content_ref(text):
+    """Stable reference for a text that arrived without a message ID"""
+    return "sha:" + hashlib.blake2b((text or "").encode("utf-8"), digest_size=8).hexdigest()
+
+def mark_reused(result, ref, score, text):
+    reused = dict(result)
+    reused["reused_from"] = {"ref": ref, "similarity": round(score, 3)}
+    # Describes the text being answered, not the one the result came from
+    reused["text_length"] = len(text)
+    return reused
+
+class NearDuplicateIndex:
+    """MinHash-LSH index of stored results, one namespace per task and model"""
+
+    def __init__(self, path=None, max_entries=MAX_ENTRIES):
+        self.path = reuse_path(path)
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        if self.path != ":memory:":
+            self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA busy_timeout=5000")
+        self.connection.executescript(SCHEMA)
+        self.max_entries = max_entries
+        self._adds = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, task, model, sig, threshold=None):
+        """(result, ref, similarity) of the closest stored match above threshold, or None"""
+        if sig is None:
+            return None
+        threshold = DEFAULT_THRESHOLDS.get(task, 0.9) if threshold is None else threshold
+        keys = band_keys(sig)
+        with self._lock:
+            candidates = self.connection.execute(
+                "SELECT e.ref, e.signature, e.result FROM entries e WHERE e.id IN ("
+                "  SELECT entry_id FROM buckets WHERE namespace = ? AND key IN "
+                f"  ({', '.join('?' for _ in keys)})) ORDER BY e.id DESC LIMIT ?",
+                [f"{task}:{model}"] + keys + [MAX_CANDIDATES]).fetchall()
+        best = None
+        for ref, blob, result in candidates:
+            score = similarity(sig, np.frombuffer(blob, dtype=np.uint32))
+            if score >= threshold and (best is None or score > best[2]):
+                best = (result, ref, score)
+        if best is None:
+            return None
+        return json.loads(best[0]), best[1], best[2]
+
+    def add(self, task, model, ref, sig, result):
+        """Store a result under its signature"""
+        if sig is None:
+            return
+        namespace = f"{task}:{model}"
+        stored = {key: value for key, value in result.items() if key not in VOLATILE_KEYS}
+        with self._lock, self.connection:
+            entry_id = self.connection.execute(
+                "INSERT INTO entries (namespace, ref, signature, result, created_at) VALUES (?, ?, ?, ?, ?)",
+                (namespace, ref, sig.tobytes(), json.dumps(stored), time.time())).lastrowid
+            self.connection.executemany(
+                "INSERT INTO buckets (namespace, key, entry_id) VALUES (?, ?, ?)",
+                [(namespace, key, entry_id) for key in band_keys(sig)])
+            self._adds += 1
+            if self._adds % 1000 == 0:
+                self._prune(namespace)
+
+    def _prune(self, namespace):
+        """Drop the oldest entries beyond max_entries"""
+        row = self.connection.execute(
+            "SELECT id FROM entries WHERE namespace = ? ORDER BY id DESC LIMIT 1 OFFSET ?",
+            (namespace, self.max_entries)).fetchone()
+        if row is None:
+            return
+        self.connection.execute(
+            "DELETE FROM buckets WHERE entry_id IN (SELECT id FROM entries WHERE namespace = ? AND id <= ?)",
+            (namespace, row[0]))
+        self.connection.execute("DELETE FROM entries WHERE namespace = ? AND id <= ?", (namespace, row[0]))
+
+    def close(self):
+        self.connection.close()
+
+def open_index(path=None):
+    try:
+        return NearDuplicateIndex(path)
+    except sqlite3.Error as e:
+        print(f"Near-duplicate reuse disabled: {e}", file=sys.stderr)
+        return None
+
+def analyze_with_reuse(index, task, model, texts, refs, analyze, threshold=None):
+    """Results for texts in order, calling analyze(list_of_texts) only for texts with no near duplicate.
+
+    Near duplicates within the batch itself are analyzed once too. Fresh results are stored
+    when they succeeded and came from model (so rules fallbacks are never reused as model output).
+    """
+    threshold = DEFAULT_THRESHOLDS.get(task, 0.9) if threshold is None else threshold
+    results = [None] * len(texts)
+    signatures = [signature(text, task) for text in texts]
+    followers = {}  # index -> (leader index, similarity)
+    batch_buckets = {}
+    todo = []
+    for i, sig in enumerate(signatures):
+        hit = index.lookup(task, model, sig, threshold)
+        if hit is not None:
+            result, ref, score = hit
+            results[i] = mark_reused(result, ref, score, texts[i])
+            continue
+        leader = None
+        if sig is not None:
+            keys = band_keys(sig)
+            candidates = {j for key in keys for j in batch_buckets.get(key, ())}
+            scored = [(similarity(sig, signatures[j]), j) for j in candidates]
+            scored = [(score, j) for score, j in scored if score >= threshold]
+            if scored:
+                score, leader = max(scored)
+                followers[i] = (leader, score)
+            else:
+                for key in keys:
+                    batch_buckets.setdefault(key, []).append(i)
+        if leader is None:
+            todo.append(i)
+
+    def run(indices):
+        for i, result in zip(indices, analyze([texts[i] for i in indices])):
+            results[i] = result
+            if result.get("success") and result.get("analysis_source", model) == model:
+                try:
+                    index.add(task, model, refs[i], signatures[i], result)
+                except sqlite3.Error as e:
+                    print(f"Could not store result for reuse: {e}", file=sys.stderr)
+
+    if todo:
+        run(todo)
+    # A failed leader's error is not worth copying; those followers get their own attempt
+    retry = [i for i, (leader, _) in followers.items() if not results[leader].get("success")]
+    if retry:
+        run(retry)
+    for i, (leader, score) in followers.items():
+        if results[i] is not None:
+            continue
+        leader_result = {key: value for key, value in results[leader].items() if key not in VOLATILE_KEYS}
+        results[i] = mark_reused(leader_result, refs[leader], score, texts[i])
+    return results
+
+def reuse_or_run(index, task, model, text, run, ref=None, threshold=None):
+    """Single-text analyze_with_reuse: a stored near duplicate's result, else run(text)"""
+    return analyze_with_reuse(index, task, model, [text], [ref or content_ref(text)],
+                              lambda texts: [run(texts[0])], threshold)[0]
@@ -0,0 +1,407 @@
+"""
+profiling.py - opt-in per-stage instrumentation for the ML workers
+
+A StageTimer accumulates wall time per named stage (import, load, tokenize,
+forward, generate, postprocess) plus token counts, and is attached to a result
+as its "timings" object. Every hook takes the timer as an optional argument and
+does nothing when it is None, so the default path pays one `is None` check.
+
+Tracing is the per-process counterpart for a single slow email: once a CLI run
+calls enable_tracing(), every stage plus the trace-only spans (stdin read, each
+classifier call, each decoder step, JSON serialization) is recorded as a Chrome
+trace event and written out at exit, ready for chrome://tracing or Perfetto.
+While it is off the module-level tracer is None and span() returns a shared
+no-op context.
+
+Memory profiling follows the same pattern: enable_memory_profiling() makes every
+stage also record its RSS growth and how far it pushed the process's peak RSS,
+while the pipeline hooks note the size of the tokenizer output and model output,
+so a ballooning worker can be pinned on the input string, the encodings or the
+forward pass's activations. tracemalloc top allocators are optional because
+tracing Python allocations slows imports down considerably.
+
+For cold starts, process_started() and timed_imports() let a script's
+--profile-startup mode split its startup into interpreter start, per-module
+imports, model resolution, weight loading and first-inference warm-up.
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import importlib
+import itertools
+import tracemalloc
+import threading
+import contextlib
+import functools
+import inspect
+from collections.abc import Mapping
+
+_NULL_CONTEXT = contextlib.nullcontext()
+# Both scripts import this module first thing, so this approximates "script code started running"
+MODULE_LOADED = time.perf_counter()
+_tracer = None
+_memory = None
+
+def timings_requested(flag=False):
+    """True when --timings was passed or WHISPRMAIL_TIMINGS is set"""
+    return flag or os.environ.get("WHISPRMAIL_TIMINGS", "").lower() in ("1", "true", "yes")
+
+def memory_profile_requested(flag=False):
+    """True when --memory-profile was passed or WHISPRMAIL_MEMORY_PROFILE is set"""
+    return flag or os.environ.get("WHISPRMAIL_MEMORY_PROFILE", "").lower() in ("1", "true", "yes")
+
+def trace_path_requested(path=None):
+    """The --trace path, else WHISPRMAIL_TRACE, else None"""
+    return path or os.environ.get("WHISPRMAIL_TRACE") or None
+
+def process_started():
+    """perf_counter() value at process creation, from /proc (Linux, 10 ms resolution); None elsewhere"""
+    try:
+        with open("/proc/self/stat") as f:
+            stat = f.read()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        now = time.perf_counter()
+        # Fields after the parenthesised command name start at field 3; starttime is field 22
+        start_ticks = int(stat.rsplit(")", 1)[1].split()[19])
+        return now - (uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def timed_imports(names):
+    """Import modules in the given order; seconds per module (0.0 for ones already imported)"""
+    seconds = {}
+    for name in names:
+        if name in sys.modules:
+            seconds[name] = 0.0
+            continue
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            continue
+        seconds[name] = time.perf_counter() - start
+    return seconds
+
+class Tracer:
+    """Collects Chrome trace "complete" events for this process"""
+
+    def __init__(self, started=None, process_name=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.process_name = process_name or os.path.basename(sys.argv[0]) or "python"
+        self.pid = os.getpid()
+        self.events = []
+
+    def record(self, name, start, end, args=None):
+        event = {
+            "name": name,
+            "cat": "whisprmail",
+            "ph": "X",
+            "ts": round((start - self.started) * 1e6, 3),
+            "dur": round((end - start) * 1e6, 3),
+            "pid": self.pid,
+            "tid": threading.get_native_id()
+        }
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+    def as_dict(self):
+        metadata = {"name": "process_name", "ph": "M", "pid": self.pid, "tid": 0,
+                    "args": {"name": self.process_name}}
+        return {"traceEvents": [metadata] + self.events, "displayTimeUnit": "ms"}
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.as_dict(), f)
+        print(f"Trace written to {path} ({len(self.events)} events)", file=sys.stderr)
+
+def enable_tracing(path, started=None):
+    """Start recording spans for the rest of the process and write them to path at exit"""
+    global _tracer
+    _tracer = Tracer(started)
+    atexit.register(_tracer.write, path)
+    return _tracer
+
+def record_span(name, start, end, **args):
+    """Record an already-measured interval (e.g. a module-level import) when tracing"""
+    if _tracer is not None:
+        _tracer.record(name, start, end, args)
+
+def _peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows; per-stage RSS deltas are still reported
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+def _tensor_bytes(value):
+    """Bytes held by the tensors in a tokenizer/model output mapping"""
+    if not isinstance(value, Mapping):
+        return 0
+    return sum(v.numel() * v.element_size() for v in value.values()
+               if hasattr(v, "numel") and hasattr(v, "element_size"))
+
+def _mb(nbytes):
+    return round(nbytes / (1024 * 1024), 2) if nbytes is not None else None
+
+class MemoryProfiler:
+    """Per-stage RSS growth, peak RSS and optional tracemalloc top allocators for one run"""
+
+    def __init__(self, top_allocators=0):
+        from metrics import process_rss_bytes
+        self.rss = process_rss_bytes
+        self.top_allocators = top_allocators
+        self.stages = {}
+        self.objects = {}
+        if top_allocators and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.start_rss = self.rss()
+
+    def mark(self):
+        python = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+        return self.rss(), _peak_rss_bytes(), python
+
+    def record(self, name, mark):
+        rss, peak, python = mark
+        after_rss, after_peak, after_python = self.mark()
+        entry = self.stages.setdefault(name, {"calls": 0, "rss_delta": 0, "peak_growth": 0, "python_delta": 0})
+        entry["calls"] += 1
+        entry["rss_delta"] += after_rss - rss
+        if peak is not None:
+            # Only a stage that raises the high-water mark shows here (activations, weights)
+            entry["peak_growth"] += after_peak - peak
+        if python is not None:
+            entry["python_delta"] += after_python - python
+
+    def note(self, name, nbytes):
+        """Keep the largest size seen for one kind of object (input text, encodings, logits)"""
+        self.objects[name] = max(self.objects.get(name, 0), int(nbytes))
+
+    def as_dict(self):
+        stages = {}
+        for name, entry in self.stages.items():
+            stages[name] = {"calls": entry["calls"],
+                            "rss_delta_mb": _mb(entry["rss_delta"]),
+                            "peak_rss_growth_mb": _mb(entry["peak_growth"])}
+            if tracemalloc.is_tracing():
+                stages[name]["python_delta_mb"] = _mb(entry["python_delta"])
+        memory = {
+            "rss_start_mb": _mb(self.start_rss),
+            "rss_end_mb": _mb(self.rss()),
+            "peak_rss_mb": _mb(_peak_rss_bytes()),
+            "stages": stages,
+            "object_bytes": dict(self.objects)
+        }
+        if tracemalloc.is_tracing():
+            memory["python_peak_mb"] = _mb(tracemalloc.get_traced_memory()[1])
+            memory["top_allocators"] = self.top_allocations()
+        return memory
+
+    def top_allocations(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>")
+        ))
+        return [{"where": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                 "size_kb": round(stat.size / 1024, 1), "count": stat.count}
+                for stat in snapshot.statistics("lineno")[:self.top_allocators]]
+
+def enable_memory_profiling(top_allocators=0):
+    """Record per-stage memory for the rest of the process; attach as_dict() to the result"""
+    global _memory
+    _memory = MemoryProfiler(top_allocators)
+    return _memory
+
+def note_size(name, nbytes):
+    """Record an object's size when memory profiling"""
+    if _memory is not None:
+        _memory.note(name, nbytes)
+
+def note_tensors(name, value):
+    """Record the size of a tokenizer/model output mapping when memory profiling"""
+    if _memory is not None:
+        _memory.note(name, _tensor_bytes(value))
+
+def _start():
+    return time.perf_counter(), (_memory.mark() if _memory is not None else None)
+
+def _record(timer, name, started, args=None):
+    start, mark = started
+    end = time.perf_counter()
+    if timer is not None:
+        timer.add(name, end - start)
+    if _tracer is not None:
+        _tracer.record(name, start, end, args)
+    if mark is not None:
+        _memory.record(name, mark)
+
+@contextlib.contextmanager
+def _recorded(timer, name, args=None):
+    started = _start()
+    try:
+        yield
+    finally:
+        _record(timer, name, started, args)
+
+def span(name, **args):
+    """A trace-only span, or a shared no-op context when tracing is off"""
+    if _tracer is None:
+        return _NULL_CONTEXT
+    return _traced(name, args)
+
+@contextlib.contextmanager
+def _traced(name, args):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _tracer.record(name, start, time.perf_counter(), args)
+
+class StageTimer:
+    """Accumulates per-stage durations and counters for one request"""
+
+    def __init__(self, started=None):
+        # started lets a script count time spent before the timer existed (module imports)
+        self.started = started if started is not None else time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name, amount):
+        self.counters[name] = self.counters.get(name, 0) + int(amount)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def as_dict(self):
+        timings = {f"{name}_ms": round(seconds * 1000, 3) for name, seconds in self.stages.items()}
+        timings.update(self.counters)
+        timings["total_ms"] = round((time.perf_counter() - self.started) * 1000, 3)
+        return timings
+
+def stage(timer, name):
+    """timer.stage(name) (also traced/memory-profiled when enabled), or a shared no-op context"""
+    if _tracer is None and _memory is None:
+        return timer.stage(name) if timer is not None else _NULL_CONTEXT
+    return _recorded(timer, name)
+
+def _count_tokens(timer, counter, value):
+    """Add the number of real (unpadded) tokens in a tokenizer/generate output"""
+    if not isinstance(value, Mapping):
+        return
+    mask = value.get("attention_mask")
+    if mask is not None:
+        timer.count(counter, int(mask.sum()))
+        return
+    ids = value.get("input_ids")
+    if ids is not None:
+        timer.count(counter, ids.numel())
+
+def _timed_generator(timer, name, generator, on_item=None):
+    while True:
+        started = _start()
+        try:
+            item = next(generator)
+        except StopIteration:
+            _record(timer, name, started)
+            return
+        _record(timer, name, started)
+        if on_item:
+            on_item(item)
+        yield item
+
+def _wrap_stage(timer, name, method, on_result=None):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        started = _start()
+        result = method(*args, **kwargs)
+        if inspect.isgenerator(result):
+            # Chunk pipelines (zero-shot) yield one tokenized pair per candidate label
+            _record(timer, name, started)
+            return _timed_generator(timer, name, result, on_result)
+        _record(timer, name, started)
+        if on_result:
+            on_result(result)
+        return result
+    return wrapper
+
+@contextlib.contextmanager
+def instrument_pipeline(pipe, timer, forward_stage="forward"):
+    """Time a transformers pipeline's preprocess/_forward/postprocess for the duration of a call.
+
+    Instance attributes shadow the class methods, so the pipeline's own code
+    path (and therefore its output) is unchanged.
+    """
+    if pipe is None or (timer is None and _tracer is None and _memory is None):
+        yield
+        return
+
+    def on_tokenized(value):
+        if timer is not None:
+            _count_tokens(timer, "tokens_in", value)
+        note_tensors("tokenizer_output", value)
+
+    def on_forward(output):
+        # Generation pipelines return the produced ids; classifiers return logits
+        if timer is not None and isinstance(output, Mapping) and "output_ids" in output:
+            timer.count("tokens_out", output["output_ids"].shape[-1])
+        note_tensors("model_output", output)
+
+    pipe.preprocess = _wrap_stage(timer, "tokenize", type(pipe).preprocess.__get__(pipe), on_tokenized)
+    pipe._forward = _wrap_stage(timer, forward_stage, type(pipe)._forward.__get__(pipe), on_forward)
+    pipe.postprocess = _wrap_stage(timer, "postprocess", type(pipe).postprocess.__get__(pipe))
+    model = getattr(pipe, "model", None)
+    can_generate = getattr(model, "can_generate", lambda: False)()
+    try:
+        with trace_generation_steps(model if can_generate else None):
+            yield
+    finally:
+        del pipe.preprocess, pipe._forward, pipe.postprocess
+
+@contextlib.contextmanager
+def trace_generation_steps(model):
+    """Trace the encoder pass and every decoder step of model.generate() while tracing is on"""
+    tracer = _tracer
+    if tracer is None or model is None:
+        yield
+        return
+
+    handles = []
+
+    def hook(module, name):
+        starts = []
+        steps = itertools.count()
+
+        def before(module, args):
+            starts.append(time.perf_counter())
+
+        def after(module, args, output):
+            start = starts.pop()
+            tracer.record(name, start, time.perf_counter(), {"step": next(steps)})
+
+        handles.append(module.register_forward_pre_hook(before))
+        handles.append(module.register_forward_hook(after))
+
+    # generate() runs the encoder once, then calls the full model once per decoder step
+    encoder = model.get_encoder() if hasattr(model, "get_encoder") else None
+    if encoder is not None:
+        hook(encoder, "encode")
+    hook(model, "decode step")
+    try:
+        yield
+    finally:
+        for handle in handles:
+            handle.remove()
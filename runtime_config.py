@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+runtime_config.py - torch thread and CPU affinity settings for the ML workers
+
+Without explicit limits every tone/summary process sizes its torch thread pool
+to all cores, so two concurrent processes oversubscribe the machine and slow
+each other down. Unless configured, each process gets the physical cores it may
+run on divided by the number of ML processes expected at once (the tone and
+summary scripts, so 2). Settings are read from a JSON file (written by the
+autotune command below, which keeps tuned values per task under "tasks") and
+can be overridden per process with environment variables:
+
+    WHISPRMAIL_RUNTIME_CONFIG   path of the JSON file
+    WHISPRMAIL_INTRA_THREADS    torch intra-op threads
+    WHISPRMAIL_INTEROP_THREADS  torch inter-op threads
+    WHISPRMAIL_CPU_AFFINITY     cores to pin to, e.g. "0-3,6"
+    WHISPRMAIL_BATCH_SIZE       batch size for bulk tone analysis
+    WHISPRMAIL_WORKERS          ML processes sharing the cores
+
+Usage:
+    python runtime_config.py show
+    python runtime_config.py autotune --task tone --batch-sizes 1,4,8 --threads 1,2,4
+"""
+
+import sys
+import os
+import json
+import time
+import argparse
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.expanduser("~"), ".whisprmail", "runtime.json")
+
+DEFAULTS = {
+    "intra_op_threads": None,   # None: physical cores / workers
+    "inter_op_threads": None,
+    "cpu_affinity": None,       # None keeps the inherited affinity
+    "batch_size": 8,
+    "workers": 2                # tone and summary processes can run at the same time
+}
+# Settings autotune keeps per task
+TASK_KEYS = ("intra_op_threads", "batch_size")
+TASKS = ("tone", "summarize")
+
+ENV_OVERRIDES = {
+    "intra_op_threads": "WHISPRMAIL_INTRA_THREADS",
+    "inter_op_threads": "WHISPRMAIL_INTEROP_THREADS",
+    "cpu_affinity": "WHISPRMAIL_CPU_AFFINITY",
+    "batch_size": "WHISPRMAIL_BATCH_SIZE",
+    "workers": "WHISPRMAIL_WORKERS"
+}
+
+# Representative email bodies for benchmarking; lengths span a short notice to a long thread
+SAMPLE_TEXTS = [
+    "Server is down, need help immediately!!! Customers cannot log in.",
+    "Hi team, attached are the notes from today's meeting. Let me know if I missed anything.",
+    "Reminder: the quarterly report is due Friday. Please send your section by Thursday noon "
+    "so there is time to review and consolidate everything before submission.",
+    "Thanks so much for the great work on the launch, everyone really appreciated the effort "
+    "you put in over the last few weeks. Drinks are on me next time we are in the office.",
+    "Big summer sale! Save up to 50% on all items this weekend only. Free shipping on orders "
+    "over $50. Unsubscribe at any time using the link at the bottom of this message. " * 3,
+    "I am really frustrated that the invoice was wrong again. This is the third time this "
+    "month and we still have not received a corrected copy. Please fix this today."
+]
+
+def config_path():
+    return os.environ.get("WHISPRMAIL_RUNTIME_CONFIG", DEFAULT_CONFIG_PATH)
+
+def parse_cpu_list(value):
+    """Parse "0-3,6" (or a JSON list) into a sorted list of core ids"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (list, tuple)):
+        return sorted({int(core) for core in value})
+    cores = set()
+    for part in str(value).split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            cores.update(range(int(first), int(last) + 1))
+        else:
+            cores.add(int(part))
+    return sorted(cores)
+
+def read_config_file(path=None):
+    """The JSON config file as written, or {} when it is missing or unreadable"""
+    path = path or config_path()
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError("expected a JSON object")
+        return data
+    except (OSError, ValueError) as e:
+        print(f"Warning: ignoring unreadable runtime config {path}: {e}", file=sys.stderr)
+        return {}
+
+def _positive_int(value, source, fallback):
+    """value as a positive int, else fallback with a warning naming where value came from"""
+    try:
+        number = int(value)
+        if number < 1:
+            raise ValueError("must be at least 1")
+        return number
+    except (TypeError, ValueError) as e:
+        using = "the default" if fallback is None else fallback
+        print(f"Warning: ignoring invalid {source}={value!r} ({e}), using {using}", file=sys.stderr)
+        return fallback
+
+def load_runtime_config(task=None, workers=None):
+    """Defaults, then the JSON config file and its section for task, then environment overrides.
+
+    workers overrides the number of ML processes the default thread count
+    divides the cores between (worker_server.py knows its own).
+    """
+    config = dict(DEFAULTS)
+    data = read_config_file()
+    config.update({k: v for k, v in data.items() if k in DEFAULTS})
+    if task:
+        tuned = (data.get("tasks") or {}).get(task) or {}
+        config.update({k: v for k, v in tuned.items() if k in TASK_KEYS})
+    for key in DEFAULTS:
+        if key != "cpu_affinity" and config[key] is not None:
+            config[key] = _positive_int(config[key], f"{key} in {config_path()}", DEFAULTS[key])
+
+    for key, env_name in ENV_OVERRIDES.items():
+        value = os.environ.get(env_name)
+        if value:
+            # A bad override keeps the configured (or default) value instead of stopping every script
+            config[key] = value if key == "cpu_affinity" else _positive_int(value, env_name, config[key])
+
+    try:
+        config["cpu_affinity"] = parse_cpu_list(config["cpu_affinity"])
+    except (TypeError, ValueError) as e:
+        print(f"Warning: ignoring invalid CPU affinity {config['cpu_affinity']!r}: {e}", file=sys.stderr)
+        config["cpu_affinity"] = None
+    if workers:
+        config["workers"] = workers
+    if not config["intra_op_threads"]:
+        config["intra_op_threads"] = max(1, physical_cores(config["cpu_affinity"]) // max(1, int(config["workers"])))
+    return config
+
+def available_cores():
+    """Cores this process is allowed to run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def physical_cores(cores=None):
+    """Physical cores among cores (default: the available ones); hyperthread siblings count once"""
+    cores = cores or available_cores()
+    seen = set()
+    for core in cores:
+        topology = f"/sys/devices/system/cpu/cpu{core}/topology"
+        try:
+            with open(os.path.join(topology, "physical_package_id"), encoding="ascii") as f:
+                package = f.read().strip()
+            with open(os.path.join(topology, "core_id"), encoding="ascii") as f:
+                seen.add((package, f.read().strip()))
+        except OSError:
+            # No sysfs topology (macOS, Windows, some containers): count logical cores
+            return len(cores)
+    return len(seen) or len(cores)
+
+def split_cores(num_workers, cores=None):
+    """Partition cores (default: all available) into one contiguous slice per worker"""
+    cores = cores or available_cores()
+    per_worker = max(1, len(cores) // num_workers)
+    slices = []
+    for worker in range(num_workers):
+        start = (worker * per_worker) % len(cores)
+        slices.append(cores[start:start + per_worker])
+    return slices
+
+def apply_thread_settings(config=None, cores=None, threads=None, task=None):
+    """Pin this process and size torch's thread pools.
+
+    Explicit cores/threads (used for per-worker slices) win over the config,
+    which is loaded for task when not given. Returns the settings that were
+    actually applied.
+    """
+    config = config or load_runtime_config(task)
+    cores = cores or config["cpu_affinity"]
+    applied = {"cpu_affinity": None, "intra_op_threads": None, "inter_op_threads": None}
+
+    if cores and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, cores)
+            applied["cpu_affinity"] = list(cores)
+        except OSError as e:
+            print(f"Warning: could not set CPU affinity {cores}: {e}", file=sys.stderr)
+
+    try:
+        import torch
+    except ImportError:
+        return applied
+
+    intra = threads or config["intra_op_threads"] or (len(cores) if cores else None)
+    if intra:
+        torch.set_num_threads(int(intra))
+        applied["intra_op_threads"] = int(intra)
+    if config["inter_op_threads"]:
+        try:
+            torch.set_num_interop_threads(int(config["inter_op_threads"]))
+            applied["inter_op_threads"] = int(config["inter_op_threads"])
+        except RuntimeError as e:
+            # Only settable before the first inter-op parallel work in this process
+            print(f"Warning: could not set inter-op threads: {e}", file=sys.stderr)
+    return applied
+
+def save_runtime_config(config, path=None):
+    path = path or config_path()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+    return path
+
+def _median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+
+def benchmark_tone(classifier, threads, batch_size, repeats):
+    """Median per-batch latency and throughput of analyze_batch_with_ai at one setting"""
+    import torch
+    import tone_analyzer
+
+    torch.set_num_threads(threads)
+    texts = (SAMPLE_TEXTS * (batch_size // len(SAMPLE_TEXTS) + 1))[:batch_size]
+    tone_analyzer.analyze_batch_with_ai(texts, classifier, batch_size)  # warm-up
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        tone_analyzer.analyze_batch_with_ai(texts, classifier, batch_size)
+        latencies.append(time.perf_counter() - start)
+    latency = _median(latencies)
+    return {"threads": threads, "batch_size": batch_size,
+            "batch_latency_ms": round(latency * 1000, 1),
+            "throughput_per_s": round(batch_size / latency, 2)}
+
+def benchmark_summarize(summarizer_pipeline, threads, repeats):
+    """Median single-email summarization latency at one thread count"""
+    import torch
+    import summarizer
+
+    torch.set_num_threads(threads)
+    text = SAMPLE_TEXTS[3]
+    summarizer.summarize_text_bart(text, summarizer_pipeline)  # warm-up
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        summarizer.summarize_text_bart(text, summarizer_pipeline)
+        latencies.append(time.perf_counter() - start)
+    latency = _median(latencies)
+    return {"threads": threads, "batch_size": 1,
+            "batch_latency_ms": round(latency * 1000, 1),
+            "throughput_per_s": round(1 / latency, 2)}
+
+def autotune(task, batch_sizes, thread_counts, repeats=3):
+    """Benchmark every batch size x thread count and pick the best configuration.
+
+    The thread count is chosen by single-email latency (what a notification
+    waits on); the batch size by throughput at that thread count (what a
+    backfill cares about).
+    """
+    results = []
+    if task == "summarize":
+        import summarizer
+        summarizer_pipeline = summarizer.load_summarizer_pipeline()
+        for threads in thread_counts:
+            results.append(benchmark_summarize(summarizer_pipeline, threads, repeats))
+            print(f"threads={threads}: {results[-1]}", file=sys.stderr)
+        best_threads = min(results, key=lambda r: r["batch_latency_ms"])["threads"]
+        return {"intra_op_threads": best_threads}, results
+
+    import tone_analyzer
+    classifier = tone_analyzer.load_ai_classifier()
+    if classifier is None:
+        raise RuntimeError("AI classifier unavailable; cannot autotune")
+    for threads in thread_counts:
+        for batch_size in sorted(set(batch_sizes) | {1}):
+            results.append(benchmark_tone(classifier, threads, batch_size, repeats))
+            print(f"threads={threads} batch={batch_size}: {results[-1]}", file=sys.stderr)
+
+    single = [r for r in results if r["batch_size"] == 1]
+    best_threads = min(single, key=lambda r: r["batch_latency_ms"])["threads"]
+    at_best = [r for r in results if r["threads"] == best_threads and r["batch_size"] in batch_sizes]
+    best_batch = max(at_best or single, key=lambda r: r["throughput_per_s"])["batch_size"]
+    return {"intra_op_threads": best_threads, "batch_size": best_batch}, results
+
+def _int_list(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or auto-tune torch thread settings")
+    sub = parser.add_subparsers(dest="command", required=True)
+    show = sub.add_parser("show", help="print the effective configuration")
+    show.add_argument("--task", choices=TASKS, default=None, help="include the values tuned for this task")
+    tune = sub.add_parser("autotune", help="benchmark batch sizes x thread counts and save the best")
+    tune.add_argument("--task", choices=TASKS, default="tone")
+    tune.add_argument("--batch-sizes", type=_int_list, default=[1, 2, 4, 8, 16])
+    tune.add_argument("--threads", type=_int_list, default=None,
+                      help="thread counts to try (default: powers of two up to the core count)")
+    tune.add_argument("--repeats", type=int, default=3)
+    tune.add_argument("--output", default=None, help="config file to write (default: %(default)s)")
+    tune.add_argument("--dry-run", action="store_true", help="report without writing the config")
+    args = parser.parse_args()
+
+    if args.command == "show":
+        print(json.dumps({"path": config_path(), **load_runtime_config(args.task)}, indent=2))
+        return
+
+    threads = args.threads
+    if not threads:
+        cores = len(available_cores())
+        threads = sorted({2 ** i for i in range(cores.bit_length()) if 2 ** i <= cores} | {cores})
+
+    best, results = autotune(args.task, args.batch_sizes, threads, args.repeats)
+    # Tone and summarization tune to different thread counts, so each keeps its own
+    config = read_config_file(args.output)
+    config.setdefault("tasks", {})[args.task] = best
+    report = {"task": args.task, "best": best, "results": results}
+    if not args.dry_run:
+        report["written_to"] = save_runtime_config(config, args.output)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+sender_priors.py - per-sender urgency priors that stand in for the tone model
+
+CI systems, shipping notices and marketing lists produce the same urgency for
+every message. Each model result is counted per urgency, label and context label
+under two keys: the sender address, and the sender plus its subject template
+(subject with numbers, links and ID-like tokens normalized, so "Build #812
+failed" and "Build #813 failed" share a template). Counts live in one uint32
+matrix with a row per key, halved when a row's history grows long or when the
+model contradicts it, so old behaviour fades.
+
+When a key has at least MIN_OBSERVATIONS results and its top urgency and label
+each cover at least MIN_CONSISTENCY of them, the prior answers instead of the
+model. A SAMPLE_RATE share of those messages, and every message after
+MAX_SERVED prior answers in a row, still go to the model so the prior keeps
+being checked. Only model results feed the counts; prior answers never do.
+
+The matrix is saved to an .npz file (WHISPRMAIL_PRIORS_PATH, default
+~/.whisprmail/sender_priors.npz) with an atomic replace; concurrent writers keep
+whichever copy lands last. Enable with --priors on backfill.py, or --sender with
+--priors (or WHISPRMAIL_PRIORS=1) on tone_analyzer.py.
+"""
+
+import sys
+import os
+import random
+import email.utils
+
+import numpy as np
+
+import tone_analyzer
+from near_duplicates import normalized_words
+
+DEFAULT_PRIORS_PATH = os.path.join(os.path.expanduser("~"), ".whisprmail", "sender_priors.npz")
+MIN_OBSERVATIONS = 5
+MIN_CONSISTENCY = 0.9
+SAMPLE_RATE = 0.1
+MAX_SERVED = 20
+# Rows are halved past this many results so a sender's recent behaviour dominates
+MAX_HISTORY = 200
+
+URGENCIES = ("low", "medium", "high")
+LABELS = ("NEUTRAL", "NEGATIVE", "POSITIVE")
+CONTEXTS = tuple(tone_analyzer.CONTEXT_LABELS)
+COLUMNS = URGENCIES + LABELS + CONTEXTS
+_URGENCY = slice(0, len(URGENCIES))
+_LABEL = slice(len(URGENCIES), len(URGENCIES) + len(LABELS))
+_CONTEXT = slice(len(URGENCIES) + len(LABELS), len(COLUMNS))
+_COLUMN_INDEX = {name: i for i, name in enumerate(COLUMNS)}
+
+def priors_path(path=None):
+    return path or os.environ.get("WHISPRMAIL_PRIORS_PATH", DEFAULT_PRIORS_PATH)
+
+def prior_keys(sender, subject=None):
+    """Most specific first: sender + subject template, then sender alone"""
+    address = (email.utils.parseaddr(sender or "")[1] or sender or "").strip().lower()
+    if not address:
+        return []
+    template = " ".join(normalized_words(subject or ""))
+    return [f"{address}\t{template}", address] if template else [address]
+
+class SenderPriors:
+    """Array-backed urgency/label/context counts per sender and sender template"""
+
+    def __init__(self, model=None, path=None):
+        self.path = priors_path(path)
+        self.model = model or tone_analyzer.TONE_MODEL_NAME
+        self.keys = []
+        self.rows = {}
+        self.counts = np.zeros((64, len(COLUMNS)), dtype=np.uint32)
+        self.score_sums = np.zeros(64, dtype=np.float64)
+        self.served = np.zeros(64, dtype=np.uint16)
+
+    @classmethod
+    def load(cls, model=None, path=None):
+        """Priors from disk, or empty ones when the file is missing, unreadable or from another model"""
+        priors = cls(model, path)
+        if not os.path.exists(priors.path):
+            return priors
+        try:
+            with np.load(priors.path, allow_pickle=False) as data:
+                if str(data["model"]) != priors.model or tuple(data["columns"]) != COLUMNS:
+                    print("Sender priors were built for another model or label set, starting over",
+                          file=sys.stderr)
+                    return priors
+                priors.keys = [str(key) for key in data["keys"]]
+                priors.counts = data["counts"].astype(np.uint32)
+                priors.score_sums = data["score_sums"].astype(np.float64)
+                priors.served = data["served"].astype(np.uint16)
+        except (OSError, KeyError, ValueError) as e:
+            print(f"Could not read sender priors: {e}", file=sys.stderr)
+            return cls(model, path)
+        priors.rows = {key: row for row, key in enumerate(priors.keys)}
+        return priors
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        n = len(self.keys)
+        temp_path = f"{self.path}.{os.getpid()}.tmp.npz"
+        np.savez(temp_path, model=np.array(self.model), columns=np.array(COLUMNS),
+                 keys=np.array(self.keys, dtype=str), counts=self.counts[:n],
+                 score_sums=self.score_sums[:n], served=self.served[:n])
+        os.replace(temp_path, self.path)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _row(self, key):
+        row = self.rows.get(key)
+        if row is not None:
+            return row
+        row = len(self.keys)
+        if row == len(self.counts):
+            # Double the capacity so appends stay amortized O(1)
+            self.counts = np.concatenate([self.counts, np.zeros_like(self.counts)])
+            self.score_sums = np.concatenate([self.score_sums, np.zeros_like(self.score_sums)])
+            self.served = np.concatenate([self.served, np.zeros_like(self.served)])
+        self.keys.append(key)
+        self.rows[key] = row
+        return row
+
+    def predict(self, keys):
+        """The first key's consistent history as a prediction dict, or None"""
+        for key in keys:
+            row = self.rows.get(key)
+            if row is None:
+                continue
+            counts = self.counts[row]
+            total = int(counts[_URGENCY].sum())
+            if total < MIN_OBSERVATIONS:
+                continue
+            urgency = int(counts[_URGENCY].argmax())
+            label = int(counts[_LABEL].argmax())
+            consistency = min(counts[_URGENCY][urgency], counts[_LABEL][label]) / total
+            if consistency < MIN_CONSISTENCY:
+                continue
+            return {
+                "key": key, "row": row, "observations": total, "consistency": float(consistency),
+                "urgency": URGENCIES[urgency], "label": LABELS[label],
+                "context_type": CONTEXTS[int(counts[_CONTEXT].argmax())],
+                "score": float(self.score_sums[row] / total)
+            }
+        return None
+
+    def decide(self, keys):
+        """A prediction to serve instead of running the model, or None (no prior, or sampled for checking)"""
+        prediction = self.predict(keys)
+        if prediction is None:
+            return None
+        row = prediction["row"]
+        if self.served[row] >= MAX_SERVED or random.random() < SAMPLE_RATE:
+            return None
+        self.served[row] += 1
+        return prediction
+
+    def observe(self, keys, result):
+        """Count one model result under every key"""
+        if not result.get("success") or result.get("analysis_source") != self.model or "reused_from" in result:
+            return
+        columns = [_COLUMN_INDEX.get(result.get("urgency")), _COLUMN_INDEX.get(result.get("label")),
+                   _COLUMN_INDEX.get(result.get("context_type"))]
+        if columns[0] is None or columns[1] is None:
+            return
+        for key in keys:
+            row = self._row(key)
+            counts = self.counts[row]
+            total = int(counts[_URGENCY].sum())
+            contradicted = total >= MIN_OBSERVATIONS and URGENCIES[int(counts[_URGENCY].argmax())] != result["urgency"]
+            if contradicted or total >= MAX_HISTORY:
+                counts >>= 1
+                self.score_sums[row] *= counts[_URGENCY].sum() / total
+            for column in columns:
+                if column is not None:
+                    counts[column] += 1
+            self.score_sums[row] += float(result.get("score") or 0.0)
+            self.served[row] = 0
+
+def prior_result(text, prediction):
+    """A tone_analyzer-shaped result answered from a sender prior"""
+    label = prediction["label"]
+    key_type = "sender and subject template" if "\t" in prediction["key"] else "sender"
+    return {
+        "success": True,
+        "label": label,
+        "score": round(prediction["score"], 4),
+        "urgency": prediction["urgency"],
+        "reason": (f"Sender prior: {prediction['consistency']:.0%} of the last {prediction['observations']} "
+                   f"analyzed messages from this {key_type} were {prediction['urgency']} urgency"),
+        "primary_emotion_detected": label.lower(),
+        "all_emotions_detected": [label.lower()],
+        "device_used": "sender_prior",
+        "analysis_source": "sender_prior",
+        "context_type": prediction["context_type"],
+        "text_length": len(text),
+        "prior": {"key": key_type, "observations": prediction["observations"],
+                  "consistency": round(prediction["consistency"], 3)}
+    }
+
+def analyze_with_priors(priors, senders, subjects, texts, analyze):
+    """Results for texts in order, calling analyze(list_of_texts) only for texts the priors cannot answer"""
+    keys = [prior_keys(sender, subject) for sender, subject in zip(senders, subjects)]
+    results = [None] * len(texts)
+    todo = []
+    for i, text in enumerate(texts):
+        prediction = priors.decide(keys[i]) if keys[i] else None
+        if prediction is not None:
+            results[i] = prior_result(text, prediction)
+        else:
+            todo.append(i)
+    if todo:
+        for i, result in zip(todo, analyze([texts[i] for i in todo])):
+            results[i] = result
+            priors.observe(keys[i], result)
+    return results
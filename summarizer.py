@@ -1,56 +1,337 @@
 import sys
+import os
 import json
-from transformers import pipeline, AutoModelForSeq2SeqLM, AutoTokenizer
+import time
+import argparse
+import runtime_config
+import profiling
+import language_id
 
-def summarize_text_bart(text_to_summarize):
+_import_started = time.perf_counter()
+# transformers pulls in torch and tokenizers anyway; importing them first splits the cost per module
+IMPORT_BREAKDOWN = profiling.timed_imports(("torch", "tokenizers"))
+_transformers_started = time.perf_counter()
+from transformers import pipeline, AutoConfig, AutoModelForSeq2SeqLM, AutoTokenizer, TextStreamer
+IMPORT_BREAKDOWN["transformers"] = time.perf_counter() - _transformers_started
+# Reported as import_ms when a CLI run asks for timings
+IMPORT_SECONDS = time.perf_counter() - _import_started
+
+# Overridable so the scripts can be pointed at a local or smaller checkpoint
+SUMMARY_MODEL_NAME = os.environ.get("WHISPRMAIL_SUMMARY_MODEL", "facebook/bart-large-cnn")
+
+def load_summarizer_model(model_name=None):
+    """Load the summarization tokenizer and model (SUMMARY_MODEL_NAME unless model_name is given)"""
+    # It's good practice to specify the tokenizer as well
+    tokenizer = AutoTokenizer.from_pretrained(model_name or SUMMARY_MODEL_NAME)
+    model = AutoModelForSeq2SeqLM.from_pretrained(model_name or SUMMARY_MODEL_NAME)
+    return tokenizer, model
+
+def load_summarizer_pipeline(model_name=None):
+    """Build the summarization pipeline so long-lived workers can load it once"""
+    tokenizer, model = load_summarizer_model(model_name)
+    return pipeline(
+        "summarization",
+        model=model,
+        tokenizer=tokenizer
+    )
+
+def summarize_text_bart(text_to_summarize, summarizer=None, timings=None, model_name=None):
     try:
-        # It's good practice to specify the tokenizer as well
-        tokenizer = AutoTokenizer.from_pretrained("facebook/bart-large-cnn")
-        model = AutoModelForSeq2SeqLM.from_pretrained("facebook/bart-large-cnn")
-        summarizer = pipeline(
-            "summarization",
-            model=model,
-            tokenizer=tokenizer
-        )
-
-        summary_list = summarizer(
-            text_to_summarize,
-            max_length=80,    # Changed
-            min_length=20,    # Changed
-            do_sample=False,
-            no_repeat_ngram_size=3,
-            length_penalty=1.0, # Changed
-            num_beams=4,
-            truncation=True # Ensure text is truncated if too long for the model
-        )
+        if summarizer is None:
+            with profiling.stage(timings, "load"):
+                summarizer = load_summarizer_pipeline(model_name)
+
+        with profiling.instrument_pipeline(summarizer, timings, forward_stage="generate"):
+            summary_list = summarizer(
+                text_to_summarize,
+                max_length=80,    # Changed
+                min_length=20,    # Changed
+                do_sample=False,
+                no_repeat_ngram_size=3,
+                length_penalty=1.0, # Changed
+                num_beams=4,
+                truncation=True # Ensure text is truncated if too long for the model
+            )
         if summary_list and isinstance(summary_list, list) and 'summary_text' in summary_list[0]:
-            return {"success": True, "summary_text": summary_list[0]['summary_text']}
+            result = {"success": True, "summary_text": summary_list[0]['summary_text']}
         else:
             # More specific error or empty string if summary is malformed
             print("Warning: Summarizer output was not as expected.", file=sys.stderr)
-            return {"success": False, "error": "Could not extract summary from model output."}
+            result = {"success": False, "error": "Could not extract summary from model output."}
 
     except Exception as e:
         # Log the exception to stderr for debugging on the server/runner side
         print(f"Error during summarization pipeline: {str(e)}", file=sys.stderr)
         # Return an error message that can be captured by main.js
-        return {"success": False, "error": f"Error in Python script (summarizer.py): {str(e)}"}
+        result = {"success": False, "error": f"Error in Python script (summarizer.py): {str(e)}"}
+
+    if timings:
+        result["timings"] = timings.as_dict()
+    return result
+
+class _EventStreamer(TextStreamer):
+    """TextStreamer that hands each finalized chunk of words to a callback"""
+
+    def __init__(self, tokenizer, on_text):
+        # skip_prompt drops the decoder start token generate() pushes first
+        super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        self.on_text = on_text
+
+    def on_finalized_text(self, text, stream_end=False):
+        if text:
+            self.on_text(text)
+
+def summarize_text_bart_stream(text_to_summarize, emit, summarizer=None, timings=None, model_name=None):
+    """Greedy summarization that calls emit() with JSON-ready events as words are generated.
+
+    Beam search cannot stream (the best hypothesis is only known at the end), so this
+    mode trades a little summary quality for showing the first words almost immediately.
+    """
+    start = time.perf_counter()
+    first_token_at = None
+    chunks = []
+
+    def on_text(text):
+        nonlocal first_token_at
+        now = time.perf_counter()
+        if first_token_at is None:
+            first_token_at = now
+        chunks.append(text)
+        emit({"event": "token", "text": text, "elapsed_ms": round((now - start) * 1000, 1)})
+
+    try:
+        if summarizer is not None:
+            tokenizer, model = summarizer.tokenizer, summarizer.model
+        else:
+            with profiling.stage(timings, "load"):
+                tokenizer, model = load_summarizer_model(model_name)
+        load_ms = (time.perf_counter() - start) * 1000
+
+        with profiling.stage(timings, "tokenize"):
+            inputs = tokenizer(text_to_summarize, truncation=True, return_tensors="pt")
+        profiling.note_tensors("tokenizer_output", inputs)
+        with profiling.stage(timings, "generate"), profiling.trace_generation_steps(model):
+            output_ids = model.generate(
+                **inputs,
+                max_length=80,
+                min_length=20,
+                do_sample=False,
+                no_repeat_ngram_size=3,
+                num_beams=1,
+                streamer=_EventStreamer(tokenizer, on_text)
+            )
+        total_ms = (time.perf_counter() - start) * 1000
+        profiling.note_tensors("model_output", {"output_ids": output_ids})
+        summary_text = "".join(chunks).strip()
+        if not summary_text:
+            print("Warning: Streaming summarizer produced no text.", file=sys.stderr)
+            return {"event": "done", "success": False, "error": "Could not extract summary from model output."}
+
+        result = {
+            "event": "done",
+            "success": True,
+            "summary_text": summary_text,
+            "load_ms": round(load_ms, 1),
+            "time_to_first_token_ms": round((first_token_at - start) * 1000, 1),
+            "total_ms": round(total_ms, 1),
+            "tokens_out": int(output_ids.shape[-1])
+        }
+        if timings:
+            timings.count("tokens_in", inputs["input_ids"].shape[-1])
+            timings.count("tokens_out", output_ids.shape[-1])
+            result["timings"] = timings.as_dict()
+        return result
+
+    except Exception as e:
+        print(f"Error during streaming summarization: {str(e)}", file=sys.stderr)
+        return {"event": "done", "success": False, "error": f"Error in Python script (summarizer.py): {str(e)}"}
+
+def profile_startup():
+    """Time each cold-start phase of the summarizer separately instead of summarizing input"""
+    started = profiling.process_started()
+    timer = profiling.StageTimer(started=started if started is not None else _import_started)
+    if started is not None:
+        timer.add("interpreter_start", profiling.MODULE_LOADED - started)
+    for module, seconds in IMPORT_BREAKDOWN.items():
+        timer.add(f"import_{module}", seconds)
+    with timer.stage("thread_settings"):
+        runtime_config.apply_thread_settings(task="summarize")
+
+    with timer.stage("resolve_model"):
+        config = AutoConfig.from_pretrained(SUMMARY_MODEL_NAME)
+    with timer.stage("load_tokenizer"):
+        tokenizer = AutoTokenizer.from_pretrained(SUMMARY_MODEL_NAME)
+    with timer.stage("load_weights"):
+        model = AutoModelForSeq2SeqLM.from_pretrained(SUMMARY_MODEL_NAME, config=config)
+    with timer.stage("build_pipeline"):
+        summarizer = pipeline("summarization", model=model, tokenizer=tokenizer)
+    with timer.stage("warmup"):
+        summarize_text_bart(runtime_config.SAMPLE_TEXTS[1], summarizer)
+    timings = timer.as_dict()
+
+    # A second call shows how much of the warm-up was one-off cost
+    start = time.perf_counter()
+    summarize_text_bart(runtime_config.SAMPLE_TEXTS[1], summarizer)
+    timings["steady_inference_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    return {"success": True, "profile": "startup", "model": SUMMARY_MODEL_NAME, "timings": timings}
+
+def emit_json_line(event):
+    """Write one JSON-lines event and flush so the reader sees it immediately"""
+    with profiling.span("serialize"):
+        line = json.dumps(event)
+    sys.stdout.write(line + "\n")
+    sys.stdout.flush()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize email text with BART")
+    parser.add_argument("--stream", action="store_true",
+                        help="emit partial summary text as JSON-lines events while generating")
+    parser.add_argument("--timings", action="store_true",
+                        help="add a per-stage timings object to the result (or set WHISPRMAIL_TIMINGS=1)")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="write a Chrome trace of this run to FILE (or set WHISPRMAIL_TRACE=FILE)")
+    parser.add_argument("--memory-profile", action="store_true",
+                        help="add RSS and per-stage memory figures to the result (or set WHISPRMAIL_MEMORY_PROFILE=1)")
+    parser.add_argument("--tracemalloc", type=int, default=0, metavar="N",
+                        help="with memory profiling, also list the top N Python allocation sites")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="report the time spent in each cold-start phase as JSON instead of summarizing text")
+    parser.add_argument("--reuse", action="store_true",
+                        help="return a stored summary of a near-identical text instead of generating one "
+                             "(or set WHISPRMAIL_REUSE=1)")
+    parser.add_argument("--html", action="store_true",
+                        help="the input is an HTML body; summarize its visible text (see html_text.py)")
+    parser.add_argument("--json", action="store_true",
+                        help='stdin is {"text": ..., "html": ..., "attachments": ..., "message_id": ..., '
+                             '"sender": ..., "subject": ..., "date": ...}; the visible text of html and then the '
+                             'attachment text are summarized after text')
+    parser.add_argument("--store", nargs="?", const="", default=None, metavar="PATH",
+                        help="record the summary in the analysis store when the --json input has a message_id "
+                             "(default path: WHISPRMAIL_STORE or ~/.whisprmail/analysis.db)")
+    parser.add_argument("text", nargs="*", help="text to summarize when nothing is piped on stdin")
+    args = parser.parse_args()
+    if args.profile_startup:
+        print(json.dumps(profile_startup()))
+        sys.exit(0)
+
+    trace_path = profiling.trace_path_requested(args.trace)
+    if trace_path:
+        profiling.enable_tracing(trace_path, started=_import_started)
+        profiling.record_span("import", _import_started, _import_started + IMPORT_SECONDS, module="transformers")
+    memory = None
+    if profiling.memory_profile_requested(args.memory_profile or args.tracemalloc > 0):
+        memory = profiling.enable_memory_profiling(args.tracemalloc)
+
     input_text = ""
+    payload = None
     # Check if input is piped or from arguments
     if not sys.stdin.isatty(): # Check if data is being piped
-        input_text = sys.stdin.read()
-    elif len(sys.argv) > 1: # Check for command line arguments
-        input_text = sys.argv[1]
+        with profiling.span("read stdin"):
+            input_text = sys.stdin.read()
+    elif args.text: # Check for command line arguments
+        input_text = " ".join(args.text)
+    if args.json and input_text.strip():
+        import attachment_text
+        try:
+            payload = json.loads(input_text)
+            if not isinstance(payload, dict):
+                raise ValueError("expected a JSON object")
+        except ValueError as e:
+            error_output = {"success": False, "error": f"Invalid JSON input: {e}"}
+            if args.stream:
+                error_output = {"event": "done", **error_output}
+            print(json.dumps(error_output))
+            sys.exit(0)
+        with profiling.span("extract html"):
+            input_text = attachment_text.combined_text(str(payload.get("text") or ""), payload.get("html"),
+                                                       payload.get("attachments"))
+    elif args.html and input_text:
+        import html_text
+        with profiling.span("extract html"):
+            input_text = html_text.html_to_text(input_text)
+    profiling.note_size("input_text", sys.getsizeof(input_text))
     # else: input_text remains empty if no piped data and no command-line arguments
 
     if not input_text.strip(): # Check if input_text is empty or whitespace
         error_output = {"success": False, "error": "No input text provided to summarizer.py or input was empty."}
+        if args.stream:
+            error_output = {"event": "done", **error_output}
         print(json.dumps(error_output))
         sys.exit(0) # Changed from sys.exit(1)
 
-    summary_result = summarize_text_bart(input_text)
+    # English goes to SUMMARY_MODEL_NAME; other languages to their routed model, or are not summarized
+    with profiling.span("detect language"):
+        language = language_id.detect(input_text)
+    model_name = language_id.route("summarize", language, SUMMARY_MODEL_NAME)
+    if model_name == language_id.RULES:
+        skipped = {"success": False, "skipped": True, "language": language,
+                   "error": f"No summarization model is routed for language '{language}'."}
+        if args.stream:
+            skipped = {"event": "done", **skipped}
+        print(json.dumps(skipped))
+        sys.exit(0)
+
+    reuse = None
+    if args.reuse or os.environ.get("WHISPRMAIL_REUSE", "").lower() in ("1", "true", "yes"):
+        import near_duplicates
+        reuse = near_duplicates.open_index()
+
+    # Size torch's thread pool before the model spins it up
+    with profiling.span("apply thread settings"):
+        runtime_config.apply_thread_settings(task="summarize")
+
+    timings = None
+    if profiling.timings_requested(args.timings):
+        timings = profiling.StageTimer(started=_import_started)
+        timings.add("import", IMPORT_SECONDS)
+
+    def record(result):
+        if args.store is None or not payload or not payload.get("message_id") or not result.get("success"):
+            return
+        import sqlite3
+        # A store that cannot be written must not cost the finished summary
+        try:
+            import analysis_store
+            with profiling.span("record analysis"):
+                analysis_store.record_once(args.store, payload["message_id"], payload.get("sender"),
+                                           payload.get("subject"), payload.get("date"),
+                                           summary=result.get("summary_text"),
+                                           summary_model=result.get("analysis_source") or model_name)
+        except (ImportError, sqlite3.Error, OSError) as e:
+            print(f"Could not record analysis: {e}", file=sys.stderr)
+
+    if args.stream:
+        # Every line is a standalone JSON object; the last one has "event": "done"
+        if reuse is not None:
+            # A reused summary arrives as a single done event with no token events before it
+            done_event = {"event": "done", **near_duplicates.reuse_or_run(
+                reuse, "summarize", model_name, input_text,
+                lambda text: summarize_text_bart_stream(text, emit_json_line, timings=timings,
+                                                        model_name=model_name))}
+        else:
+            done_event = summarize_text_bart_stream(input_text, emit_json_line, timings=timings,
+                                                    model_name=model_name)
+        done_event["language"] = language
+        record(done_event)
+        if memory:
+            done_event["memory"] = memory.as_dict()
+        emit_json_line(done_event)
+        sys.exit(0)
+
+    if reuse is not None:
+        summary_result = near_duplicates.reuse_or_run(
+            reuse, "summarize", model_name, input_text,
+            lambda text: summarize_text_bart(text, timings=timings, model_name=model_name))
+    else:
+        summary_result = summarize_text_bart(input_text, timings=timings, model_name=model_name)
+    if model_name != SUMMARY_MODEL_NAME and summary_result.get("success"):
+        summary_result["analysis_source"] = model_name
+    summary_result["language"] = language
+    record(summary_result)
     # summarize_text_bart now returns a dictionary with the success flag.
-    print(json.dumps(summary_result))
+    if memory:
+        summary_result["memory"] = memory.as_dict()
+    with profiling.span("serialize"):
+        output = json.dumps(summary_result)
+    print(output)
     sys.exit(0) # Ensure exit with 0 after printing result
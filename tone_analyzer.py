@@ -7,18 +7,30 @@ Maintains exact same interface as original but uses Hugging Face AI
 import sys
 import json
 import os
+import re
+import time
+import argparse
 
-def load_ai_classifier():
-    """Load the AI model with proper error handling"""
+import runtime_config
+import profiling
+import language_id
+
+# Overridable so the scripts can be pointed at a local or smaller checkpoint
+TONE_MODEL_NAME = os.environ.get("WHISPRMAIL_TONE_MODEL", "facebook/bart-large-mnli")
+
+def load_ai_classifier(timings=None, model_name=None):
+    """Load the AI model (TONE_MODEL_NAME unless model_name is given) with proper error handling"""
     try:
-        from transformers import pipeline
+        with profiling.stage(timings, "import"):
+            from transformers import pipeline
         print("Loading AI model... (this may take a moment on first run)", file=sys.stderr)
         
-        classifier = pipeline(
-            "zero-shot-classification",
-            model="facebook/bart-large-mnli",
-            device=-1  # CPU
-        )
+        with profiling.stage(timings, "load"):
+            classifier = pipeline(
+                "zero-shot-classification",
+                model=model_name or TONE_MODEL_NAME,
+                device=-1  # CPU
+            )
         print("Device set to use cpu", file=sys.stderr)
         return classifier
     except ImportError:
@@ -28,112 +40,275 @@ def load_ai_classifier():
         print(f"Error loading AI model: {e}", file=sys.stderr)
         return None
 
-def analyze_with_ai(text, classifier):
+URGENCY_LABELS = [
+    "urgent and requires immediate action",
+    "important but not urgent", 
+    "normal routine communication",
+    "not important or spam"
+]
+
+CONTEXT_LABELS = [
+    "emergency or crisis situation",
+    "business deadline or time-sensitive",
+    "personal urgent request",
+    "angry or frustrated communication",
+    "positive or thankful communication",
+    "casual conversation",
+    "marketing or promotional content"
+]
+
+def analyze_with_ai(text, classifier, timings=None):
     """Analyze text with AI and return in original format"""
-    urgency_labels = [
-        "urgent and requires immediate action",
-        "important but not urgent", 
-        "normal routine communication",
-        "not important or spam"
-    ]
-    
-    context_labels = [
-        "emergency or crisis situation",
-        "business deadline or time-sensitive",
-        "personal urgent request",
-        "angry or frustrated communication",
-        "positive or thankful communication",
-        "casual conversation",
-        "marketing or promotional content"
-    ]
-    
     try:
-        # Primary urgency classification
-        urgency_result = classifier(text, urgency_labels)
-        context_result = classifier(text, context_labels)
-        
-        top_urgency = urgency_result['labels'][0]
-        urgency_score = urgency_result['scores'][0]
-        top_context = context_result['labels'][0]
-        context_score = context_result['scores'][0]
-        
-        # Map to original format
-        if "urgent and requires immediate action" in top_urgency and urgency_score > 0.6:
+        with profiling.instrument_pipeline(classifier, timings):
+            # Primary urgency classification
+            with profiling.span("classify", labels="urgency"):
+                urgency_result = classifier(text, URGENCY_LABELS)
+            with profiling.span("classify", labels="context"):
+                context_result = classifier(text, CONTEXT_LABELS)
+        result = build_ai_result(text, urgency_result, context_result)
+    except Exception as e:
+        result = ai_error_result(e)
+    if timings:
+        result["timings"] = timings.as_dict()
+    return result
+
+def analyze_batch_with_ai(texts, classifier, batch_size=8, timings=None):
+    """Analyze many texts with batched forward passes; results keep the input order"""
+    if not texts:
+        return []
+    try:
+        with profiling.instrument_pipeline(classifier, timings):
+            with profiling.span("classify", labels="urgency", texts=len(texts)):
+                urgency_results = classifier(texts, URGENCY_LABELS, batch_size=batch_size)
+            with profiling.span("classify", labels="context", texts=len(texts)):
+                context_results = classifier(texts, CONTEXT_LABELS, batch_size=batch_size)
+        # A single input comes back as a dict rather than a list
+        if isinstance(urgency_results, dict):
+            urgency_results, context_results = [urgency_results], [context_results]
+        return [build_ai_result(text, urgency_result, context_result)
+                for text, urgency_result, context_result in zip(texts, urgency_results, context_results)]
+    except Exception as e:
+        return [ai_error_result(e) for _ in texts]
+
+def build_ai_result(text, urgency_result, context_result):
+    """Map zero-shot urgency and context predictions to the original output format"""
+    top_urgency = urgency_result['labels'][0]
+    urgency_score = urgency_result['scores'][0]
+    top_context = context_result['labels'][0]
+    context_score = context_result['scores'][0]
+    
+    # Map to original format
+    if "urgent and requires immediate action" in top_urgency and urgency_score > 0.6:
+        urgency_level = "high"
+        sentiment = "NEGATIVE"  # Urgent usually means problems
+    elif "important but not urgent" in top_urgency and urgency_score > 0.5:
+        urgency_level = "medium"
+        sentiment = "NEUTRAL"
+    elif "emergency" in top_context or "deadline" in top_context:
+        if context_score > 0.6:
             urgency_level = "high"
-            sentiment = "NEGATIVE"  # Urgent usually means problems
-        elif "important but not urgent" in top_urgency and urgency_score > 0.5:
+            sentiment = "NEGATIVE"
+        else:
             urgency_level = "medium"
             sentiment = "NEUTRAL"
-        elif "emergency" in top_context or "deadline" in top_context:
-            if context_score > 0.6:
-                urgency_level = "high"
-                sentiment = "NEGATIVE"
-            else:
-                urgency_level = "medium"
-                sentiment = "NEUTRAL"
-        elif "angry" in top_context or "frustrated" in top_context:
+    elif "angry" in top_context or "frustrated" in top_context:
+        urgency_level = "medium"
+        sentiment = "NEGATIVE"
+    elif "positive" in top_context or "thankful" in top_context:
+        urgency_level = "low"
+        sentiment = "POSITIVE"
+    elif "marketing" in top_context or "not important" in top_urgency:
+        urgency_level = "low"
+        sentiment = "NEUTRAL"
+    else:
+        # Default based on confidence
+        if urgency_score > 0.7:
             urgency_level = "medium"
-            sentiment = "NEGATIVE"
-        elif "positive" in top_context or "thankful" in top_context:
-            urgency_level = "low"
-            sentiment = "POSITIVE"
-        elif "marketing" in top_context or "not important" in top_urgency:
-            urgency_level = "low"
             sentiment = "NEUTRAL"
         else:
-            # Default based on confidence
-            if urgency_score > 0.7:
-                urgency_level = "medium"
-                sentiment = "NEUTRAL"
-            else:
-                urgency_level = "low"
-                sentiment = "NEUTRAL"
-        
-        return {
-            "success": True,
-            "label": sentiment,
-            "score": float(urgency_score),
-            "urgency": urgency_level,
-            "reason": f"AI: '{top_urgency}' ({urgency_score:.1%}), Context: '{top_context}' ({context_score:.1%})",
-            "primary_emotion_detected": sentiment.lower(),
-            "all_emotions_detected": [sentiment.lower()],
-            "device_used": "ai_huggingface",
-            "analysis_source": "facebook/bart-large-mnli",
-            "context_type": top_context,
-            "text_length": len(text)
-        }
-        
-    except Exception as e:
-        return {
-            "success": False,
-            "error": f"AI analysis failed: {str(e)}",
-            "label": "NEUTRAL",
-            "score": 0.5,
-            "urgency": "low",
-            "reason": f"AI Error: {str(e)}",
-            "primary_emotion_detected": "neutral",
-            "all_emotions_detected": ["neutral"],
-            "device_used": "ai_error",
-            "analysis_source": "error"
-        }
+            urgency_level = "low"
+            sentiment = "NEUTRAL"
+    
+    return {
+        "success": True,
+        "label": sentiment,
+        "score": float(urgency_score),
+        "urgency": urgency_level,
+        "reason": f"AI: '{top_urgency}' ({urgency_score:.1%}), Context: '{top_context}' ({context_score:.1%})",
+        "primary_emotion_detected": sentiment.lower(),
+        "all_emotions_detected": [sentiment.lower()],
+        "device_used": "ai_huggingface",
+        "analysis_source": TONE_MODEL_NAME,
+        "context_type": top_context,
+        "text_length": len(text)
+    }
+
+def ai_error_result(e):
+    """Result returned when the AI pipeline raises"""
+    return {
+        "success": False,
+        "error": f"AI analysis failed: {str(e)}",
+        "label": "NEUTRAL",
+        "score": 0.5,
+        "urgency": "low",
+        "reason": f"AI Error: {str(e)}",
+        "primary_emotion_detected": "neutral",
+        "all_emotions_detected": ["neutral"],
+        "device_used": "ai_error",
+        "analysis_source": "error"
+    }
+
+# Weighted keyword lexicons for the rules tier. A JSON file of the same shape named by
+# WHISPRMAIL_LEXICON replaces any category it defines.
+DEFAULT_LEXICON = {
+    "urgent": {"urgent": 1, "urgently": 1, "emergency": 1, "asap": 1, "immediately": 1,
+               "critical": 1, "help": 1, "!!!": 2},
+    "negative": {"problem": 1, "problems": 1, "error": 1, "errors": 1, "failed": 1, "failure": 1,
+                 "wrong": 1, "angry": 1, "upset": 1},
+    "positive": {"thanks": 1, "thank you": 1, "great": 1, "good": 1, "excellent": 1, "love": 1}
+}
+LEXICON_CATEGORIES = ("urgent", "negative", "positive")
 
-def fallback_analysis(text):
+def load_lexicon(path=None):
+    """DEFAULT_LEXICON with any categories from the JSON file at path (or WHISPRMAIL_LEXICON)"""
+    lexicon = {category: dict(terms) for category, terms in DEFAULT_LEXICON.items()}
+    path = path or os.environ.get("WHISPRMAIL_LEXICON")
+    if path:
+        try:
+            with open(path, encoding="utf-8") as f:
+                custom = json.load(f)
+            for category in LEXICON_CATEGORIES:
+                if category in custom:
+                    lexicon[category] = {term: float(weight) for term, weight in custom[category].items()}
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"Could not load lexicon {path}, using defaults: {e}", file=sys.stderr)
+    return {category: {term.lower(): weight for term, weight in terms.items()}
+            for category, terms in lexicon.items()}
+
+def _is_word_char(char):
+    return char.isalnum() or char == "_"
+
+def _escape(char):
+    # A space inside a phrase ("thank you") matches any run of whitespace, including line breaks
+    return r"\s+" if char.isspace() else re.escape(char)
+
+def _trie_pattern(terms):
+    """One alternation shaped like a trie, so the cost per text position does not grow with the lexicon"""
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[""] = None
+
+    def build(node, last_char):
+        alternatives = [_escape(char) + build(child, char) for char, child in sorted(node.items()) if char]
+        if "" in node:
+            # Terms ending in a word character must not match inside a longer word ("help" in "helpful")
+            alternatives.append(r"(?!\w)" if _is_word_char(last_char) else "")
+        return alternatives[0] if len(alternatives) == 1 else "(?:" + "|".join(alternatives) + ")"
+
+    # Every branch starts with a literal so re can skip to candidate characters in C; the
+    # start-of-word check comes after the first character for the same reason
+    roots = [_escape(char) + (r"(?<!\w.)" if _is_word_char(char) else "") + build(child, char)
+             for char, child in sorted(trie.items())]
+    return "|".join(roots) if roots else "(?!)"
+
+def build_matcher(lexicon):
+    """Compiled pattern over every (lowercased) lexicon term plus term -> [(category, weight)]"""
+    term_weights = {}
+    for category, terms in lexicon.items():
+        for term, weight in terms.items():
+            term_weights.setdefault(term, []).append((category, weight))
+    return re.compile(_trie_pattern(term_weights)), term_weights
+
+# Built once at import; every fallback call is then a single pass over the text
+LEXICON = load_lexicon()
+LEXICON_PATTERN, TERM_WEIGHTS = build_matcher(LEXICON)
+# Batch path: one column per lexicon term
+TERM_INDEX = {term: i for i, term in enumerate(TERM_WEIGHTS)}
+_weight_matrix = None
+
+def use_lexicon(lexicon):
+    """Rebuild the single and batch matchers around lexicon (a load_lexicon()-shaped dict)"""
+    global LEXICON, LEXICON_PATTERN, TERM_WEIGHTS, TERM_INDEX, _weight_matrix
+    LEXICON = {category: {term.lower(): weight for term, weight in terms.items()}
+               for category, terms in lexicon.items()}
+    LEXICON_PATTERN, TERM_WEIGHTS = build_matcher(LEXICON)
+    TERM_INDEX = {term: i for i, term in enumerate(TERM_WEIGHTS)}
+    _weight_matrix = None
+
+def score_keywords(text):
+    """Weighted urgent/negative/positive scores; each distinct term counts once per text"""
+    scores = dict.fromkeys(LEXICON_CATEGORIES, 0.0)
+    # Lowering once is cheaper than re.IGNORECASE on every comparison
+    for term in {" ".join(match.split()) for match in LEXICON_PATTERN.findall(text.lower())}:
+        for category, weight in TERM_WEIGHTS.get(term, ()):
+            scores[category] += weight
+    return scores
+
+def fallback_analysis(text, timings=None):
     """Simple fallback if AI fails"""
-    text_lower = text.lower()
-    
-    # Simple urgency detection
-    urgent_words = ['urgent', 'emergency', 'asap', 'immediately', 'critical', 'help', '!!!']
-    urgent_count = sum(1 for word in urgent_words if word in text_lower)
-    
-    # Simple sentiment
-    negative_words = ['problem', 'error', 'failed', 'wrong', 'angry', 'upset']
-    positive_words = ['thanks', 'great', 'good', 'excellent', 'love']
-    
-    neg_count = sum(1 for word in negative_words if word in text_lower)
-    pos_count = sum(1 for word in positive_words if word in text_lower)
-    
-    # Determine urgency
-    if urgent_count >= 2 or '!!!' in text:
+    with profiling.stage(timings, "rules"):
+        scores = score_keywords(text)
+    return rules_result(text, scores["urgent"], scores["negative"], scores["positive"], timings)
+
+def _term_hits(lowered):
+    """(positions, term columns) of every lexicon hit in a lowered string.
+
+    The same trie pattern as score_keywords, so overlapping and nested terms resolve the
+    same way (leftmost, longest, non-overlapping) on both paths.
+    """
+    positions, columns = [], []
+    for match in LEXICON_PATTERN.finditer(lowered):
+        positions.append(match.start())
+        columns.append(TERM_INDEX[" ".join(match.group().split())])
+    return positions, columns
+
+def batch_keyword_scores(texts):
+    """(len(texts), 3) array of urgent/negative/positive scores via a sparse term matrix product"""
+    import numpy as np
+    from scipy import sparse
+    global _weight_matrix
+
+    if _weight_matrix is None:
+        _weight_matrix = np.zeros((len(TERM_INDEX), len(LEXICON_CATEGORIES)))
+        for term, entries in TERM_WEIGHTS.items():
+            for category, weight in entries:
+                _weight_matrix[TERM_INDEX[term], LEXICON_CATEGORIES.index(category)] += weight
+
+    lowered = [text.lower() for text in texts]
+    # NUL is not a word character, so no term or word boundary reaches across two texts
+    starts = np.cumsum([0] + [len(text) + 1 for text in lowered[:-1]])
+    positions, columns = _term_hits("\x00".join(lowered))
+    rows = np.searchsorted(starts, positions, side="right") - 1
+
+    # texts x terms, 1 where the term occurs: duplicates are summed on construction and then
+    # clamped so a term counts once per text, as in fallback_analysis
+    terms = sparse.csr_matrix((np.ones(len(rows)), (rows, columns)), shape=(len(texts), len(TERM_INDEX)))
+    terms.data[:] = 1.0
+    return terms @ _weight_matrix
+
+def fallback_analysis_batch(texts, timings=None):
+    """fallback_analysis for many texts at once; same per-text dicts, in input order.
+
+    Needs numpy and scipy for the vectorized path and loops over fallback_analysis without them.
+    """
+    if not texts:
+        return []
+    try:
+        with profiling.stage(timings, "rules"):
+            scores = batch_keyword_scores(texts).tolist()
+    except ImportError:
+        return [fallback_analysis(text) for text in texts]
+    return [rules_result(text, urgent, negative, positive)
+            for text, (urgent, negative, positive) in zip(texts, scores)]
+
+def rules_result(text, urgent_count, neg_count, pos_count, timings=None):
+    """Map lexicon scores to the original fallback output format"""
+    # Determine urgency ("!!!" carries weight 2 in the default lexicon, enough for high on its own)
+    if urgent_count >= 2:
         urgency = "high"
     elif urgent_count >= 1:
         urgency = "medium"
@@ -151,28 +326,223 @@ def fallback_analysis(text):
         sentiment = "NEUTRAL"
         score = 0.5
     
-    return {
+    result = {
         "success": True,
         "label": sentiment,
         "score": score,
         "urgency": urgency,
-        "reason": f"Fallback analysis: {urgent_count} urgent words, {neg_count} negative, {pos_count} positive",
+        "reason": f"Fallback analysis: {urgent_count:g} urgent words, {neg_count:g} negative, {pos_count:g} positive",
         "primary_emotion_detected": sentiment.lower(),
         "all_emotions_detected": [sentiment.lower()],
         "device_used": "cpu_fallback",
         "analysis_source": "simple_rules",
         "text_length": len(text)
     }
+    if timings:
+        result["timings"] = timings.as_dict()
+    return result
+
+# Headers that identify newsletters, campaigns and other automated bulk mail on their own.
+# Bump HEADER_RULES_VERSION when the rules change so backfills re-analyze under them.
+BULK_HEADERS = ("List-Unsubscribe", "List-Id", "Precedence", "Auto-Submitted", "X-Mailer")
+BULK_PRECEDENCE = ("bulk", "list", "junk")
+BULK_MAILERS = re.compile(
+    r"mailchimp|sendgrid|sendinblue|brevo|campaign ?monitor|createsend|mailerlite|mailjet|hubspot|"
+    r"klaviyo|constant ?contact|exacttarget|marketo|mautic|salesforce marketing", re.IGNORECASE)
+HEADER_RULES_VERSION = 1
+
+def header_map(headers):
+    """{lowercased name: value} from a {name: value} dict or a Gmail-style [{"name", "value"}] list"""
+    if not headers:
+        return {}
+    if isinstance(headers, dict):
+        items = headers.items()
+    else:
+        items = ((h.get("name"), h.get("value")) for h in headers if isinstance(h, dict))
+    return {str(name).lower(): str(value or "") for name, value in items if name}
+
+def bulk_mail_signals(headers):
+    """The header evidence that this is bulk or automated mail, as readable strings"""
+    found = header_map(headers)
+    signals = [name for name in ("List-Unsubscribe", "List-Id") if name.lower() in found]
+    precedence = found.get("precedence", "").strip().lower()
+    if precedence in BULK_PRECEDENCE:
+        signals.append(f"Precedence: {precedence}")
+    auto_submitted = found.get("auto-submitted", "").strip().lower()
+    if auto_submitted and auto_submitted != "no":
+        signals.append(f"Auto-Submitted: {auto_submitted}")
+    mailer = found.get("x-mailer", "")
+    if BULK_MAILERS.search(mailer):
+        signals.append(f"X-Mailer: {mailer.strip()[:40]}")
+    return signals
+
+def header_precheck(text, headers, timings=None):
+    """Low-urgency promotional result for mail its headers mark as bulk, or None to run the model"""
+    if not headers:
+        return None
+    with profiling.stage(timings, "headers"):
+        signals = bulk_mail_signals(headers)
+        # Alerts sent through list software still go to the model when the text itself sounds urgent
+        if not signals or score_keywords(text)["urgent"] > 0:
+            return None
+    result = {
+        "success": True,
+        "label": "NEUTRAL",
+        "score": 0.9,
+        "urgency": "low",
+        "reason": f"Bulk mail headers: {', '.join(signals)}",
+        "primary_emotion_detected": "neutral",
+        "all_emotions_detected": ["neutral"],
+        "device_used": "header_rules",
+        "analysis_source": "header_rules",
+        "context_type": "marketing or promotional content",
+        "text_length": len(text)
+    }
+    if timings:
+        result["timings"] = timings.as_dict()
+    return result
+
+def profile_startup():
+    """Time each cold-start phase of the AI path separately instead of analyzing input"""
+    started = profiling.process_started()
+    timer = profiling.StageTimer(started=started)
+    if started is not None:
+        timer.add("interpreter_start", profiling.MODULE_LOADED - started)
+    # torch and tokenizers first so that transformers' own time excludes them
+    for module, seconds in profiling.timed_imports(("torch", "tokenizers")).items():
+        timer.add(f"import_{module}", seconds)
+    with timer.stage("import_transformers"):
+        # transformers resolves these names lazily, so the pipeline machinery loads here
+        from transformers import AutoConfig, AutoTokenizer, AutoModelForSequenceClassification, pipeline
+    with timer.stage("thread_settings"):
+        runtime_config.apply_thread_settings(task="tone")
+
+    with timer.stage("resolve_model"):
+        config = AutoConfig.from_pretrained(TONE_MODEL_NAME)
+    with timer.stage("load_tokenizer"):
+        tokenizer = AutoTokenizer.from_pretrained(TONE_MODEL_NAME)
+    with timer.stage("load_weights"):
+        model = AutoModelForSequenceClassification.from_pretrained(TONE_MODEL_NAME, config=config)
+    with timer.stage("build_pipeline"):
+        classifier = pipeline("zero-shot-classification", model=model, tokenizer=tokenizer, device=-1)
+    with timer.stage("warmup"):
+        analyze_with_ai(runtime_config.SAMPLE_TEXTS[0], classifier)
+    timings = timer.as_dict()
+
+    # A second call shows how much of the warm-up was one-off cost
+    start = time.perf_counter()
+    analyze_with_ai(runtime_config.SAMPLE_TEXTS[0], classifier)
+    timings["steady_inference_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    return {"success": True, "profile": "startup", "model": TONE_MODEL_NAME, "timings": timings}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Detect urgency and tone of email text")
+    parser.add_argument("--timings", action="store_true",
+                        help="add a per-stage timings object to the result (or set WHISPRMAIL_TIMINGS=1)")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="write a Chrome trace of this run to FILE (or set WHISPRMAIL_TRACE=FILE)")
+    parser.add_argument("--memory-profile", action="store_true",
+                        help="add RSS and per-stage memory figures to the result (or set WHISPRMAIL_MEMORY_PROFILE=1)")
+    parser.add_argument("--tracemalloc", type=int, default=0, metavar="N",
+                        help="with memory profiling, also list the top N Python allocation sites")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="report the time spent in each cold-start phase as JSON instead of analyzing text")
+    parser.add_argument("--reuse", action="store_true",
+                        help="return a stored result for a near-identical text instead of running the model "
+                             "(or set WHISPRMAIL_REUSE=1)")
+    parser.add_argument("--json", action="store_true",
+                        help='stdin is {"text": ..., "html": ..., "attachments": ..., "headers": {...}, '
+                             '"sender": ..., "message_id": ..., "subject": ..., "date": ...}; bulk-mail headers '
+                             'are labelled without the model, html is reduced to text and appended, then '
+                             'attachment text (see attachment_text.py)')
+    parser.add_argument("--html", action="store_true",
+                        help="the input is an HTML body; analyze its visible text (see html_text.py)")
+    parser.add_argument("--sender", help="sender address, used to answer from the sender's history with --priors")
+    parser.add_argument("--priors", action="store_true",
+                        help="answer from the sender's consistent history instead of running the model "
+                             "(or set WHISPRMAIL_PRIORS=1)")
+    parser.add_argument("--store", nargs="?", const="", default=None, metavar="PATH",
+                        help="record the result in the analysis store when the --json input has a message_id "
+                             "(default path: WHISPRMAIL_STORE or ~/.whisprmail/analysis.db)")
+    parser.add_argument("text", nargs="*", help="text to analyze when nothing is piped on stdin")
+    return parser.parse_args(argv)
+
+def analyze_text(input_text, timings=None, model=None):
+    """Model analysis of one text, or the rules when routed there or the model cannot be loaded"""
+    model = model or TONE_MODEL_NAME
+    if model == language_id.RULES:
+        return fallback_analysis(input_text, timings)
+
+    # Size torch's thread pool before the model spins it up (this imports torch)
+    with profiling.stage(timings, "import"):
+        runtime_config.apply_thread_settings(task="tone")
+
+    # Try AI analysis first
+    classifier = load_ai_classifier(timings, model)
+    if classifier:
+        result = analyze_with_ai(input_text, classifier, timings)
+        if result.get("success") and model != TONE_MODEL_NAME:
+            result["analysis_source"] = model
+        return result
+    # Fall back to simple rules
+    print("AI unavailable, using fallback analysis", file=sys.stderr)
+    return fallback_analysis(input_text, timings)
 
 def main():
     """Main function - maintains original interface"""
+    args = parse_args()
+    if args.profile_startup:
+        print(json.dumps(profile_startup()))
+        sys.exit(0)
+    timings = profiling.StageTimer() if profiling.timings_requested(args.timings) else None
+    trace_path = profiling.trace_path_requested(args.trace)
+    if trace_path:
+        profiling.enable_tracing(trace_path)
+    memory = None
+    if profiling.memory_profile_requested(args.memory_profile or args.tracemalloc > 0):
+        memory = profiling.enable_memory_profiling(args.tracemalloc)
     try:
         # Get input text
         input_text = ""
         if not sys.stdin.isatty():
-            input_text = sys.stdin.read().strip()
-        elif len(sys.argv) > 1:
-            input_text = " ".join(sys.argv[1:]).strip()
+            with profiling.span("read stdin"):
+                input_text = sys.stdin.read().strip()
+        elif args.text:
+            input_text = " ".join(args.text).strip()
+        headers, sender, payload = None, args.sender, {}
+        if args.json and input_text:
+            try:
+                payload = json.loads(input_text)
+                if not isinstance(payload, dict):
+                    raise ValueError("expected a JSON object")
+            except ValueError as e:
+                result = {
+                    "success": False,
+                    "error": f"Invalid JSON input: {e}",
+                    "label": "NEUTRAL",
+                    "score": 0.0,
+                    "urgency": "low",
+                    "reason": "Invalid input",
+                    "primary_emotion_detected": "neutral",
+                    "all_emotions_detected": [],
+                    "device_used": "none",
+                    "analysis_source": "invalid_input"
+                }
+                print(json.dumps(result))
+                sys.exit(0)
+            input_text = str(payload.get("text") or "").strip()
+            headers = payload.get("headers")
+            sender = payload.get("sender") or sender
+            if payload.get("html") or payload.get("attachments"):
+                import attachment_text
+                with profiling.span("extract html"):
+                    input_text = attachment_text.combined_text(input_text, payload.get("html"),
+                                                               payload.get("attachments"))
+        elif args.html and input_text:
+            import html_text
+            with profiling.span("extract html"):
+                input_text = html_text.html_to_text(input_text)
+        profiling.note_size("input_text", sys.getsizeof(input_text))
         
         if not input_text:
             result = {
@@ -190,17 +560,56 @@ def main():
             print(json.dumps(result))
             sys.exit(0)
         
-        # Try AI analysis first
-        classifier = load_ai_classifier()
-        if classifier:
-            result = analyze_with_ai(input_text, classifier)
-        else:
-            # Fall back to simple rules
-            print("AI unavailable, using fallback analysis", file=sys.stderr)
-            result = fallback_analysis(input_text)
+        reuse = None
+        if args.reuse or os.environ.get("WHISPRMAIL_REUSE", "").lower() in ("1", "true", "yes"):
+            import near_duplicates
+            reuse = near_duplicates.open_index()
+
+        # English goes to TONE_MODEL_NAME; other languages to their routed model or the rules
+        with profiling.span("detect language"):
+            language = language_id.detect(input_text)
+        model = language_id.route("tone", language, TONE_MODEL_NAME)
+
+        def run(text):
+            if reuse is not None and model != language_id.RULES:
+                # A near-identical text analyzed before skips loading the model altogether
+                return near_duplicates.reuse_or_run(
+                    reuse, "tone", model, text, lambda text: analyze_text(text, timings, model))
+            return analyze_text(text, timings, model)
+
+        # Bulk mail recognized by its headers needs neither the priors nor the model
+        result = header_precheck(input_text, headers, timings)
+        priors_enabled = args.priors or os.environ.get("WHISPRMAIL_PRIORS", "").lower() in ("1", "true", "yes")
+        # Priors hold the default model's answers, so other languages neither read nor update them
+        if result is None and sender and priors_enabled and model == TONE_MODEL_NAME:
+            import sender_priors
+            priors = sender_priors.SenderPriors.load()
+            # main.js sends "subject\n\nbody" (or the subject alone, with the body as html)
+            subject = payload.get("subject") or input_text.split("\n", 1)[0]
+            result = sender_priors.analyze_with_priors(
+                priors, [sender], [subject], [input_text], lambda texts: [run(texts[0])])[0]
+            priors.save()
+        elif result is None:
+            result = run(input_text)
+        result["language"] = language
+        if args.store is not None and payload.get("message_id") and result.get("success"):
+            import sqlite3
+            # A store that cannot be written must not cost the finished analysis
+            try:
+                import analysis_store
+                with profiling.span("record analysis"):
+                    analysis_store.record_once(args.store, payload["message_id"], sender, payload.get("subject"),
+                                               payload.get("date"), tone=result)
+            except (ImportError, sqlite3.Error, OSError) as e:
+                print(f"Could not record analysis: {e}", file=sys.stderr)
         
+        if memory:
+            result["memory"] = memory.as_dict()
+
         # Output result
-        print(json.dumps(result))
+        with profiling.span("serialize"):
+            output = json.dumps(result)
+        print(output)
         sys.exit(0)
         
     except KeyboardInterrupt:
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+tone_pool.py - data-parallel batch tone analysis for mailbox backfills
+
+A single small-batch BART forward does not scale past a few cores, so large
+batches are split across processes instead: the model parameters are moved to
+shared memory once, every worker pins its own slice of CPU cores with a matching
+torch thread count, and the inputs are sharded so each worker gets roughly the
+same number of characters to process.
+
+Input (stdin or --input): one JSON string or {"text": ...} object per line
+Output: one tone_analyzer.py result per line, in input order
+"""
+
+import sys
+import json
+import heapq
+import queue
+import argparse
+
+import tone_analyzer
+import runtime_config
+
+def shard_by_length(texts, num_shards):
+    """Split text indices into num_shards groups with near-equal total length.
+
+    Longest-first greedy assignment to the currently lightest shard keeps the
+    slowest worker within one email of the average.
+    """
+    num_shards = max(1, min(num_shards, len(texts)))
+    heap = [(0, shard) for shard in range(num_shards)]
+    shards = [[] for _ in range(num_shards)]
+    for index in sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True):
+        load, shard = heapq.heappop(heap)
+        shards[shard].append(index)
+        heapq.heappush(heap, (load + len(texts[index]), shard))
+    return [shard for shard in shards if shard]
+
+def _worker(model, tokenizer, config, cores, items, batch_size, results):
+    """Process entry point: pin cores, rebuild the pipeline around the shared model, analyze a shard"""
+    from transformers import pipeline
+
+    runtime_config.apply_thread_settings(config, cores=cores, threads=len(cores))
+
+    classifier = pipeline("zero-shot-classification", model=model, tokenizer=tokenizer, device=-1)
+    # Similar lengths in a batch means less padding per forward pass
+    items = sorted(items, key=lambda item: len(item[1]))
+    for start in range(0, len(items), batch_size):
+        chunk = items[start:start + batch_size]
+        analyzed = tone_analyzer.analyze_batch_with_ai([text for _, text in chunk], classifier, batch_size)
+        results.put([(index, result) for (index, _), result in zip(chunk, analyzed)])
+    results.put(None)
+
+def analyze_batch_parallel(texts, num_workers=None, batch_size=None, classifier=None):
+    """Analyze texts across num_workers processes that share one copy of the model weights"""
+    if not texts:
+        return []
+    config = runtime_config.load_runtime_config("tone")
+    batch_size = batch_size or config["batch_size"]
+    cores = config["cpu_affinity"] or runtime_config.available_cores()
+    if classifier is None:
+        classifier = tone_analyzer.load_ai_classifier()
+    if classifier is None:
+        print("AI unavailable, using fallback analysis", file=sys.stderr)
+        return tone_analyzer.fallback_analysis_batch(texts)
+
+    import torch.multiprocessing as mp
+
+    shards = shard_by_length(texts, num_workers or len(cores))
+    if len(shards) == 1:
+        return tone_analyzer.analyze_batch_with_ai(texts, classifier, batch_size)
+
+    # Parameters move to shared memory once; spawned workers map the same pages
+    model = classifier.model.share_memory()
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    workers = []
+    for shard, worker_cores in zip(shards, runtime_config.split_cores(len(shards), cores)):
+        items = [(index, texts[index]) for index in shard]
+        process = ctx.Process(target=_worker,
+                              args=(model, classifier.tokenizer, config, worker_cores, items, batch_size, results))
+        process.start()
+        workers.append(process)
+
+    ordered = [None] * len(texts)
+    remaining = len(workers)
+    while remaining:
+        try:
+            batch = results.get(timeout=1.0)
+        except queue.Empty:
+            if not any(process.is_alive() for process in workers):
+                break
+            continue
+        if batch is None:
+            remaining -= 1
+            continue
+        for index, result in batch:
+            ordered[index] = result
+    for process in workers:
+        process.join()
+
+    # A worker that crashed leaves holes; fill them rather than dropping emails
+    return [result if result is not None else tone_analyzer.ai_error_result("worker process failed")
+            for result in ordered]
+
+def read_texts(stream):
+    """Read one JSON string or {"text": ...} object per non-empty line"""
+    texts = []
+    for line in stream:
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        texts.append(item["text"] if isinstance(item, dict) else str(item))
+    return texts
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch tone analysis across CPU cores")
+    parser.add_argument("--input", help="JSON-lines file of texts (default: stdin)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes (default: one per available core)")
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help="texts per forward pass (default: runtime config batch_size)")
+    args = parser.parse_args()
+
+    if args.input:
+        with open(args.input, encoding="utf-8") as f:
+            texts = read_texts(f)
+    else:
+        texts = read_texts(sys.stdin)
+
+    for result in analyze_batch_parallel(texts, args.workers, args.batch_size):
+        print(json.dumps(result))
+
+if __name__ == "__main__":
+    main()
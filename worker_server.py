@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+"""
+worker_server.py - long-lived tone/summary worker for WhisprMail
+
+Loads torch/transformers and both BART models once, then answers JSON-lines
+requests over a localhost socket. In fork-server mode the warm parent forks N
+workers that share the model weights copy-on-write and respawns any worker that
+dies, so a crash costs a fork instead of a multi-second cold reload. With
+--memory-budget-mb or --idle-timeout, models are instead loaded on demand and
+evicted by model_manager.ModelManager. --metrics-port / --metrics-file expose
+request, latency, batch, cache, residency and RSS metrics in Prometheus format.
+With --store, results for requests that carry a message_id are also recorded in
+the analysis store (analysis_store.py). With --reuse, a request whose text is a
+near duplicate of one already analyzed gets that result back (near_duplicates.py).
+A request may carry a raw HTML body in "html"; its visible text (html_text.py)
+is analyzed after "text", followed by any extracted attachment text in
+"attachments" (attachment_text.py).
+
+Request:  {"id": 1, "task": "tone" | "summarize" | "status" | "ping", "text": "...",
+           "timings": false, "message_id": null, "sender": null, "subject": null, "date": null,
+           "headers": null, "html": null, "attachments": null}
+Response: the same dict tone_analyzer.py / summarizer.py would print, plus "id"
+"""
+
+import sys
+import os
+import json
+import time
+import gc
+import signal
+import socket
+import sqlite3
+import shutil
+import tempfile
+import argparse
+import functools
+
+import tone_analyzer
+import summarizer
+import runtime_config
+import profiling
+import metrics
+import analysis_store
+import near_duplicates
+import attachment_text
+import language_id
+from model_manager import ModelManager
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# A worker that dies sooner than this after being forked is treated as crash-looping
+MIN_WORKER_LIFETIME = 5.0
+# How often forked workers hand their metrics to the parent
+METRICS_SNAPSHOT_INTERVAL = 2.0
+# How often buffered analysis-store rows are committed
+STORE_FLUSH_INTERVAL = 2.0
+
+# Opened per process (SQLite connections must not cross fork) when --store / --reuse are given
+STORE = None
+REUSE = None
+
+# Per-worker metrics; in fork mode each worker ships a snapshot of these to the parent
+REQUESTS = metrics.REGISTRY.counter(
+    "whisprmail_requests_total", "Requests handled by task, analysis source and outcome",
+    ["task", "analysis_source", "status"])
+REQUEST_LATENCY = metrics.REGISTRY.histogram(
+    "whisprmail_request_duration_seconds", "Time from request decoded to result ready",
+    ["task", "model"])
+BATCH_SIZE = metrics.REGISTRY.histogram(
+    "whisprmail_batch_size", "Texts per request", ["task"], buckets=metrics.SIZE_BUCKETS)
+IN_FLIGHT = metrics.REGISTRY.gauge(
+    "whisprmail_in_flight_requests", "Requests received on an open connection and not yet answered")
+CACHE_REQUESTS = metrics.REGISTRY.counter(
+    "whisprmail_cache_requests_total", "Cache lookups by cache and result (hit or miss)",
+    ["cache", "result"])
+MODEL_RESIDENT_BYTES = metrics.REGISTRY.gauge(
+    "whisprmail_model_resident_bytes", "Parameter bytes of each resident model (0 when evicted)",
+    ["model"])
+MODEL_LOADS = metrics.REGISTRY.counter(
+    "whisprmail_model_loads_total", "Model loads, including reloads after eviction", ["model"])
+MODEL_EVICTIONS = metrics.REGISTRY.counter(
+    "whisprmail_model_evictions_total", "Model evictions by the model manager", ["model"])
+PROCESS_RSS = metrics.REGISTRY.gauge(
+    "whisprmail_process_resident_memory_bytes", "Resident set size of the worker process")
+
+# Supervisor metrics live in their own registry so forked workers do not re-export them
+SUPERVISOR = metrics.Registry()
+WORKER_RESTARTS = SUPERVISOR.counter(
+    "whisprmail_worker_restarts_total", "Workers respawned after exiting")
+ACCEPT_QUEUE = SUPERVISOR.gauge(
+    "whisprmail_accept_queue_depth", "Connections waiting to be accepted by a worker")
+
+def load_summarizer_pipeline(model_name=None):
+    print("Loading summarization model...", file=sys.stderr)
+    return summarizer.load_summarizer_pipeline(model_name)
+
+MODEL_LOADERS = {
+    "tone": tone_analyzer.load_ai_classifier,
+    "summarize": load_summarizer_pipeline
+}
+
+def create_model_manager(tasks, memory_budget_mb=None, idle_timeout=None):
+    """Model manager that can load the models the requested tasks need"""
+    loaders = {task: loader for task, loader in MODEL_LOADERS.items() if task in tasks}
+    # Models routed per language (language_id.py) are managed as "task:model"
+    defaults = {"tone": tone_analyzer.TONE_MODEL_NAME, "summarize": summarizer.SUMMARY_MODEL_NAME}
+    for task in loaders.copy():
+        for model in language_id.routed_models(task, defaults[task]):
+            loaders[f"{task}:{model}"] = functools.partial(MODEL_LOADERS[task], model_name=model)
+    return ModelManager(loaders, memory_budget_mb, idle_timeout)
+
+def load_models(models):
+    """Import torch/transformers and load every model the manager knows about"""
+    for task in models.loaders:
+        models.get(task)
+    return models
+
+def warm_up(models):
+    """Run one tiny inference per model so lazy initialisation happens in the parent"""
+    import torch
+    # Keep the parent's intra-op pool single-threaded: forking after an OpenMP
+    # parallel region can leave children with a thread pool they cannot use
+    threads = torch.get_num_threads()
+    torch.set_num_threads(1)
+    try:
+        classifier = models.get("tone")
+        if classifier:
+            tone_analyzer.analyze_with_ai("warm up", classifier)
+        summarizer_pipeline = models.get("summarize")
+        if summarizer_pipeline:
+            summarizer.summarize_text_bart("warm up", summarizer_pipeline)
+    finally:
+        torch.set_num_threads(threads)
+
+def handle_request(request, models):
+    """Dispatch one decoded request to the matching analysis function"""
+    task = request.get("task", "tone")
+
+    if task == "ping":
+        return {"success": True, "pid": os.getpid()}
+
+    if task == "status":
+        return {"success": True, "pid": os.getpid(), "models": models.stats()}
+
+    text = request.get("text") or ""
+    timings = profiling.StageTimer() if request.get("timings") else None
+    if request.get("html") or request.get("attachments"):
+        # Raw HTML bodies are reduced to their visible text, after any plain text (e.g. the subject),
+        # and extracted attachment text comes last
+        text = attachment_text.combined_text(text, request.get("html"), request.get("attachments"))
+
+    if task == "tone":
+        if not text.strip():
+            return {"success": False, "error": "No input text provided", "label": "NEUTRAL",
+                    "score": 0.0, "urgency": "low", "reason": "No input",
+                    "primary_emotion_detected": "neutral", "all_emotions_detected": [],
+                    "device_used": "none", "analysis_source": "no_input"}
+        language = language_id.detect(text)
+        result = analyze_tone(text, language, request, models, timings)
+        result["language"] = language
+        return result
+
+    if task == "summarize":
+        if not text.strip():
+            return {"success": False, "error": "No input text provided to summarizer or input was empty."}
+        language = language_id.detect(text)
+        result = summarize(text, language, request, models, timings)
+        result["language"] = language
+        return result
+
+    return {"success": False, "error": f"Unknown task: {task}"}
+
+def analyze_tone(text, language, request, models, timings):
+    """Header rules, then the model routed for language (or the rules tier), reusing near duplicates"""
+    # Bulk mail recognized by its headers never reaches the model
+    prechecked = tone_analyzer.header_precheck(text, request.get("headers"), timings)
+    if prechecked is not None:
+        return prechecked
+    model = language_id.route("tone", language, tone_analyzer.TONE_MODEL_NAME)
+    if model == language_id.RULES:
+        return tone_analyzer.fallback_analysis(text, timings)
+
+    def analyze(text):
+        with profiling.stage(timings, "load"):
+            classifier = models.get("tone" if model == tone_analyzer.TONE_MODEL_NAME else f"tone:{model}")
+        if classifier:
+            result = tone_analyzer.analyze_with_ai(text, classifier, timings)
+            if result.get("success"):
+                result["analysis_source"] = model
+            return result
+        return tone_analyzer.fallback_analysis(text, timings)
+    if REUSE is None:
+        return analyze(text)
+    return near_duplicates.reuse_or_run(REUSE, "tone", model, text, analyze, ref=request.get("message_id"))
+
+def summarize(text, language, request, models, timings):
+    """Summary from the model routed for language; languages routed to the rules are not summarized"""
+    model = language_id.route("summarize", language, summarizer.SUMMARY_MODEL_NAME)
+    if model == language_id.RULES:
+        return {"success": False, "skipped": True,
+                "error": f"No summarization model is routed for language '{language}'."}
+
+    def run(text):
+        with profiling.stage(timings, "load"):
+            summarizer_pipeline = models.get(
+                "summarize" if model == summarizer.SUMMARY_MODEL_NAME else f"summarize:{model}")
+        if not summarizer_pipeline:
+            return {"success": False, "error": "Summarization model is not loaded in this worker."}
+        result = summarizer.summarize_text_bart(text, summarizer_pipeline, timings)
+        if model != summarizer.SUMMARY_MODEL_NAME and result.get("success"):
+            result["analysis_source"] = model
+        return result
+    if REUSE is None:
+        return run(text)
+    return near_duplicates.reuse_or_run(REUSE, "summarize", model, text, run, ref=request.get("message_id"))
+
+def record_request(request, result, seconds):
+    """Update the request metrics for one answered request"""
+    task = request.get("task", "tone")
+    if task in ("ping", "status"):
+        return
+    source = result.get("analysis_source") or (summarizer.SUMMARY_MODEL_NAME if task == "summarize" else "none")
+    REQUESTS.inc(task=task, analysis_source=source, status="ok" if result.get("success") else "error")
+    if REUSE is not None and task in ("tone", "summarize"):
+        CACHE_REQUESTS.inc(cache=f"near_duplicate:{task}", result="hit" if "reused_from" in result else "miss")
+    REQUEST_LATENCY.observe(seconds, task=task, model=source)
+    BATCH_SIZE.observe(1, task=task)
+
+def open_store(path):
+    """Open this process's analysis store and flush it in the background"""
+    global STORE
+    STORE = analysis_store.AnalysisStore(path or None)
+    STORE.flush_periodically(STORE_FLUSH_INTERVAL)
+
+def open_reuse_index(path):
+    """Open this process's near-duplicate index"""
+    global REUSE
+    REUSE = near_duplicates.open_index(path or None)
+
+def record_analysis(request, result):
+    """Queue a successful tone/summary result for the analysis store"""
+    task = request.get("task", "tone")
+    if STORE is None or not request.get("message_id") or not result.get("success"):
+        return
+    if task not in ("tone", "summarize"):
+        return
+    try:
+        STORE.record(
+            request["message_id"], request.get("sender"), request.get("subject"), request.get("date"),
+            tone=result if task == "tone" else None,
+            summary=result.get("summary_text") if task == "summarize" else None,
+            summary_model=(result.get("analysis_source") if task == "summarize" else None)
+            or summarizer.SUMMARY_MODEL_NAME)
+    except (ValueError, sqlite3.Error) as e:
+        print(f"Could not record analysis: {e}", file=sys.stderr)
+
+def register_model_metrics(models):
+    """Refresh model residency, load/evict counts and RSS before every snapshot"""
+    def collect():
+        stats = models.stats()
+        for name in models.loaders:
+            resident = stats["resident"].get(name)
+            MODEL_RESIDENT_BYTES.set(int(resident["size_mb"] * 1024 * 1024) if resident else 0, model=name)
+            MODEL_LOADS.set_total(stats["loads"][name], model=name)
+            MODEL_EVICTIONS.set_total(stats["evictions"][name], model=name)
+            CACHE_REQUESTS.set_total(stats["hits"][name], cache=f"model:{name}", result="hit")
+            CACHE_REQUESTS.set_total(stats["loads"][name], cache=f"model:{name}", result="miss")
+        PROCESS_RSS.set(metrics.process_rss_bytes())
+    metrics.REGISTRY.add_collector(collect)
+
+def start_metrics_exporter(render_text, args):
+    """Expose render_text() on --metrics-port and/or rewrite it to --metrics-file"""
+    if args.metrics_port:
+        metrics.serve_http(render_text, args.host, args.metrics_port)
+        print(f"Metrics at http://{args.host}:{args.metrics_port}/metrics", file=sys.stderr)
+    if args.metrics_file:
+        metrics.write_file_periodically(render_text, args.metrics_file, args.metrics_interval)
+
+def serve_connection(conn, models):
+    """Answer newline-delimited JSON requests until the client disconnects"""
+    with conn, conn.makefile("rb") as reader, conn.makefile("wb") as writer:
+        for line in reader:
+            if not line.strip():
+                continue
+            request_id = None
+            request = {}
+            started = time.perf_counter()
+            IN_FLIGHT.inc()
+            try:
+                decoded = json.loads(line)
+                if isinstance(decoded, dict):
+                    request = decoded
+                    request_id = request.get("id")
+                    result = handle_request(request, models)
+                else:
+                    result = {"success": False, "error": "Invalid request: expected a JSON object"}
+            except Exception as e:
+                print(f"Error handling request: {e}", file=sys.stderr)
+                result = {"success": False, "error": f"Worker error: {str(e)}"}
+            finally:
+                IN_FLIGHT.dec()
+            try:
+                record_request(request, result, time.perf_counter() - started)
+                record_analysis(request, result)
+            except Exception as e:
+                # Bookkeeping must not take the worker down or cost the client its answer
+                print(f"Could not record request: {e}", file=sys.stderr)
+            result["id"] = request_id
+            writer.write((json.dumps(result) + "\n").encode("utf-8"))
+            writer.flush()
+
+def serve_forever(listener, models):
+    """Accept loop shared by every worker; the kernel hands each connection to one of them"""
+    while True:
+        try:
+            conn, _ = listener.accept()
+        except InterruptedError:
+            continue
+        try:
+            serve_connection(conn, models)
+        except (ConnectionError, OSError) as e:
+            print(f"Connection dropped: {e}", file=sys.stderr)
+
+def spawn_worker(listener, models, index, config, cores, metrics_dir=None, store_path=None, reuse_path=None):
+    """Fork one worker from the warm parent; returns the child's pid"""
+    pid = os.fork()
+    if pid:
+        return pid
+
+    # Child: default signal handling, its own core slice, then serve until killed
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    threads = min(config["intra_op_threads"] or len(cores), len(cores))
+    applied = runtime_config.apply_thread_settings(config, cores=cores, threads=threads)
+    print(f"Worker {index} ready (pid {os.getpid()}, cores {applied['cpu_affinity']}, "
+          f"threads {applied['intra_op_threads']})", file=sys.stderr)
+    # Threads do not survive fork(), so each worker runs its own idle reaper
+    # and its own metrics snapshot writer
+    models.start_idle_reaper()
+    if metrics_dir:
+        metrics.write_snapshot_periodically(
+            metrics.REGISTRY, os.path.join(metrics_dir, f"worker-{index}.json"), METRICS_SNAPSHOT_INTERVAL)
+    if store_path is not None:
+        open_store(store_path)
+    if reuse_path is not None:
+        open_reuse_index(reuse_path)
+    try:
+        serve_forever(listener, models)
+    finally:
+        os._exit(1)
+
+def run_fork_server(listener, models, num_workers, config, metrics_dir=None, store_path=None, reuse_path=None):
+    """Keep num_workers forked workers alive, respawning from the warm parent"""
+    # Move everything loaded so far out of the collector's reach so gc passes in
+    # the children do not touch (and therefore copy) the shared pages
+    gc.collect()
+    gc.freeze()
+
+    # Each worker gets its own slice of cores so they do not oversubscribe each other
+    core_slices = runtime_config.split_cores(num_workers, config["cpu_affinity"])
+
+    workers = {}  # pid -> (index, started_at)
+    for index in range(num_workers):
+        pid = spawn_worker(listener, models, index, config, core_slices[index], metrics_dir, store_path,
+                           reuse_path)
+        workers[pid] = (index, time.monotonic())
+
+    def shutdown(signum, frame):
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        if metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    while True:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        if pid not in workers:
+            continue
+        index, started_at = workers.pop(pid)
+        print(f"Worker {index} (pid {pid}) exited with status {status}, respawning", file=sys.stderr)
+        if time.monotonic() - started_at < MIN_WORKER_LIFETIME:
+            # Back off instead of fork-bombing when a worker dies on startup
+            time.sleep(1.0)
+        WORKER_RESTARTS.inc()
+        pid = spawn_worker(listener, models, index, config, core_slices[index], metrics_dir, store_path,
+                           reuse_path)
+        workers[pid] = (index, time.monotonic())
+
+def request_worker(payload, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=100.0):
+    """Send one request to a running worker server and return the decoded response"""
+    with socket.create_connection((host, port), timeout=timeout) as conn:
+        conn.sendall((json.dumps(payload) + "\n").encode("utf-8"))
+        with conn.makefile("rb") as reader:
+            return json.loads(reader.readline())
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve WhisprMail tone/summary requests from warm models")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=2,
+                        help="number of forked workers; 0 serves from the loading process itself")
+    parser.add_argument("--tasks", default="tone,summarize",
+                        help="comma-separated models to preload (tone, summarize)")
+    parser.add_argument("--no-warmup", action="store_true",
+                        help="skip the warm-up inference in the parent before forking")
+    parser.add_argument("--memory-budget-mb", type=float, default=None,
+                        help="evict the least-recently-used model when resident models exceed this")
+    parser.add_argument("--idle-timeout", type=float, default=None,
+                        help="evict a model after this many seconds without requests")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve Prometheus metrics on this localhost port")
+    parser.add_argument("--metrics-file", default=None,
+                        help="periodically rewrite Prometheus metrics to this file")
+    parser.add_argument("--metrics-interval", type=float, default=15.0,
+                        help="seconds between --metrics-file rewrites")
+    parser.add_argument("--store", nargs="?", const="", default=None,
+                        help="record results for requests with a message_id in the analysis store "
+                             "(default path: WHISPRMAIL_STORE or ~/.whisprmail/analysis.db)")
+    parser.add_argument("--reuse", nargs="?", const="", default=None,
+                        help="answer near-duplicate texts from stored results (default path: "
+                             "WHISPRMAIL_REUSE_DB or ~/.whisprmail/near_duplicates.db)")
+    args = parser.parse_args()
+
+    # Each worker's default thread count is its share of the physical cores
+    config = runtime_config.load_runtime_config(workers=max(1, args.workers))
+    runtime_config.apply_thread_settings(config)
+
+    tasks = {t.strip() for t in args.tasks.split(",") if t.strip()}
+    models = create_model_manager(tasks, args.memory_budget_mb, args.idle_timeout)
+    if args.memory_budget_mb or args.idle_timeout:
+        # Weights preloaded in the parent stay mapped there, so evicting them in a
+        # worker would free nothing; managed residency loads on demand instead
+        print("Managed model residency: loading models on demand", file=sys.stderr)
+    else:
+        load_models(models)
+        if not args.no_warmup:
+            warm_up(models)
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((args.host, args.port))
+    listener.listen(64)
+    print(f"Listening on {args.host}:{args.port}", file=sys.stderr)
+
+    register_model_metrics(models)
+    SUPERVISOR.add_collector(lambda: ACCEPT_QUEUE.set(metrics.listen_queue_depth(args.port) or 0))
+    metrics_enabled = bool(args.metrics_port or args.metrics_file)
+    fork_mode = args.workers > 0 and hasattr(os, "fork")
+
+    if fork_mode:
+        metrics_dir = tempfile.mkdtemp(prefix="whisprmail-metrics-") if metrics_enabled else None
+        if metrics_enabled:
+            start_metrics_exporter(lambda: metrics.render(
+                [({}, SUPERVISOR.snapshot())] + metrics.read_snapshots(metrics_dir)), args)
+        run_fork_server(listener, models, args.workers, config, metrics_dir, args.store, args.reuse)
+    else:
+        if args.workers > 0:
+            print("fork() is not available on this platform, serving in-process", file=sys.stderr)
+        if metrics_enabled:
+            start_metrics_exporter(lambda: metrics.render(
+                [({}, SUPERVISOR.snapshot()), ({}, metrics.REGISTRY.snapshot())]), args)
+        models.start_idle_reaper()
+        if args.store is not None:
+            open_store(args.store)
+        if args.reuse is not None:
+            open_reuse_index(args.reuse)
+        serve_forever(listener, models)
+
+if __name__ == "__main__":
+    main()